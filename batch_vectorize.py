@@ -0,0 +1,97 @@
+import argparse
+import glob
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from drawing_file import DRAWING_SUFFIX
+from image_2_paths import I2P
+from path_optimizer import PathOptimizer, estimate_draw_time
+
+IMAGE_PATTERNS = ("*.png", "*.jpg", "*.jpeg", "*.JPG")
+
+
+def vectorize(job: dict) -> dict:
+    """Vectorize and order one image, save it next to its siblings and return a summary row.
+
+    Runs in a worker process, so failures come back as a row with an error instead of raising.
+    """
+    started = time.perf_counter()
+    summary = {**job, "ok": False}
+    try:
+        i2p = I2P(image_path=job["image"], drawing_area=job["drawing_area"], log=False, tracer=job["tracer"],
+                  resample=job["resample"], pen_width_mm=job["pen_width_mm"])
+        paths, travel_stats = PathOptimizer(log=False).optimize(i2p.reduced_paths)
+        i2p.save(job["output"], paths, tracer=job["tracer"], pen_width_mm=job["pen_width_mm"])
+        summary.update(ok=True, paths=len(paths), points=paths.total_points,
+                       pen_up_mm=travel_stats["pen_up_after_mm"], draw_s=estimate_draw_time(paths))
+    except Exception as e:
+        summary["error"] = repr(e)
+    summary["seconds"] = time.perf_counter() - started
+    return summary
+
+
+def make_jobs(inputs, output_dir: str, drawing_area, tracers, resamples, pen_widths) -> list:
+    files = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            files += [f for p in IMAGE_PATTERNS for f in glob.glob(os.path.join(pattern, p))]
+        else:
+            files += glob.glob(pattern)
+    sweep = list(itertools.product(tracers, resamples, pen_widths))
+    jobs = []
+    for image in sorted(set(files)):
+        for tracer, resample, pen_width in sweep:
+            # One file per image when there is nothing to sweep, otherwise the parameters go in the name
+            suffix = "" if len(sweep) == 1 else f"_{tracer}_{resample}_pen{pen_width}"
+            output = Path(output_dir) / f"{Path(image).stem}{suffix}{DRAWING_SUFFIX}"
+            jobs.append({"image": image, "output": str(output), "drawing_area": drawing_area, "tracer": tracer,
+                         "resample": resample, "pen_width_mm": pen_width})
+    return jobs
+
+
+def main(inputs, output_dir: str, workers: int, drawing_area, tracers, resamples, pen_widths):
+    jobs = make_jobs(inputs, output_dir, drawing_area, tracers, resamples, pen_widths)
+    if not jobs:
+        print(f"No images found in {' '.join(inputs)}")
+        return
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"Vectorizing {len(jobs)} jobs on {workers} processes into {output_dir}")
+
+    started = time.perf_counter()
+    rows = []
+    print(f"{'output':<48}{'paths':>7}{'points':>8}{'pen up m':>10}{'draw min':>10}{'secs':>7}")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for future in as_completed([pool.submit(vectorize, job) for job in jobs]):
+            row = future.result()
+            rows.append(row)
+            name = Path(row["output"]).name
+            if not row["ok"]:
+                print(f"{name:<48}failed: {row['error']}")
+                continue
+            print(f"{name:<48}{row['paths']:7d}{row['points']:8d}{row['pen_up_mm'] / 1000:10.1f}"
+                  f"{row['draw_s'] / 60:10.1f}{row['seconds']:7.1f}")
+
+    done = [row for row in rows if row["ok"]]
+    elapsed = time.perf_counter() - started
+    print(f"{len(done)}/{len(rows)} drawings in {elapsed:.1f}s wall, {sum(r['seconds'] for r in rows):.1f}s in workers")
+    if done:
+        print(f"Total {sum(r['paths'] for r in done)} paths, {sum(r['points'] for r in done)} points, "
+              f"{sum(r['draw_s'] for r in done) / 3600:.2f}h estimated drawing")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vectorize a directory of line art images into drawings, in parallel.")
+    parser.add_argument("inputs", nargs="+", help="Directories or glob patterns of images.")
+    parser.add_argument("--out", type=str, default="output/drawings", help="Directory for the .drawing files.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes.")
+    parser.add_argument("--area", type=float, nargs=4, default=(0, 360, 0, 500), metavar=("MIN_X", "MAX_X", "MIN_Y", "MAX_Y"),
+                        help="Drawing area in mm.")
+    parser.add_argument("--tracer", nargs="+", default=["graph"], help="Tracers to sweep.")
+    parser.add_argument("--resample", nargs="+", default=["adaptive"], help="Resample modes to sweep.")
+    parser.add_argument("--pen-width", type=float, nargs="+", default=[1.0], help="Pen widths in mm to sweep.")
+
+    args = parser.parse_args()
+    main(args.inputs, args.out, args.workers, tuple(args.area), args.tracer, args.resample, args.pen_width)
@@ -0,0 +1,53 @@
+import argparse
+import time
+
+from dobot_sim import DobotSimulator
+from image_2_paths import I2P
+from path_optimizer import PathOptimizer
+from robot import Robot
+
+
+def draw(sim: DobotSimulator, paths, motion: str, rate_hz: float, blend: int) -> dict:
+    bot = Robot(log=False, ip=sim.host, main_port=sim.dashboard_port, feedback_port=sim.feedback_port)
+    bot.blend_ratio = blend
+    before = sim.stats()["commands"]
+    start = time.monotonic()
+    res, msg = bot.process_paths(paths, rate_hz=rate_hz, motion=motion)
+    elapsed = time.monotonic() - start
+    after = sim.stats()["commands"]
+    channel = bot.command_stats()
+    bot.close_connections()
+    commands = sum(after.values()) - sum(before.values())
+    return {"ok": res, "message": msg, "draw_s": elapsed, "commands": commands,
+            "syncs": after.get("Sync", 0) - before.get("Sync", 0),
+            "commands_per_s": commands / elapsed if elapsed > 0 else 0.0,
+            "mean_rtt_ms": channel.get("mean_rtt_ms", 0.0)}
+
+
+def main(image_path: str, path_count: int, rate_hz: float, blend: int, latency: float):
+    i2p = I2P(image_path=image_path, drawing_area=(0, 360, 0, 500), log=False, resample="adaptive")
+    # The longest strokes, where per-point pacing matters more than pen moves
+    paths, _ = PathOptimizer(log=False).optimize(i2p.reduced_paths.sort_by_length(reverse=True)[:path_count])
+    print(f"{image_path}: {len(paths)} paths, {paths.total_points} points")
+
+    with DobotSimulator(reply_latency=latency) as sim:
+        servo = draw(sim, paths, "servo", rate_hz, blend)
+        blended = draw(sim, paths, "blended", rate_hz, blend)
+
+    for name, result in (("servo", servo), (f"blended CP={blend}", blended)):
+        print(f"{name:<16} {result['draw_s']:7.2f}s  {result['commands']:6d} commands  "
+              f"{result['commands_per_s']:7.1f}/s  {result['mean_rtt_ms']:7.2f}ms mean RTT  "
+              f"{result['syncs']:4d} syncs  {result['message']}")
+    print(f"Blended mode speedup: {servo['draw_s'] / blended['draw_s']:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare ServoP streaming with blended MovL strokes on a simulated controller.")
+    parser.add_argument("--image", type=str, default="output/ComfyUI_00046_.png", help="Line art image to vectorize.")
+    parser.add_argument("--paths", type=int, default=20, help="Number of paths to draw in each mode.")
+    parser.add_argument("--rate", type=float, default=30.0, help="ServoP rate in Hz for the servo mode.")
+    parser.add_argument("--blend", type=int, default=50, help="CP blending ratio for the blended mode.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated controller reply latency in seconds.")
+
+    args = parser.parse_args()
+    main(args.image, args.paths, args.rate, args.blend, args.latency)
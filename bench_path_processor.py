@@ -0,0 +1,69 @@
+import argparse
+import contextlib
+import glob
+import io
+import time
+
+import cv2 as cv
+import numpy as np
+
+from image_2_paths import extract_paths
+from path_array import PathArray
+from path_processor import PathProcessor
+
+
+def paths_match(a: PathArray, b: PathArray, tol: float = 1e-4) -> bool:
+    return np.array_equal(a.offsets, b.offsets) and np.allclose(a.points, b.points, rtol=0, atol=tol)
+
+
+def time_engine(paths, dimensions, engine: str, repeats: int):
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        pp = PathProcessor(paths, (0, 360, 0, 500), image_dimensions=dimensions,
+                           z_height_pen_down=0.65, z_height_pen_up=-20, distance_mm=3.0, engine=engine)
+        # The python engine prints diagnostics for every path, keep them out of the terminal
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = pp.process_paths()
+            best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(pattern: str, repeats: int):
+    files = sorted(glob.glob(pattern))
+    if not files:
+        print(f"No images match {pattern}")
+        return
+
+    print(f"{'image':<28}{'paths':>7}{'points':>9}{'python ms':>11}{'numpy ms':>10}{'speedup':>9}  match")
+    python_total, numpy_total = 0.0, 0.0
+    for filename in files:
+        image = cv.imread(filename, cv.IMREAD_GRAYSCALE)
+        if image is None:
+            print(f"{filename.split('/')[-1]:<28}unreadable, skipped")
+            continue
+        paths = extract_paths(image)
+        dimensions = (image.shape[1], image.shape[0])
+
+        python_time, python_result = time_engine(paths, dimensions, "python", repeats)
+        numpy_time, numpy_result = time_engine(paths, dimensions, "numpy", repeats)
+        python_total += python_time
+        numpy_total += numpy_time
+
+        match = all(paths_match(a, b) for a, b in zip(python_result, numpy_result))
+        points = sum(len(path) for path in paths)
+        print(f"{filename.split('/')[-1]:<28}{len(paths):>7}{points:>9}{python_time * 1000:>11.1f}"
+              f"{numpy_time * 1000:>10.1f}{python_time / numpy_time:>8.1f}x  {match}")
+
+    print(f"Total: python {python_total:.2f}s, numpy {numpy_total:.2f}s, "
+          f"speedup {python_total / numpy_total:.1f}x over {len(files)} images")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the PathProcessor engines on ComfyUI outputs.")
+    parser.add_argument("--images", type=str, default="output/*.png", help="Glob of line art images to process.")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per engine, the best time is reported.")
+
+    args = parser.parse_args()
+    main(args.images, args.repeats)
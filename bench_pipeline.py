@@ -0,0 +1,191 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+import cv2 as cv
+import numpy as np
+
+from drawing_file import load_drawing, save_drawing
+from image_2_paths import I2P
+from path_optimizer import PathOptimizer, estimate_draw_time, pen_up_distance
+
+DRAWING_AREA = (0, 360, 0, 500)
+# Lower is better for every metric compared against a baseline, changes smaller than the floor are noise
+COMPARED = {"wall_s": 0.005, "peak_mb": 0.5}
+
+
+def measure(work: Callable[[], object], repeats: int) -> Tuple[object, dict]:
+    """Best wall time over repeats, then one more run under tracemalloc for the peak of Python and numpy
+    allocations. Tracing slows pure Python code down, so its time and result only count with repeats=0."""
+    best, result = float("inf"), None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = work()
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        traced_result = work()
+        traced = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    if not repeats:
+        return traced_result, {"wall_s": traced, "peak_mb": peak / 1024 / 1024}
+    return result, {"wall_s": best, "peak_mb": peak / 1024 / 1024}
+
+
+def simulate_draw(paths, rate_hz: float) -> dict:
+    """Draw on dobot_sim.py, in real time, and report what the controller saw"""
+    from dobot_sim import DobotSimulator
+    from robot import Robot
+
+    with DobotSimulator() as sim:
+        bot = Robot(log=False, ip=sim.host, main_port=sim.dashboard_port, feedback_port=sim.feedback_port)
+        started = time.monotonic()
+        res, msg = bot.process_paths(paths, rate_hz=rate_hz)
+        elapsed = time.monotonic() - started
+        channel = bot.command_stats()
+        bot.close_connections()
+    return {"ok": res, "message": str(msg), "sim_draw_s": elapsed,
+            "commands_per_s": channel.get("commands_per_s", 0.0), "mean_rtt_ms": channel.get("mean_rtt_ms", 0.0)}
+
+
+def bench_image(filename: str, repeats: int, rate_hz: float, simulate: bool, scratch: str) -> dict:
+    stages = {}
+    i2p, stages["vectorize"] = measure(lambda: I2P(image_path=filename, drawing_area=DRAWING_AREA, log=False,
+                                                   resample="adaptive"), repeats)
+    # I2P's own per step split of the last timed run
+    stages["vectorize"]["steps_ms"] = {step: seconds * 1000 for step, seconds in i2p.timings.items()}
+
+    (paths, travel), stages["optimize"] = measure(lambda: PathOptimizer(log=False).optimize(i2p.reduced_paths), repeats)
+
+    drawing = os.path.join(scratch, "bench.drawing")
+    _, stages["save"] = measure(lambda: save_drawing(drawing, paths, i2p.metadata()), repeats)
+    # Walk every point so the memory map is actually read
+    _, stages["load"] = measure(lambda: float(load_drawing(drawing)[0].points.sum()), repeats)
+    os.remove(drawing)
+
+    result = {
+        "image": filename,
+        "shape": list(cv.imread(filename, cv.IMREAD_UNCHANGED).shape),
+        "working_scale": i2p.scale,
+        "stages": stages,
+        "counts": {
+            "original_paths": len(i2p.original_paths),
+            "original_points": i2p.original_paths.total_points,
+            "paths": len(paths),
+            "points": paths.total_points,
+        },
+        "pen_up_mm": {"unordered": pen_up_distance(i2p.reduced_paths), "optimized": travel["pen_up_after_mm"]},
+        "draw_s": {"estimated": estimate_draw_time(paths, rate_hz=rate_hz)},
+    }
+    if simulate:
+        draw, stages["draw"] = measure(lambda: simulate_draw(paths, rate_hz), 0)
+        result["draw_s"]["simulated"] = draw["sim_draw_s"]
+        result["robot"] = draw
+    return result
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results: List[dict], baseline: dict, threshold: float) -> int:
+    """Print per stage changes against a baseline run, returns the number of regressions beyond threshold"""
+    previous = {entry["image"]: entry for entry in baseline["results"]}
+    print(f"\nAgainst baseline {baseline['environment'].get('commit')} from {baseline['environment'].get('date')}:")
+    regressions = 0
+    for entry in results:
+        old = previous.get(entry["image"])
+        if old is None:
+            continue
+        changes = []
+        for stage, values in entry["stages"].items():
+            for metric, floor in COMPARED.items():
+                before = old["stages"].get(stage, {}).get(metric)
+                if not before or abs(values[metric] - before) < floor:
+                    continue
+                change = values[metric] / before - 1
+                if change > threshold:
+                    regressions += 1
+                changes.append(f"{stage} {metric} {change:+.0%}{' !' if change > threshold else ''}")
+        for key in ("paths", "points"):
+            if entry["counts"][key] != old["counts"][key]:
+                changes.append(f"{key} {old['counts'][key]} -> {entry['counts'][key]}")
+        print(f"  {os.path.basename(entry['image']):<28} " + (", ".join(changes) or "no change"))
+    return regressions
+
+
+def main(patterns: List[str], repeats: int, rate_hz: float, simulate: bool, out: str, baseline: str,
+         threshold: float) -> int:
+    files = sorted({f for pattern in patterns for f in glob.glob(pattern)})
+    if not files:
+        print(f"No images match {patterns}")
+        return 1
+
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    print(f"{'image':<28}{'paths':>7}{'points':>8}{'vectorize':>11}{'optimize':>10}{'peak MB':>9}"
+          f"{'pen up m':>10}{'draw s':>8}")
+    results = []
+    for filename in files:
+        try:
+            entry = bench_image(filename, repeats, rate_hz, simulate, os.path.dirname(out) or ".")
+        except ValueError as e:
+            print(f"{os.path.basename(filename):<28}skipped: {e}")
+            continue
+        results.append(entry)
+        stages, counts = entry["stages"], entry["counts"]
+        peak = max(stage["peak_mb"] for stage in stages.values())
+        draw_s = entry["draw_s"].get("simulated", entry["draw_s"]["estimated"])
+        print(f"{os.path.basename(filename):<28}{counts['paths']:>7}{counts['points']:>8}"
+              f"{stages['vectorize']['wall_s'] * 1000:>9.0f}ms{stages['optimize']['wall_s'] * 1000:>8.0f}ms"
+              f"{peak:>9.1f}{entry['pen_up_mm']['optimized'] / 1000:>10.1f}{draw_s:>8.0f}")
+
+    report = {"environment": environment(), "settings": {"repeats": repeats, "rate_hz": rate_hz,
+                                                         "simulate": simulate, "drawing_area": DRAWING_AREA},
+              "results": results}
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {out}")
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), threshold)
+        if regressions:
+            print(f"{regressions} measurements over {threshold:.0%} slower or larger than the baseline")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark vectorizing, ordering, saving and drawing the sample images.")
+    parser.add_argument("--images", type=str, nargs="+", default=["images/*.png", "output/*.png"], help="Globs of images to run.")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per stage, the best is kept.")
+    parser.add_argument("--rate", type=float, default=30.0, help="ServoP rate in Hz for the draw time.")
+    parser.add_argument("--simulate", action="store_true", help="Also draw every image on dobot_sim.py, which takes as long as the real robot.")
+    parser.add_argument("--out", type=str, default=f"output/bench/bench_{datetime.now():%Y%m%d_%H%M%S}.json", help="Where to save the results.")
+    parser.add_argument("--baseline", type=str, default=None, help="Earlier results to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown counted as a regression.")
+
+    args = parser.parse_args()
+    raise SystemExit(main(args.images, args.repeats, args.rate, args.simulate, args.out, args.baseline, args.threshold))
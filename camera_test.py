@@ -1,24 +1,22 @@
 import cv2
 
+from face_capture import FaceTracker, FrameGrabber, make_detector
 
-cap = cv2.VideoCapture(0)
-
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
 
+grabber = FrameGrabber(0)
+tracker = FaceTracker(make_detector("haar"), scale=0.5)
+sequence = 0
 
 while True:
-    ret, frame = cap.read()
-
-    # Detect faces
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+    sequence, frame = grabber.read(after=sequence)
+    if frame is None: continue
 
-    if len(faces) > 0:
-        largest_face = max(faces, key=lambda face: face[2] * face[3])
+    face = tracker.detect(frame)
 
-        x, y, w, h = largest_face
+    if face is not None:
+        x, y, w, h = face
 
-        print(w, h)
+        print(w, h, f"{grabber.stats()['fps']:.1f}fps", f"{tracker.stats()['mean_detect_ms']:.1f}ms")
 
         padding = 40
         x = max(0, x - padding)
@@ -29,4 +27,4 @@ while True:
         frame = frame[y:y+h, x:x+w]
 
     cv2.imshow('faces', frame)
-    cv2.waitKey(1) 
\ No newline at end of file
+    cv2.waitKey(1)
@@ -0,0 +1,177 @@
+import socket
+import threading
+import time
+from collections import deque
+from typing import Deque, List, Tuple, Union
+
+# Upper edges of the RTT histogram buckets in milliseconds, the last bucket is open ended
+RTT_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def configure_low_latency(con: socket.socket) -> None:
+    """Disable Nagle so small commands go out immediately, and keep idle connections alive"""
+    con.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    con.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, "TCP_QUICKACK"):
+        con.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
+
+class PendingReply:
+    """A command that has been written to the socket and is waiting for its reply"""
+    __slots__ = ("command", "sent_at", "rtt", "reply", "error", "event")
+
+    def __init__(self, command: str):
+        self.command = command
+        self.sent_at = 0.0
+        self.rtt = None
+        self.reply = None
+        self.error = None
+        self.event = threading.Event()
+
+    def wait(self, timeout: float = None) -> Tuple[bool, Union[bytes, Exception]]:
+        if not self.event.wait(timeout):
+            return False, TimeoutError(f"No reply to {self.command} after {timeout}s")
+        if self.error is not None:
+            return False, self.error
+        return True, self.reply
+
+
+class CommandChannel:
+    """Pipelined dashboard connection: commands are written without waiting for the previous reply.
+
+    The dashboard answers commands in order, each reply ending with ';'
+    (e.g. b"0,{},ServoP(1,2,3,0,0,0);"), so a background reader matches replies to the oldest
+    outstanding command. At most max_in_flight commands are outstanding, send() blocks beyond that.
+    """
+
+    def __init__(self, connection: socket.socket, max_in_flight: int = 32, timeout: float = 60.0, log: bool = True):
+        self.connection = connection
+        self.timeout = timeout
+        self.log = log
+        configure_low_latency(connection)
+
+        self.pending: Deque[PendingReply] = deque()
+        self.send_lock = threading.Lock()
+        self.window = threading.BoundedSemaphore(max_in_flight)
+        self.closed = False
+        self.error = None
+
+        self.sent = 0
+        self.replied = 0
+        self.error_replies = 0
+        self.rtt_counts = [0] * (len(RTT_BUCKETS_MS) + 1)
+        self.rtt_total = 0.0
+        self.started_at = time.monotonic()
+
+        self.reader = threading.Thread(target=self.read_loop, name="dobot-dashboard-reader", daemon=True)
+        self.reader.start()
+
+    def send(self, message: str) -> PendingReply:
+        """Write a command and return its PendingReply without waiting for the controller"""
+        if self.closed:
+            raise ConnectionError(f"Command channel closed: {self.error}")
+        if not self.window.acquire(timeout=self.timeout):
+            raise TimeoutError(f"{len(self.pending)} commands outstanding for {self.timeout}s")
+
+        pending = PendingReply(message)
+        with self.send_lock:
+            # Queue before writing so the reader can never see a reply without its command
+            self.pending.append(pending)
+            pending.sent_at = time.monotonic()
+            try:
+                self.connection.sendall(message.encode())
+            except Exception as e:
+                self.pending.pop()
+                self.window.release()
+                raise e
+            self.sent += 1
+        return pending
+
+    def request(self, message: str) -> Tuple[bool, Union[bytes, Exception]]:
+        """Send and wait, same contract as Robot.send_message"""
+        try:
+            return self.send(message).wait(self.timeout)
+        except Exception as e:
+            return False, e
+
+    def drain(self, timeout: float = None) -> bool:
+        """Wait until every outstanding command has its reply"""
+        try:
+            last = self.pending[-1]
+        except IndexError:
+            return True
+        return last.event.wait(self.timeout if timeout is None else timeout)
+
+    def read_loop(self) -> None:
+        buffer = b""
+        try:
+            while not self.closed:
+                data = self.connection.recv(4096)
+                if not data:
+                    raise ConnectionError("Dashboard connection closed by controller")
+                buffer += data
+                while b";" in buffer:
+                    reply, buffer = buffer.split(b";", 1)
+                    self.complete(reply + b";")
+        except Exception as e:
+            if not self.closed and self.log:
+                print(f"Command channel reader stopped: {e}")
+            self.fail_pending(e)
+
+    def complete(self, reply: bytes) -> None:
+        now = time.monotonic()
+        if not self.pending:
+            if self.log: print("Unexpected reply:", reply)
+            return
+        pending = self.pending.popleft()
+        pending.rtt = now - pending.sent_at
+        pending.reply = reply
+        self.replied += 1
+        if not reply.lstrip().startswith(b"0,"):
+            self.error_replies += 1
+        self.record_rtt(pending.rtt)
+        self.window.release()
+        pending.event.set()
+
+    def record_rtt(self, rtt: float) -> None:
+        rtt_ms = rtt * 1000
+        self.rtt_total += rtt
+        for i, edge in enumerate(RTT_BUCKETS_MS):
+            if rtt_ms <= edge:
+                self.rtt_counts[i] += 1
+                return
+        self.rtt_counts[-1] += 1
+
+    def fail_pending(self, error: Exception) -> None:
+        self.closed = True
+        self.error = error
+        while self.pending:
+            pending = self.pending.popleft()
+            pending.error = error
+            pending.event.set()
+
+    def rtt_histogram(self) -> List[Tuple[str, int]]:
+        labels = [f"<={edge}ms" for edge in RTT_BUCKETS_MS] + [f">{RTT_BUCKETS_MS[-1]}ms"]
+        return list(zip(labels, self.rtt_counts))
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started_at
+        return {
+            "sent": self.sent,
+            "replied": self.replied,
+            "in_flight": len(self.pending),
+            "error_replies": self.error_replies,
+            "commands_per_s": self.replied / elapsed if elapsed > 0 else 0.0,
+            "mean_rtt_ms": self.rtt_total / self.replied * 1000 if self.replied else 0.0,
+            "rtt_histogram": self.rtt_histogram(),
+        }
+
+    def close(self) -> None:
+        self.closed = True
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+        self.reader.join(timeout=1.0)
+        self.fail_pending(ConnectionError("Command channel closed"))
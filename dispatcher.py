@@ -0,0 +1,439 @@
+import argparse
+import queue
+import threading
+import time
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from metrics import METRICS
+from path_array import PathArray, as_path_array
+from path_optimizer import DrawTimeModel, PathOptimizer
+from robot import Robot
+
+
+def parse_address(address: str) -> dict:
+    """"ip[:port[:feedback_port[:user]]]" to the Robot keyword arguments of one arm"""
+    parts = address.split(":")
+    arm = {"ip": parts[0]}
+    for key, value in zip(("main_port", "feedback_port", "user"), parts[1:]):
+        if value:
+            arm[key] = int(value)
+    return arm
+
+
+class DrawJob:
+    """A drawing handed to a Dispatcher, wait() returns process_paths' (res, message) once an arm is done"""
+
+    def __init__(self, name: str, paths: PathArray, estimated_s: float):
+        self.name = name
+        self.paths = paths
+        self.estimated_s = estimated_s
+        self.arm = None
+        self.attempts = 0
+        # Where the next attempt starts, moved on by every arm that gets part of it down
+        self.checkpoint = {"path": 0, "point": 0}
+        # Some arm put the pen down for it, so a failed job still left something on the paper
+        self.touched = False
+        self.result = None
+        self.queued_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+        # Guards callbacks against finish(), so each one runs exactly once
+        self.lock = threading.Lock()
+        self.callbacks: List[Callable[["DrawJob"], None]] = []
+
+    def wait(self, timeout: float = None) -> Tuple[bool, Union[str, Exception]]:
+        if not self.done.wait(timeout):
+            return False, TimeoutError(f"{self.name} not drawn after {timeout}s")
+        return self.result
+
+    def add_done_callback(self, callback: Callable[["DrawJob"], None]) -> None:
+        """Call callback(job) on the arm's thread once the job is drawn or given up, right away if it already is"""
+        with self.lock:
+            if not self.done.is_set():
+                self.callbacks.append(callback)
+                return
+        self.call(callback)
+
+    def finish(self, res: bool, msg: Union[str, Exception]) -> None:
+        with self.lock:
+            if self.done.is_set():
+                return
+            self.finished_at = time.monotonic()
+            self.result = res, msg
+            self.done.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            self.call(callback)
+
+    def call(self, callback: Callable[["DrawJob"], None]) -> None:
+        try:
+            callback(self)
+        except Exception as e:
+            print(f"{self.name} callback failed: {e}")
+
+
+class RobotWorker:
+    """One arm: a Robot drawing jobs on its own thread, from its own inbox first and then the shared queue.
+
+    An arm that fails a drawing is taken out of rotation for retry_s seconds and its job goes back
+    on the shared queue for another arm, which carries on from the checkpoint this one reached. After the wait it has to reconnect before it takes a job
+    again, the wait doubling up to max_retry_s while that keeps failing.
+    """
+
+    def __init__(self, name: str, robot: Robot, dispatcher: "Dispatcher", retry_s: float = 5.0,
+                 max_retry_s: float = 120.0):
+        self.name = name
+        self.robot = robot
+        self.dispatcher = dispatcher
+        self.inbox: "queue.Queue[DrawJob]" = queue.Queue()
+        self.job: Optional[DrawJob] = None
+        self.retry_s = retry_s
+        self.max_retry_s = max_retry_s
+        self.backoff = retry_s
+        self.down_until = 0.0
+        self.suspect = False  # taken down, has to reconnect before taking jobs again
+
+        self.drawings = 0
+        self.failures = 0
+        self.points = 0
+        self.busy_s = 0.0
+        self.started_at = None
+        self.thread = threading.Thread(target=self.run, name=f"arm-{name}", daemon=True)
+
+    @property
+    def idle(self) -> bool:
+        """Free to draw: up, not drawing and nothing in its inbox, call with the dispatcher lock held"""
+        return self.healthy and not self.suspect and self.job is None and self.inbox.empty()
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def take_down(self, reason: Union[str, Exception]) -> None:
+        """Out of rotation for the current backoff, its inbox goes to the other arms"""
+        dispatcher = self.dispatcher
+        with dispatcher.work_ready:
+            self.down_until = time.monotonic() + self.backoff
+            self.suspect = True
+            while not self.inbox.empty():
+                dispatcher.shared.put(self.inbox.get_nowait())
+            dispatcher.work_ready.notify_all()
+        if dispatcher.log: print(f"[{self.name}] out of rotation for {self.backoff:.0f}s: {reason}")
+        METRICS.count("arm_down", arm=self.name)
+        self.backoff = min(self.backoff * 2, self.max_retry_s)
+
+    def reconnect(self) -> bool:
+        """process_paths closes the connections when it gives up, pick the arm up again"""
+        robot = self.robot
+        try:
+            if robot.pipelined and (robot.channel is None or robot.channel.closed):
+                robot.close_connections()
+                if not robot.connect():
+                    raise ConnectionError(f"Could not connect to {robot.ip}:{robot.main_port}")
+            return True
+        except Exception as e:
+            self.take_down(e)
+            return False
+
+    def next_job(self) -> Optional[DrawJob]:
+        """Own inbox first, then the shared queue, taken and marked as this arm's job in one step so the
+        arm never looks idle with a job in hand"""
+        dispatcher = self.dispatcher
+        with dispatcher.work_ready:
+            while not dispatcher.stop_event.is_set():
+                if self.healthy and self.suspect:
+                    return None  # time to check the arm again
+                if self.healthy:
+                    for source in (self.inbox, dispatcher.shared):
+                        try:
+                            self.job = source.get_nowait()
+                            return self.job
+                        except queue.Empty:
+                            pass
+                dispatcher.work_ready.wait(0.2)
+        return None
+
+    def run(self) -> None:
+        self.started_at = time.monotonic()
+        while not self.dispatcher.stop_event.is_set():
+            if self.suspect and self.healthy:
+                if self.reconnect():
+                    self.suspect = False
+                    if self.dispatcher.log: print(f"[{self.name}] back in rotation")
+                continue
+            job = self.next_job()
+            if job is not None:
+                self.draw(job)
+
+    def draw(self, job: DrawJob) -> None:
+        job.arm = self.name
+        job.attempts += 1
+        job.started_at = time.monotonic()
+        dispatcher = self.dispatcher
+        resumed = job.checkpoint["path"] > 0 or job.checkpoint["point"] > 0
+        if dispatcher.log: print(f"[{self.name}] drawing {job.name}, {len(job.paths)} paths, ~{job.estimated_s:.0f}s"
+                                 + (f", resuming at path {job.checkpoint['path']}" if resumed else ""))
+        drawing_s = 0.0
+        if not self.reconnect():
+            res, msg = False, ConnectionError(f"{self.name} is down")
+        else:
+            try:
+                # Only the drawing itself is what time_model predicts, not the reconnect or the move to rest
+                started = time.monotonic()
+                res, msg = self.robot.process_paths(job.paths, rate_hz=dispatcher.time_model.rate_hz,
+                                                    checkpoint=job.checkpoint)
+                drawing_s = time.monotonic() - started
+                job.checkpoint = dict(self.robot.checkpoint)
+                job.touched = job.touched or self.robot.pen_downs > 0
+                if res and dispatcher.rest is not None:
+                    self.robot.servo_p_sync(*dispatcher.rest, 0.0, 0.0, 0.0)
+            except Exception as e:
+                res, msg = False, e
+        elapsed = time.monotonic() - job.started_at
+        self.busy_s += elapsed
+
+        if res:
+            self.drawings += 1
+            self.points += job.paths.total_points
+            self.backoff = self.retry_s
+            # A resumed drawing only took part of what the model would predict for the whole job
+            if not resumed:
+                dispatcher.time_model.calibrate(job.paths, drawing_s)
+        else:
+            self.failures += 1
+            if self.down_until <= time.monotonic():
+                self.take_down(msg)
+        METRICS.observe("arm_draw", elapsed, arm=self.name, result="ok" if res else "failed")
+        if res and not resumed: METRICS.gauge("draw_estimate_error_seconds", drawing_s - job.estimated_s, arm=self.name)
+        if dispatcher.log: print(f"[{self.name}] {job.name} {'drawn' if res else 'failed'} in {elapsed:.0f}s: {msg}")
+
+        with dispatcher.work_ready:
+            self.job = None
+            retry = not res and job.attempts < dispatcher.max_attempts and not dispatcher.stop_event.is_set()
+            if retry:
+                # Another arm picks it up at job.checkpoint, after whatever this one got down
+                dispatcher.shared.put(job)
+                dispatcher.work_ready.notify_all()
+        if retry:
+            if dispatcher.log: print(f"[{self.name}] {job.name} back in the queue at path {job.checkpoint['path']}, "
+                                     f"attempt {job.attempts} of {dispatcher.max_attempts}")
+        else:
+            job.finish(res, msg)
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        busy = self.busy_s
+        job = self.job
+        if job is not None and job.started_at is not None:
+            busy += time.monotonic() - job.started_at
+        return {
+            "drawings": self.drawings,
+            "failures": self.failures,
+            "points": self.points,
+            "busy_s": busy,
+            "utilization": busy / elapsed if elapsed > 0 else 0.0,
+            "drawing": job.name if job is not None else None,
+            "down_s": max(0.0, self.down_until - time.monotonic()),
+        }
+
+
+class Dispatcher:
+    """Pool of arms behind one capture and stylize front end.
+
+    submit() queues a whole drawing for the first arm that is idle. submit_split() cuts one large
+    drawing into vertical bands with about the same estimated draw time, one per arm in the order
+    the arms were given (left to right on the sheet, every arm's user frame calibrated to the same
+    sheet), and draws them at the same time. Each arm is configured by address, see parse_address.
+    A failed drawing is retried on another arm up to max_attempts times before its job finishes
+    as failed, default once per arm.
+    """
+
+    def __init__(self, arms: Sequence[dict], time_model: DrawTimeModel = None,
+                 rest: Optional[Tuple[float, float, float]] = (0, 0, -30), max_attempts: int = None,
+                 log: bool = True):
+        self.time_model = time_model if time_model is not None else DrawTimeModel()
+        self.rest = rest
+        self.max_attempts = max_attempts or len(arms)
+        self.log = log
+        self.lock = threading.Lock()
+        # Guards which arm holds which job, notified whenever a job is queued
+        self.work_ready = threading.Condition(self.lock)
+        self.shared: "queue.Queue[DrawJob]" = queue.Queue()
+        self.stop_event = threading.Event()
+        self.workers: List[RobotWorker] = []
+        for i, arm in enumerate(arms):
+            arm = dict(arm)
+            name = arm.pop("name", f"arm{i}")
+            # Stream the strokes the way time_model expects them to be drawn
+            arm.setdefault("trajectory", self.time_model.trajectory)
+            robot = Robot(log=arm.pop("log", False), **arm)
+            self.workers.append(RobotWorker(name, robot, self))
+        self.started_at = None
+
+    def start(self) -> "Dispatcher":
+        self.started_at = time.monotonic()
+        for worker in self.workers:
+            if self.rest is not None:
+                try:
+                    worker.robot.initialize(blended=False)
+                    worker.robot.servo_p_sync(*self.rest, 0.0, 0.0, 0.0)
+                except Exception as e:
+                    # Start with the arms that are up, this one is retried after its backoff
+                    worker.take_down(e)
+            worker.thread.start()
+        return self
+
+    def busy(self) -> bool:
+        """Anything queued or drawing that an arm that is up could still finish"""
+        with self.lock:
+            pending = not self.shared.empty() or any(not w.inbox.empty() for w in self.workers)
+            drawing = any(worker.job is not None for worker in self.workers)
+            return drawing or (pending and any(worker.healthy for worker in self.workers))
+
+    def stop(self, drain: bool = True) -> None:
+        """Stop the arms once everything queued is drawn, or with drain=False after the drawing they are on.
+        Jobs still queued then, e.g. with every arm down, finish as failed."""
+        if drain:
+            while self.busy():
+                time.sleep(0.1)
+        with self.work_ready:
+            self.stop_event.set()
+            self.work_ready.notify_all()
+        for worker in self.workers:
+            worker.thread.join()
+            worker.robot.close_connections()
+        for source in [self.shared] + [worker.inbox for worker in self.workers]:
+            while not source.empty():
+                source.get_nowait().finish(False, RuntimeError("Dispatcher stopped before the drawing started"))
+
+    def __enter__(self) -> "Dispatcher":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def estimate(self, paths: PathArray) -> float:
+        return self.time_model.estimate(paths)
+
+    def submit(self, paths: Union[PathArray, List[List[dict]]], name: str = None) -> DrawJob:
+        """Queue a drawing for the first idle arm"""
+        paths = as_path_array(paths)
+        job = DrawJob(name or f"drawing{int(time.time())}", paths, self.estimate(paths))
+        with self.work_ready:
+            self.shared.put(job)
+            self.work_ready.notify_all()
+        return job
+
+    def split(self, paths: PathArray, parts: int) -> List[PathArray]:
+        """Vertical bands of paths, left to right, each about 1/parts of the estimated drawing time"""
+        model = self.time_model
+        entry_x = paths.points[paths.offsets[:-1], 0]
+        order = np.argsort(entry_x, kind="stable")
+        # Per path cost without travel, which depends on the order PathOptimizer picks afterwards
+        if model.trajectory is not None:
+            drawing = model.trajectory.sample_counts(paths, model.rate_hz)[order] / model.rate_hz
+        else:
+            drawing = (paths.lengths[order] - 2) / model.rate_hz
+        cost = drawing + model.syncs_per_path * model.sync_s
+        cumulative = np.cumsum(cost)
+        cuts = np.searchsorted(cumulative, cumulative[-1] * np.arange(1, parts) / parts)
+        return [paths.take(band) for band in np.split(order, cuts)]
+
+    def submit_split(self, paths: Union[PathArray, List[List[dict]]], name: str = None) -> List[DrawJob]:
+        """Split one drawing across every arm by region and draw the parts at the same time"""
+        paths = as_path_array(paths)
+        name = name or f"drawing{int(time.time())}"
+        start = self.rest[:2] if self.rest is not None else (0.0, 0.0)
+        jobs = []
+        for i, (worker, band) in enumerate(zip(self.workers, self.split(paths, len(self.workers)))):
+            if len(band) == 0:
+                continue
+            band, _ = PathOptimizer(start=start, log=False).optimize(band)
+            job = DrawJob(f"{name}[{i}]", band, self.estimate(band))
+            with self.work_ready:
+                # An arm that is down hands its band to the others
+                (worker.inbox if not worker.suspect else self.shared).put(job)
+                self.work_ready.notify_all()
+            jobs.append(job)
+        if self.log and jobs:
+            print(f"Split {name} across {len(jobs)} arms, ~{max(job.estimated_s for job in jobs):.0f}s instead of "
+                  f"~{self.estimate(PathOptimizer(start=start, log=False).optimize(paths)[0]):.0f}s on one")
+        return jobs
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """Block until some arm is free and nothing is queued for it, so callers don't queue up visitors"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                if self.shared.empty() and any(worker.idle for worker in self.workers):
+                    return True
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.1)
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        arms = {worker.name: worker.stats() for worker in self.workers}
+        drawings = sum(arm["drawings"] for arm in arms.values())
+        return {
+            "elapsed_s": elapsed,
+            "drawings": drawings,
+            "queued": self.shared.qsize(),
+            "utilization": sum(arm["utilization"] for arm in arms.values()) / len(arms) if arms else 0.0,
+            "sync_s": self.time_model.sync_s,
+            "arms": arms,
+        }
+
+    def export_metrics(self) -> None:
+        for name, arm in self.stats()["arms"].items():
+            METRICS.gauge("arm_utilization", arm["utilization"], arm=name)
+
+    def report(self) -> str:
+        stats = self.stats()
+        lines = [f"{stats['drawings']} drawings on {len(stats['arms'])} arms in {stats['elapsed_s']:.0f}s, "
+                 f"{stats['utilization']:.1%} utilization, {stats['queued']} queued"]
+        for name, arm in stats["arms"].items():
+            state = arm["drawing"] or (f"down for {arm['down_s']:.0f}s" if arm["down_s"] else "idle")
+            lines.append(f"  {name:<10} {arm['utilization']:6.1%} busy  {arm['drawings']:4d} ok  {arm['failures']:3d} failed  "
+                         f"{arm['points']:7d} points  {state}")
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw .drawing files on several arms, or on simulated controllers.")
+    parser.add_argument("files", type=str, nargs="+", help="Drawing files, each goes to the first idle arm.")
+    parser.add_argument("--robot", type=str, action="append", default=[], help="Arm as ip[:port[:feedback_port[:user]]], repeat per arm.")
+    parser.add_argument("--sim", type=int, default=0, help="Start this many local dobot_sim.py controllers instead.")
+    parser.add_argument("--split", action="store_true", help="Split every drawing across all arms by region.")
+    parser.add_argument("--paths", type=int, default=None, help="Only draw the first N paths of each file.")
+
+    args = parser.parse_args()
+    from dobot_sim import DobotSimulator
+    from drawing_file import load_drawing
+
+    sims = [DobotSimulator().start() for _ in range(args.sim)]
+    arms = [{"ip": sim.host, "main_port": sim.dashboard_port, "feedback_port": sim.feedback_port} for sim in sims]
+    arms += [parse_address(address) for address in args.robot]
+    if not arms:
+        parser.error("give at least one --robot or --sim")
+
+    dispatcher = Dispatcher(arms).start()
+    jobs = []
+    for filename in args.files:
+        paths, _ = load_drawing(filename, mmap=False)
+        paths = paths[:args.paths] if args.paths else paths
+        if args.split:
+            jobs += dispatcher.submit_split(paths, filename)
+        else:
+            jobs.append(dispatcher.submit(paths, filename))
+    for job in jobs:
+        res, msg = job.wait()
+        print(f"{job.name} on {job.arm}: {msg}, {job.finished_at - job.started_at:.0f}s (estimated {job.estimated_s:.0f}s, "
+              f"waited {job.started_at - job.queued_at:.0f}s)")
+    print(dispatcher.report())
+    dispatcher.stop()
+    for sim in sims:
+        sim.stop()
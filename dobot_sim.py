@@ -0,0 +1,383 @@
+import argparse
+import math
+import re
+import socket
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+import numpy as np
+
+from feedback import FEEDBACK_DTYPE, FEEDBACK_TEST_VALUE
+
+# Name(args) as sent by Robot.send_message
+COMMAND_PATTERN = re.compile(rb"(\w+)\(([^)]*)\)")
+
+
+def segment_time(distance: float, v_in: float, v_out: float, speed: float, acc: float) -> float:
+    """Time to cover distance entering at v_in and leaving at v_out, with a speed limit and constant acceleration"""
+    if distance <= 0:
+        return 0.0
+    v_out = min(v_out, math.sqrt(v_in * v_in + 2 * acc * distance))
+    peak = math.sqrt(acc * distance + (v_in * v_in + v_out * v_out) / 2)
+    if peak <= speed:
+        return (2 * peak - v_in - v_out) / acc
+    ramps = (2 * speed * speed - v_in * v_in - v_out * v_out) / (2 * acc)
+    return (2 * speed - v_in - v_out) / acc + (distance - ramps) / speed
+
+
+def trapezoid_time(distance: float, speed: float, acc: float) -> float:
+    """Time to travel distance from rest to rest"""
+    return segment_time(distance, 0.0, 0.0, speed, acc)
+
+
+class DobotSimulator:
+    """Local stand-in for the CR5 dashboard (29999) and real-time feedback (30004) ports with a
+    simple motion timing model.
+
+    MovL and MovJ moves queue up behind each other and take a trapezoidal profile at SpeedFactor
+    of max_speed / max_acc (MovJ is timed like a straight move). Without CP every move stops at
+    its end; with CP the arm passes a queued junction at CP% of the speed limit, scaled down by
+    how sharply the path turns there. ServoP retargets immediately and arrives after at least
+    servo_time. Sync() replies once the queued motion would have finished. reply_latency delays
+    every reply without holding up the commands behind it, like a slow network rather than a slow
+    controller, so pipelined sends finish sooner than lock-step ones. The feedback port streams
+    FEEDBACK_DTYPE packets every feedback_period with the interpolated pose. RelMovLUser offsets
+    the last target. inject_error() and drop_connections() simulate faults.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", dashboard_port: int = 0, feedback_port: int = 0,
+                 max_speed: float = 1000.0, max_acc: float = 2500.0, servo_time: float = 0.1,
+                 reply_latency: float = 0.0, feedback_period: float = 0.008, log: bool = False):
+        self.host = host
+        self.dashboard_port = dashboard_port
+        self.feedback_port = feedback_port
+        self.max_speed = max_speed
+        self.max_acc = max_acc
+        self.servo_time = servo_time
+        self.reply_latency = reply_latency
+        self.feedback_period = feedback_period
+        self.log = log
+
+        self.speed_factor = 100
+        self.cp = 0
+        self.user = 0
+        self.enabled = False
+        # Set by inject_error(): motion is refused with ErrorID -2 until ClearError()
+        self.alarm = False
+        self.position = (0.0, 0.0, 0.0)
+        self.busy_until = 0.0
+        # Last queued MovL as (distance, entry speed, duration, unit direction) so a blended
+        # follow-up can re-time it with a non-zero exit speed
+        self.last_segment = None
+        # Planned motion as [start time, end time, start position, end position], oldest first
+        self.timeline: Deque[list] = deque()
+        self.motion_s = 0.0
+        self.command_counts: Dict[str, int] = {}
+        self.first_command_at = None
+        self.last_command_at = None
+        self.running = False
+        self.lock = threading.Lock()
+        self.threads: List[threading.Thread] = []
+        self.servers: List[socket.socket] = []
+        self.clients: List[socket.socket] = []
+
+    def start(self) -> "DobotSimulator":
+        """Start listening; with port 0 a free port is picked and stored on the instance"""
+        self.running = True
+        server = self.listen(self.dashboard_port)
+        self.dashboard_port = server.getsockname()[1]
+        self.spawn(self.accept_loop, server, self.handle_dashboard)
+        server = self.listen(self.feedback_port)
+        self.feedback_port = server.getsockname()[1]
+        self.spawn(self.accept_loop, server, self.handle_feedback)
+        if self.log: print(f"Simulated controller on {self.host}, dashboard {self.dashboard_port}, feedback {self.feedback_port}")
+        return self
+
+    def stop(self) -> None:
+        self.running = False
+        for server in self.servers:
+            server.close()
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+
+    def __enter__(self) -> "DobotSimulator":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def listen(self, port: int) -> socket.socket:
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((self.host, port))
+        server.listen()
+        server.settimeout(0.2)
+        self.servers.append(server)
+        return server
+
+    def spawn(self, target, *args) -> None:
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def accept_loop(self, server: socket.socket, handler) -> None:
+        while self.running:
+            try:
+                con, _ = server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            con.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.spawn(handler, con)
+
+    def inject_error(self) -> None:
+        """Put the controller in alarm like a collision or limit error would"""
+        with self.lock:
+            self.alarm = True
+            now = time.monotonic()
+            # The arm stops where it is, not at the end of the queued motion
+            self.position = self.pose_at(now)
+            self.busy_until = now
+            self.timeline.clear()
+            self.last_segment = None
+
+    def drop_connections(self) -> None:
+        """Close every client connection, as a network drop or controller restart would"""
+        with self.lock:
+            clients, self.clients = self.clients, []
+        for con in clients:
+            try:
+                con.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def handle_dashboard(self, con: socket.socket) -> None:
+        buffer = b""
+        with self.lock:
+            self.clients.append(con)
+        # Replies wait out reply_latency on their own thread, so replies in flight overlap like on a
+        # network link instead of adding up as if the controller took that long per command
+        outgoing: Deque[Tuple[float, bytes]] = deque()
+        ready = threading.Condition()
+        if self.reply_latency > 0:
+            self.spawn(self.send_delayed, con, outgoing, ready)
+        try:
+            with con:
+                while self.running:
+                    try:
+                        data = con.recv(4096)
+                    except OSError:
+                        return
+                    if not data:
+                        return
+                    buffer += data
+                    # Commands are not ';' terminated, so consume every complete Name(args) in the buffer
+                    end = 0
+                    for match in COMMAND_PATTERN.finditer(buffer):
+                        name, args = match.group(1).decode(), match.group(2).decode()
+                        reply = f"{self.execute(name, args)},{name}({args});".encode()
+                        end = match.end()
+                        if self.reply_latency > 0:
+                            with ready:
+                                outgoing.append((time.monotonic() + self.reply_latency, reply))
+                                ready.notify()
+                            continue
+                        try:
+                            con.sendall(reply)
+                        except OSError:
+                            return
+                    buffer = buffer[end:]
+        finally:
+            with ready:
+                outgoing.append((0.0, None))
+                ready.notify()
+
+    def send_delayed(self, con: socket.socket, outgoing: Deque[Tuple[float, bytes]],
+                     ready: threading.Condition) -> None:
+        """Send each queued reply once its due time has passed, in order; a None reply ends the thread"""
+        while True:
+            with ready:
+                while not outgoing:
+                    ready.wait()
+                due, reply = outgoing.popleft()
+            if reply is None:
+                return
+            time.sleep(max(0.0, due - time.monotonic()))
+            try:
+                con.sendall(reply)
+            except OSError:
+                return
+
+    def handle_feedback(self, con: socket.socket) -> None:
+        packet = np.zeros(1, dtype=FEEDBACK_DTYPE)[0]
+        packet["len"] = FEEDBACK_DTYPE.itemsize
+        packet["test_value"] = FEEDBACK_TEST_VALUE
+        deadline = time.monotonic()
+        with con:
+            while self.running:
+                now = time.monotonic()
+                with self.lock:
+                    busy = self.busy_until > now
+                    packet["robot_mode"] = 9 if self.alarm else (7 if busy else 5) if self.enabled else 4
+                    packet["error_status"] = self.alarm
+                    packet["tool_vector_actual"][:3] = self.pose_at(now)
+                    packet["tool_vector_target"][:3] = self.position
+                    packet["speed_scaling"] = self.speed_factor
+                    packet["user_coordinate"] = self.user
+                    packet["is_run_queued_cmd"] = busy
+                    packet["running_status"] = busy
+                    packet["enable_status"] = self.enabled
+                try:
+                    con.sendall(packet.tobytes())
+                except OSError:
+                    return
+                deadline += self.feedback_period
+                time.sleep(max(0.0, deadline - time.monotonic()))
+
+    def execute(self, name: str, args: str) -> str:
+        """Run one dashboard command and return the 'ErrorID,{value}' part of its reply"""
+        values = [a.strip() for a in args.split(",") if a.strip()]
+        with self.lock:
+            self.command_counts[name] = self.command_counts.get(name, 0) + 1
+            self.last_command_at = time.monotonic()
+            if self.first_command_at is None:
+                self.first_command_at = self.last_command_at
+
+        if name == "Sync":
+            remaining = self.busy_until - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            return "0,{}"
+        if name == "ClearError":
+            self.alarm = False
+            return "0,{}"
+        if name in ("EnableRobot", "ResetRobot"):
+            self.enabled = name != "ResetRobot" or self.enabled
+            return "0,{}"
+        if name == "DisableRobot":
+            self.enabled = False
+            return "0,{}"
+        if name == "SpeedFactor":
+            self.speed_factor = int(values[0])
+            return "0,{}"
+        if name == "CP":
+            self.cp = int(values[0])
+            return "0,{}"
+        if name == "User":
+            self.user = int(values[0])
+            return "0,{}"
+        if name == "RobotMode":
+            return "0,{9}" if self.alarm else "0,{5}" if self.enabled else "0,{4}"
+        if name in ("MovL", "MovJ", "ServoP"):
+            if self.alarm:
+                return "-2,{}"
+            if not self.enabled:
+                return "-1,{}"
+            target = tuple(float(v) for v in values[:3])
+            self.move(name, target)
+            return "0,{}"
+        if name == "RelMovLUser":
+            # User frames are not modelled, the offset is taken along the base axes
+            if self.alarm:
+                return "-2,{}"
+            if not self.enabled:
+                return "-1,{}"
+            with self.lock:
+                target = tuple(p + float(v) for p, v in zip(self.position, values[:3]))
+            self.move("MovL", target)
+            return "0,{}"
+        return "-10000,{}"
+
+    def pose_at(self, now: float) -> Tuple[float, float, float]:
+        """Interpolated position along the planned motion, call with the lock held"""
+        while self.timeline and self.timeline[0][1] <= now:
+            if len(self.timeline) == 1:
+                return self.timeline[0][3]
+            self.timeline.popleft()
+        if not self.timeline:
+            return self.position
+        start, end, p0, p1 = self.timeline[0]
+        if now <= start:
+            return p0
+        fraction = (now - start) / (end - start)
+        return tuple(a + (b - a) * fraction for a, b in zip(p0, p1))
+
+    def move(self, name: str, target: Tuple[float, float, float]) -> None:
+        now = time.monotonic()
+        speed = self.max_speed * self.speed_factor / 100
+        acc = self.max_acc * self.speed_factor / 100
+        with self.lock:
+            if name == "ServoP":
+                # Servo targets replace whatever was in progress, starting from where the arm is now
+                current = self.pose_at(now)
+                duration = max(self.servo_time, trapezoid_time(math.dist(current, target), speed, acc))
+                self.timeline.clear()
+                self.timeline.append([now, now + duration, current, target])
+                self.motion_s += duration - max(0.0, self.busy_until - now)
+                self.busy_until = now + duration
+                self.position = target
+                self.last_segment = None
+                return
+
+            delta = [t - p for t, p in zip(target, self.position)]
+            distance = math.sqrt(sum(d * d for d in delta))
+            direction = [d / distance for d in delta] if distance > 0 else None
+
+            v_in = 0.0
+            previous = self.last_segment
+            blend = name == "MovL" and self.cp > 0 and self.busy_until > now
+            if previous is not None and blend and direction is not None:
+                previous_distance, previous_v_in, previous_duration, previous_direction = previous
+                turn_cos = sum(a * b for a, b in zip(previous_direction, direction))
+                v_in = speed * self.cp / 100 * (1 + turn_cos) / 2
+                # No further than reachable by the end of the previous move; lookahead over more than one
+                # move is not modelled, so stopping after a fast short final move is slightly optimistic
+                v_in = min(v_in, math.sqrt(previous_v_in ** 2 + 2 * acc * previous_distance))
+                saved = previous_duration - segment_time(previous_distance, previous_v_in, v_in, speed, acc)
+                self.busy_until -= saved
+                self.motion_s -= saved
+                self.timeline[-1][1] -= saved
+
+            duration = segment_time(distance, v_in, 0.0, speed, acc)
+            start = max(now, self.busy_until)
+            self.timeline.append([start, start + duration, self.position, target])
+            self.busy_until = start + duration
+            self.motion_s += duration
+            self.position = target
+            self.last_segment = (distance, v_in, duration, direction) if direction is not None else None
+
+    def stats(self) -> dict:
+        with self.lock:
+            commands = sum(self.command_counts.values())
+            span = (self.last_command_at - self.first_command_at) if self.first_command_at else 0.0
+            return {
+                "commands": dict(self.command_counts),
+                "commands_per_s": commands / span if span > 0 else 0.0,
+                "motion_s": self.motion_s,
+                "position": self.position,
+                "busy_s": max(0.0, self.busy_until - time.monotonic()),
+            }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a simulated Dobot controller for Robot to connect to.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument("--dashboard-port", type=int, default=29999, help="Dashboard command port.")
+    parser.add_argument("--feedback-port", type=int, default=30004, help="Real-time feedback port.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to delay every reply, to mimic the network.")
+
+    args = parser.parse_args()
+    sim = DobotSimulator(args.host, args.dashboard_port, args.feedback_port, reply_latency=args.latency, log=True)
+    sim.start()
+    print(f"Point Robot at it with DOBOT_IP={args.host} DOBOT_PORT={sim.dashboard_port} DOBOT_FEEDBACK_PORT={sim.feedback_port}")
+    try:
+        while True:
+            time.sleep(5)
+            stats = sim.stats()
+            print(f"{sum(stats['commands'].values())} commands at {stats['commands_per_s']:.1f}/s, "
+                  f"{stats['motion_s']:.1f}s of motion, at {stats['position']}")
+    except KeyboardInterrupt:
+        sim.stop()
@@ -0,0 +1,109 @@
+import argparse
+import json
+import os
+import struct
+from typing import Tuple
+
+import numpy as np
+
+from path_array import PathArray
+from path_optimizer import DrawTimeModel
+from trajectory import TrajectoryPlanner
+
+# File layout, all little endian and every section 8 byte aligned:
+#   header    magic, version, metadata length, path count, point count (HEADER)
+#   metadata  UTF-8 JSON, padded with spaces
+#   offsets   int64[path count + 1]
+#   points    float32[point count, 3] x/y/z
+DRAWING_MAGIC = b"DRAWBOT\0"
+DRAWING_VERSION = 1
+DRAWING_SUFFIX = ".drawing"
+HEADER = struct.Struct("<8sIIQQ")
+
+
+def _pad(size: int) -> int:
+    return -size % 8
+
+
+def save_drawing(filename: str, paths: PathArray, metadata: dict = None) -> None:
+    """Write a drawing atomically: a crash leaves either the previous file or the complete new one"""
+    meta = json.dumps(metadata or {}).encode()
+    meta += b" " * _pad(HEADER.size + len(meta))
+    partial = f"{filename}.part"
+    with open(partial, "wb") as f:
+        f.write(HEADER.pack(DRAWING_MAGIC, DRAWING_VERSION, len(meta), len(paths), paths.total_points))
+        f.write(meta)
+        f.write(paths.offsets.astype("<i8", copy=False).tobytes())
+        f.write(paths.points.astype("<f4", copy=False).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial, filename)
+
+
+def read_header(filename: str) -> Tuple[int, dict, int, int]:
+    """(data offset, metadata, path count, point count)"""
+    with open(filename, "rb") as f:
+        magic, version, meta_size, path_count, point_count = HEADER.unpack(f.read(HEADER.size))
+        if magic != DRAWING_MAGIC:
+            raise ValueError(f"{filename} is not a drawing file")
+        if version != DRAWING_VERSION:
+            raise ValueError(f"{filename} is drawing format version {version}, expected {DRAWING_VERSION}")
+        metadata = json.loads(f.read(meta_size))
+    return HEADER.size + meta_size, metadata, path_count, point_count
+
+
+def load_drawing(filename: str, mmap: bool = True) -> Tuple[PathArray, dict]:
+    """Open a drawing as a PathArray and its metadata.
+
+    With mmap the offsets and points are read only views of the file, so opening costs the same
+    for any size and pages are only read as Robot.process_paths reaches them.
+    """
+    data_offset, metadata, path_count, point_count = read_header(filename)
+    points_offset = data_offset + 8 * (path_count + 1)
+    if mmap:
+        offsets = np.memmap(filename, dtype="<i8", mode="r", offset=data_offset, shape=(path_count + 1,))
+        points = np.memmap(filename, dtype="<f4", mode="r", offset=points_offset, shape=(point_count, 3))
+    else:
+        with open(filename, "rb") as f:
+            f.seek(data_offset)
+            offsets = np.fromfile(f, dtype="<i8", count=path_count + 1)
+            points = np.fromfile(f, dtype="<f4", count=point_count * 3).reshape(-1, 3)
+    return PathArray(points, offsets), metadata
+
+
+def draw(filename: str, motion: str = None, rate_hz: float = None, resume: bool = False,
+         trajectory: TrajectoryPlanner = None) -> None:
+    from robot import Robot
+
+    paths, metadata = load_drawing(filename)
+    print(f"{filename}: {len(paths)} paths, {paths.total_points} points from {metadata.get('source_image', '?')}")
+    bot = Robot(trajectory=trajectory)
+    bot.clear_error()
+    bot.enable_robot()
+    bot.set_speed_factor(bot.speed)
+    bot.set_user(6)
+    res, msg = bot.process_paths(paths, rate_hz=rate_hz, motion=motion,
+                                 checkpoint_file=f"{filename}.checkpoint", resume=resume)
+    print(msg)
+    bot.close_connections()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or draw a saved .drawing file. The robot address comes from DOBOT_IP / DOBOT_PORT.")
+    parser.add_argument("command", choices=("info", "draw"), help="Print the metadata, or draw it on the robot.")
+    parser.add_argument("file", type=str, help="Drawing file.")
+    parser.add_argument("--motion", choices=("servo", "blended"), default=None, help="Motion mode, defaults to the robot's.")
+    parser.add_argument("--rate", type=float, default=None, help="ServoP rate in Hz.")
+    parser.add_argument("--resume", action="store_true", help="Continue from FILE.checkpoint left by an interrupted draw.")
+    parser.add_argument("--retime", action="store_true", help="Retime strokes to TrajectoryPlanner's speed limits, resume with the same setting.")
+
+    args = parser.parse_args()
+    trajectory = TrajectoryPlanner(rate_hz=args.rate or 30.0) if args.retime else None
+    if args.command == "info":
+        paths, metadata = load_drawing(args.file)
+        print(f"{len(paths)} paths, {paths.total_points} points, {paths.nbytes / 1024:.1f} KiB")
+        breakdown = DrawTimeModel(args.rate or 30.0, trajectory=trajectory).breakdown(paths)
+        print("Estimated draw time: " + ", ".join(f"{name[:-2]} {seconds:.0f}s" for name, seconds in breakdown.items()))
+        print(json.dumps(metadata, indent=2))
+    else:
+        draw(args.file, args.motion, args.rate, args.resume, trajectory)
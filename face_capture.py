@@ -0,0 +1,257 @@
+import threading
+import time
+from typing import Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from metrics import METRICS
+
+# x, y, w, h in full frame pixels
+Box = Tuple[int, int, int, int]
+
+
+class FrameGrabber:
+    """Reads the camera on a background thread and keeps only the newest frame.
+
+    cap.read() blocks until the driver hands over a frame and the driver buffers a few, so reading
+    on the detection thread falls further behind the visitor the slower detection gets. Here the
+    grab thread drains the camera at its own rate and read() returns the latest frame.
+    source is a device index, a video file, or anything with read() / release() like cv2.VideoCapture.
+    """
+
+    def __init__(self, source: Union[int, str, object] = 0, log: bool = True):
+        self.log = log
+        self.cap = cv2.VideoCapture(source) if isinstance(source, (int, str)) else source
+        if hasattr(self.cap, "isOpened") and not self.cap.isOpened():
+            raise RuntimeError(f"Could not open camera {source}")
+        if hasattr(self.cap, "set"):
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        self.frame = None
+        self.sequence = 0
+        self.frame_at = None
+        self.condition = threading.Condition()
+        self.running = True
+        self.started_at = time.monotonic()
+        self.thread = threading.Thread(target=self.grab_loop, name="camera-grabber", daemon=True)
+        self.thread.start()
+
+    def grab_loop(self) -> None:
+        failures = 0
+        while self.running:
+            ret, frame = self.cap.read()
+            if not ret:
+                failures += 1
+                if failures > 100:
+                    if self.log: print("Camera stopped returning frames")
+                    break
+                time.sleep(0.01)
+                continue
+            failures = 0
+            with self.condition:
+                self.frame = frame
+                self.sequence += 1
+                self.frame_at = time.monotonic()
+                self.condition.notify_all()
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+
+    def read(self, after: int = 0, timeout: float = 1.0) -> Tuple[int, Optional[np.ndarray]]:
+        """Newest frame with a sequence number above after, (after, None) on timeout"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.sequence <= after:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.running:
+                    return after, None
+                self.condition.wait(remaining)
+            return self.sequence, self.frame
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started_at
+        return {"frames": self.sequence, "fps": self.sequence / elapsed if elapsed > 0 else 0.0}
+
+    def close(self) -> None:
+        self.running = False
+        self.thread.join(timeout=1.0)
+        self.cap.release()
+
+
+class HaarDetector:
+    """OpenCV's frontal face Haar cascade"""
+
+    def __init__(self, cascade_path: str = None, scale_factor: float = 1.1, min_neighbors: int = 5):
+        self.cascade = cv2.CascadeClassifier(cascade_path or cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+
+    def detect(self, image: np.ndarray) -> np.ndarray:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        faces = self.cascade.detectMultiScale(gray, scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors)
+        return np.asarray(faces, dtype=np.int32).reshape(-1, 4)
+
+
+class DnnDetector:
+    """OpenCV DNN face detector, the res10 300x300 SSD from the OpenCV samples.
+
+    Slower per call than Haar on a CPU but far steadier with turned heads and uneven light. The
+    model files are not in the repo, download them into models/ first.
+    """
+
+    def __init__(self, prototxt: str = "models/deploy.prototxt",
+                 model: str = "models/res10_300x300_ssd_iter_140000.caffemodel", confidence: float = 0.6):
+        self.net = cv2.dnn.readNetFromCaffe(prototxt, model)
+        self.confidence = confidence
+
+    def detect(self, image: np.ndarray) -> np.ndarray:
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        h, w = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(cv2.resize(image, (300, 300)), 1.0, (300, 300), (104.0, 177.0, 123.0))
+        self.net.setInput(blob)
+        detections = self.net.forward()[0, 0]
+        detections = detections[detections[:, 2] >= self.confidence]
+        boxes = np.clip(detections[:, 3:7], 0, 1) * [w, h, w, h]
+        boxes[:, 2:] -= boxes[:, :2]
+        return boxes.astype(np.int32).reshape(-1, 4)
+
+
+DETECTORS = {"haar": HaarDetector, "dnn": DnnDetector}
+
+
+def make_detector(name: str = "haar", **kwargs):
+    if name not in DETECTORS:
+        raise ValueError(f"Unknown detector {name}, expected one of {list(DETECTORS)}")
+    return DETECTORS[name](**kwargs)
+
+
+class FaceTracker:
+    """Finds the largest face on a downscaled frame, searching only around the last face once found.
+
+    The ROI is the last box grown by roi_margin of its size on every side. If the ROI comes up
+    empty the whole frame is searched again on the same call, so losing track costs one extra
+    detection rather than a frame.
+    """
+
+    def __init__(self, detector=None, scale: float = 0.5, roi_margin: float = 0.5):
+        self.detector = detector if detector is not None else HaarDetector()
+        self.scale = scale
+        self.roi_margin = roi_margin
+        self.last_box: Optional[Box] = None
+        self.detections = 0
+        self.roi_hits = 0
+        self.detect_s = 0.0
+
+    def search(self, frame: np.ndarray, x0: int, y0: int) -> Optional[Box]:
+        small = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA) if self.scale != 1 else frame
+        faces = self.detector.detect(small)
+        if len(faces) == 0:
+            return None
+        x, y, w, h = max(faces, key=lambda face: face[2] * face[3]) / self.scale
+        return int(x) + x0, int(y) + y0, int(w), int(h)
+
+    def detect(self, frame: np.ndarray) -> Optional[Box]:
+        started = time.monotonic()
+        self.detections += 1
+        box = None
+        if self.last_box is not None:
+            x, y, w, h = self.last_box
+            mx, my = int(w * self.roi_margin), int(h * self.roi_margin)
+            x0, y0 = max(0, x - mx), max(0, y - my)
+            x1, y1 = min(frame.shape[1], x + w + mx), min(frame.shape[0], y + h + my)
+            box = self.search(frame[y0:y1, x0:x1], x0, y0)
+            if box is not None:
+                self.roi_hits += 1
+        if box is None:
+            box = self.search(frame, 0, 0)
+        self.last_box = box
+        self.detect_s += time.monotonic() - started
+        return box
+
+    def reset(self) -> None:
+        self.last_box = None
+
+    def stats(self) -> dict:
+        return {
+            "detections": self.detections,
+            "roi_hits": self.roi_hits,
+            "mean_detect_ms": self.detect_s / self.detections * 1000 if self.detections else 0.0,
+        }
+
+
+class FaceCapture:
+    """Waits for a visitor to hold a large enough face in view for hold_s, then returns the padded crop"""
+
+    def __init__(self, grabber: FrameGrabber, tracker: FaceTracker = None, hold_s: float = 2.0,
+                 min_face: int = 145, padding: int = 150, log: bool = True):
+        self.grabber = grabber
+        self.tracker = tracker if tracker is not None else FaceTracker()
+        self.hold_s = hold_s
+        self.min_face = min_face
+        self.padding = padding
+        self.log = log
+        self.last_capture = {}
+
+    def crop(self, frame: np.ndarray, box: Box) -> np.ndarray:
+        x, y, w, h = box
+        x = max(0, x - self.padding)
+        y = max(0, y - self.padding)
+        w = min(frame.shape[1] - x, w + 2*self.padding)
+        h = min(frame.shape[0] - y, h + 2*self.padding)
+        return frame[y:y+h, x:x+w]
+
+    def capture(self, timeout: float = None) -> Tuple[bool, Union[np.ndarray, str]]:
+        started = time.monotonic()
+        face_detected_start_time = None
+        sequence, frames = self.grabber.sequence, 0
+        self.tracker.reset()
+
+        while timeout is None or time.monotonic() - started < timeout:
+            sequence, frame = self.grabber.read(after=sequence)
+            if frame is None:
+                if not self.grabber.running:
+                    return False, "Error: Camera stopped"
+                continue
+            frames += 1
+            box = self.tracker.detect(frame)
+
+            if box is None:
+                if face_detected_start_time is not None:
+                    if self.log: print("Face lost - resetting timer...")
+                    face_detected_start_time = None
+                elif self.log:
+                    print("No face detected, retrying...", end="\r")
+                continue
+
+            x, y, w, h = box
+            # Only start timer if face is large enough
+            if w <= self.min_face or h <= self.min_face:
+                if face_detected_start_time is not None:
+                    if self.log: print("Face too small - resetting timer...")
+                    face_detected_start_time = None
+                elif self.log:
+                    print("Face too small, please move closer...", end="\r")
+                continue
+
+            if face_detected_start_time is None:
+                face_detected_start_time = time.monotonic()
+                if self.log: print("Face detected! Hold still...")
+            elapsed_time = time.monotonic() - face_detected_start_time
+            if elapsed_time >= self.hold_s:
+                elapsed = time.monotonic() - started
+                self.last_capture = {
+                    "time_to_capture_s": elapsed,
+                    "detection_fps": frames / elapsed if elapsed > 0 else 0.0,
+                    "camera_fps": self.grabber.stats()["fps"],
+                    **self.tracker.stats(),
+                }
+                METRICS.observe("capture_wait", elapsed)
+                METRICS.gauge("face_detection_ms", self.last_capture["mean_detect_ms"])
+                if self.log: print(f"Face held for {self.hold_s:.0f} seconds - capturing image! "
+                                   f"{elapsed:.1f}s to capture, {self.last_capture['detection_fps']:.1f} detections/s")
+                return True, self.crop(frame, box)
+            elif self.log:
+                print(f"Hold still for {self.hold_s - elapsed_time:.1f} more seconds...", end="\r")
+        return False, f"No face held for {self.hold_s}s within {timeout}s"
@@ -0,0 +1,265 @@
+import argparse
+import base64
+import hashlib
+import itertools
+import json
+import re
+import socket
+import struct
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def ws_frame(text: str) -> bytes:
+    """Unmasked server to client text frame"""
+    payload = text.encode()
+    if len(payload) < 126:
+        header = struct.pack("!BB", 0x81, len(payload))
+    elif len(payload) < 1 << 16:
+        header = struct.pack("!BBH", 0x81, 126, len(payload))
+    else:
+        header = struct.pack("!BBQ", 0x81, 127, len(payload))
+    return header + payload
+
+
+class FakeComfyUI:
+    """Local stand-in for the ComfyUI endpoints portrait_2_line_art uses.
+
+    Prompts run one at a time for run_time seconds. Every SaveImage node then "outputs" the image
+    that was uploaded, under output_<n>.png. Status events go over /ws to the client_id that queued
+    the prompt, as in ComfyUI. With fail_next set the next prompt ends with execution_error.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, run_time: float = 0.5, log: bool = False):
+        self.host = host
+        self.port = port
+        self.run_time = run_time
+        self.log = log
+        self.fail_next = False
+
+        self.uploads: Dict[str, bytes] = {}
+        self.outputs: Dict[str, bytes] = {}
+        self.history: Dict[str, dict] = {}
+        self.pending: List[tuple] = []
+        self.running_prompt = None
+        self.sockets: Dict[str, List[socket.socket]] = {}
+        self.output_ids = itertools.count(1)
+        self.request_counts: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.work = threading.Condition(self.lock)
+        self.server = None
+        self.running = False
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "FakeComfyUI":
+        simulator = self
+
+        class Handler(FakeComfyHandler):
+            sim = simulator
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.running = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self.worker, daemon=True).start()
+        if self.log: print(f"Fake ComfyUI on {self.url}")
+        return self
+
+    def stop(self) -> None:
+        self.running = False
+        with self.lock:
+            self.work.notify_all()
+            sockets = [s for client in self.sockets.values() for s in client]
+        for s in sockets:
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "FakeComfyUI":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def queue(self, prompt: dict, client_id: str) -> str:
+        prompt_id = str(uuid.uuid4())
+        with self.lock:
+            self.pending.append((prompt_id, prompt, client_id))
+            self.work.notify_all()
+        return prompt_id
+
+    def worker(self) -> None:
+        while self.running:
+            with self.lock:
+                while self.running and not self.pending:
+                    self.work.wait()
+                if not self.running:
+                    return
+                prompt_id, prompt, client_id = self.pending.pop(0)
+                self.running_prompt = prompt_id
+                fail, self.fail_next = self.fail_next, False
+            self.send_event(client_id, "executing", {"node": "1", "prompt_id": prompt_id})
+            time.sleep(self.run_time)
+
+            if fail:
+                with self.lock:
+                    self.running_prompt = None
+                    self.history[prompt_id] = {"outputs": {}, "status": {"status_str": "error", "completed": False}}
+                self.send_event(client_id, "execution_error", {"prompt_id": prompt_id, "exception_message": "simulated failure"})
+                continue
+
+            outputs = {}
+            with self.lock:
+                for node_id, node in prompt.items():
+                    if node.get("class_type") != "SaveImage":
+                        continue
+                    source = next((n["inputs"]["image"] for n in prompt.values()
+                                   if n.get("class_type") == "LoadImage"), None)
+                    filename = f"output_{next(self.output_ids):05d}.png"
+                    self.outputs[filename] = self.uploads.get(source, b"")
+                    outputs[node_id] = {"images": [{"filename": filename, "subfolder": "", "type": "output"}]}
+                self.history[prompt_id] = {"outputs": outputs, "status": {"status_str": "success", "completed": True}}
+                self.running_prompt = None
+            self.send_event(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+
+    def send_event(self, client_id: str, kind: str, data: dict) -> None:
+        frame = ws_frame(json.dumps({"type": kind, "data": data}))
+        with self.lock:
+            sockets = list(self.sockets.get(client_id, []))
+        for s in sockets:
+            try:
+                s.sendall(frame)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"requests": dict(self.request_counts), "prompts": len(self.history), "pending": len(self.pending)}
+
+
+class FakeComfyHandler(BaseHTTPRequestHandler):
+    sim: FakeComfyUI = None
+    protocol_version = "HTTP/1.1"  # keep-alive, so pooled sessions are actually reused
+
+    def log_message(self, format, *args):
+        if self.sim.log: super().log_message(format, *args)
+
+    def count(self, name: str) -> None:
+        with self.sim.lock:
+            self.sim.request_counts[name] = self.sim.request_counts.get(name, 0) + 1
+
+    def reply(self, body: bytes, status: int = 200, content_type: str = "application/json") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def reply_json(self, value, status: int = 200) -> None:
+        self.reply(json.dumps(value).encode(), status)
+
+    def body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        if self.path == "/upload/image":
+            self.count("upload")
+            body = self.body()
+            # The only file part is the image, take its filename and the bytes up to the next boundary
+            boundary = self.headers.get_param("boundary").encode()
+            match = re.search(rb'filename="([^"]+)"[^\r]*\r\n(?:[^\r]+\r\n)*\r\n(.*?)\r\n--' + re.escape(boundary), body, re.S)
+            if match is None:
+                return self.reply_json({"error": "no image"}, 400)
+            name = match.group(1).decode()
+            with self.sim.lock:
+                self.sim.uploads[name] = match.group(2)
+            return self.reply_json({"name": name, "subfolder": "", "type": "input"})
+        if self.path == "/prompt":
+            self.count("prompt")
+            payload = json.loads(self.body())
+            prompt_id = self.sim.queue(payload["prompt"], payload.get("client_id", ""))
+            return self.reply_json({"prompt_id": prompt_id, "number": len(self.sim.history), "node_errors": {}})
+        self.reply_json({"error": "not found"}, 404)
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/ws":
+            return self.websocket()
+        if path == "/queue":
+            self.count("queue")
+            with self.sim.lock:
+                pending = [[i, prompt_id, prompt, {}, []] for i, (prompt_id, prompt, _) in enumerate(self.sim.pending)]
+                running = [[0, self.sim.running_prompt, {}, {}, []]] if self.sim.running_prompt else []
+            return self.reply_json({"queue_running": running, "queue_pending": pending})
+        if path.startswith("/history/"):
+            self.count("history")
+            prompt_id = path[len("/history/"):]
+            with self.sim.lock:
+                entry = self.sim.history.get(prompt_id)
+            return self.reply_json({prompt_id: entry} if entry is not None else {})
+        if path.startswith("/output/"):
+            self.count("output")
+            with self.sim.lock:
+                data = self.sim.outputs.get(path[len("/output/"):])
+            if data is None:
+                return self.reply_json({"error": "not found"}, 404)
+            return self.reply(data, content_type="image/png")
+        self.reply_json({"error": "not found"}, 404)
+
+    def websocket(self) -> None:
+        self.count("ws")
+        client_id = dict(p.split("=", 1) for p in self.path.split("?", 1)[-1].split("&") if "=" in p).get("clientId", "")
+        accept = base64.b64encode(hashlib.sha1((self.headers["Sec-WebSocket-Key"] + WS_GUID).encode()).digest()).decode()
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        con = self.connection
+        with self.sim.lock:
+            self.sim.sockets.setdefault(client_id, []).append(con)
+        try:
+            con.sendall(ws_frame(json.dumps({"type": "status", "data": {"sid": client_id}})))
+            # Nothing the client sends matters apart from a close frame, which is echoed
+            while self.sim.running:
+                data = con.recv(4096)
+                if not data:
+                    break
+                if data[0] & 0x0F == 0x8:
+                    con.sendall(b"\x88\x00")
+                    break
+        except OSError:
+            pass
+        finally:
+            with self.sim.lock:
+                self.sim.sockets[client_id].remove(con)
+            self.close_connection = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake ComfyUI server that echoes uploaded images back.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=8188, help="Port to listen on.")
+    parser.add_argument("--run-time", type=float, default=2.0, help="Seconds each prompt takes.")
+
+    args = parser.parse_args()
+    sim = FakeComfyUI(args.host, args.port, args.run_time, log=True).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sim.stop()
@@ -0,0 +1,166 @@
+import socket
+import threading
+import time
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils import ROBOT_MODE
+
+# Fixed size real-time packet the controller pushes on port 30004 every 8ms (Dobot TCP/IP protocol V3)
+_JOINT_VECTORS = ["q_target", "qd_target", "qdd_target", "i_target", "m_target", "q_actual", "qd_actual",
+                  "i_actual", "i_control", "tool_vector_actual", "TCP_speed_actual", "TCP_force",
+                  "tool_vector_target", "TCP_speed_target", "motor_temperatures", "joint_modes", "v_actual"]
+_STATUS_BYTES = ["user_coordinate", "tool_coordinate", "is_run_queued_cmd", "is_pause_cmd_flag",
+                 "velocity_ratio", "acceleration_ratio", "jerk_ratio", "xyz_velocity_ratio", "r_velocity_ratio",
+                 "xyz_acceleration_ratio", "r_acceleration_ratio", "xyz_jerk_ratio", "r_jerk_ratio",
+                 "brake_status", "enable_status", "drag_status", "running_status", "error_status", "jog_status",
+                 "robot_type", "drag_button_signal", "enable_button_signal", "record_button_signal",
+                 "reappear_button_signal", "jaw_button_signal", "six_force_online"]
+
+FEEDBACK_DTYPE = np.dtype(
+    [("len", "<i2"), ("reserve", "<i2", (3,)),
+     ("digital_input_bits", "<i8"), ("digital_outputs", "<i8"), ("robot_mode", "<i8"),
+     ("controller_timer", "<i8"), ("run_time", "<i8"), ("test_value", "<i8"),
+     ("safety_mode", "<f8"), ("speed_scaling", "<f8"), ("linear_momentum_norm", "<f8"), ("v_main", "<f8"),
+     ("v_robot", "<f8"), ("i_robot", "<f8"), ("program_state", "<f8"), ("safety_status", "<f8"),
+     ("tool_accelerometer_values", "<f8", (3,)), ("elbow_position", "<f8", (3,)), ("elbow_velocity", "<f8", (3,))]
+    + [(name, "<f8", (6,)) for name in _JOINT_VECTORS]
+    + [("hand_type", "i1", (4,))]
+    + [(name, "i1") for name in _STATUS_BYTES]
+    + [("reserve2", "i1", (82,)), ("m_actual", "<f8", (6,)), ("load", "<f8"),
+       ("center_x", "<f8"), ("center_y", "<f8"), ("center_z", "<f8"),
+       ("user", "<f8", (6,)), ("tool", "<f8", (6,)), ("trace_index", "<i8"), ("six_force_value", "<i8", (6,)),
+       ("target_quaternion", "<f8", (4,)), ("actual_quaternion", "<f8", (4,)), ("reserve3", "i1", (24,))]
+)
+FEEDBACK_PACKET_SIZE = FEEDBACK_DTYPE.itemsize  # 1440
+FEEDBACK_TEST_VALUE = 0x0123456789ABCDEF
+
+
+class FeedbackReader:
+    """Background reader for the real-time feedback port.
+
+    Packets are received straight into one of two preallocated buffers and read through a
+    numpy structured view of that buffer, so decoding copies nothing. The reader fills the back
+    buffer and swaps it to the front once a whole packet has arrived, callers only ever see the
+    front one. tool_vector_actual is compared as-is, so near() expects targets in the same frame
+    the controller reports (the user frame selected with User()).
+    """
+
+    def __init__(self, connection: socket.socket, log: bool = True):
+        self.connection = connection
+        self.log = log
+        self.buffers = [bytearray(FEEDBACK_PACKET_SIZE), bytearray(FEEDBACK_PACKET_SIZE)]
+        self.views = [np.frombuffer(buffer, dtype=FEEDBACK_DTYPE)[0] for buffer in self.buffers]
+        self.front = None
+        self.lock = threading.Lock()
+        self.packet_event = threading.Condition(self.lock)
+
+        self.packets = 0
+        self.bad_packets = 0
+        self.last_packet_at = None
+        self.started_at = time.monotonic()
+        self.running = True
+
+        self.reader = threading.Thread(target=self.read_loop, name="dobot-feedback-reader", daemon=True)
+        self.reader.start()
+
+    @property
+    def alive(self) -> bool:
+        return self.running and self.reader.is_alive()
+
+    def read_loop(self) -> None:
+        back = 0
+        try:
+            while self.running:
+                view = memoryview(self.buffers[back])
+                received = 0
+                while received < FEEDBACK_PACKET_SIZE:
+                    count = self.connection.recv_into(view[received:], FEEDBACK_PACKET_SIZE - received)
+                    if count == 0:
+                        raise ConnectionError("Feedback connection closed by controller")
+                    received += count
+
+                if self.views[back]["test_value"] != FEEDBACK_TEST_VALUE:
+                    self.bad_packets += 1
+                    continue
+                with self.lock:
+                    self.front = back
+                    self.packets += 1
+                    self.last_packet_at = time.monotonic()
+                    self.packet_event.notify_all()
+                back = 1 - back
+        except Exception as e:
+            if self.running and self.log:
+                print(f"Feedback reader stopped: {e}")
+        finally:
+            self.running = False
+            with self.lock:
+                self.packet_event.notify_all()
+
+    def latest(self) -> Optional[np.void]:
+        """Copy of the most recent packet as a numpy structured scalar, None before the first one"""
+        with self.lock:
+            return None if self.front is None else self.views[self.front].copy()
+
+    def pose(self) -> Optional[np.ndarray]:
+        """Actual TCP pose as x, y, z, rx, ry, rz"""
+        with self.lock:
+            return None if self.front is None else self.views[self.front]["tool_vector_actual"].copy()
+
+    def robot_mode(self) -> Tuple[Optional[int], str]:
+        with self.lock:
+            if self.front is None:
+                return None, ""
+            mode = int(self.views[self.front]["robot_mode"])
+        return mode, ROBOT_MODE.get(mode, "")
+
+    def queue_state(self) -> dict:
+        """Whether queued motion commands are running or paused, and the running/error flags"""
+        with self.lock:
+            if self.front is None:
+                return {}
+            packet = self.views[self.front]
+            return {
+                "running_queued": bool(packet["is_run_queued_cmd"]),
+                "paused": bool(packet["is_pause_cmd_flag"]),
+                "running": bool(packet["running_status"]),
+                "error": bool(packet["error_status"]),
+                "enabled": bool(packet["enable_status"]),
+            }
+
+    def near(self, target: Sequence[float], tolerance_mm: float = 0.5) -> bool:
+        pose = self.pose()
+        return pose is not None and float(np.linalg.norm(pose[:3] - np.asarray(target[:3]))) <= tolerance_mm
+
+    def wait_near(self, target: Sequence[float], tolerance_mm: float = 0.5, timeout: float = 5.0) -> bool:
+        """Block until the TCP is within tolerance_mm of target, False on timeout or a dead feed"""
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while True:
+                if self.front is not None:
+                    pose = self.views[self.front]["tool_vector_actual"]
+                    if float(np.linalg.norm(pose[:3] - np.asarray(target[:3]))) <= tolerance_mm:
+                        return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.running:
+                    return False
+                self.packet_event.wait(remaining)
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started_at
+        return {
+            "packets": self.packets,
+            "bad_packets": self.bad_packets,
+            "packets_per_s": self.packets / elapsed if elapsed > 0 else 0.0,
+            "age_ms": (time.monotonic() - self.last_packet_at) * 1000 if self.last_packet_at else None,
+        }
+
+    def close(self) -> None:
+        self.running = False
+        try:
+            # Unblocks the recv_into in read_loop
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.reader.join(timeout=1.0)
@@ -1,84 +1,301 @@
 import os
 import time
+from typing import List
+
 import cv2 as cv
 import numpy as np
 from skimage.morphology import skeletonize
 
+from drawing_file import save_drawing
+from metrics import DEBUG, METRICS
+from path_array import PathArray
+from path_optimizer import DrawTimeModel, PathOptimizer
 from path_processor import PathProcessor
+from sheet_allocator import SheetAllocator, SheetFull
+from skeleton_tracer import SkeletonTracer
+
+
+TRACERS = ("graph", "contours")
+# "opencv" is Zhang-Suen thinning from opencv-contrib's ximgproc, several times faster than skimage when installed
+THINNING = ("skimage", "opencv")
+# Detail knobs from the full drawing down to a sketch. A lower threshold keeps only darker lines,
+# distance_mm / max_chord_error_mm thin out points (uniform / adaptive resampling) and strokes
+# shorter than min_stroke_mm are dropped, which saves the most as every stroke costs four Sync() stops
+DETAIL_LEVELS = (
+    {"threshold": 125, "distance_mm": 3.0, "max_chord_error_mm": 0.5, "min_stroke_mm": 0.0},
+    {"threshold": 125, "distance_mm": 4.0, "max_chord_error_mm": 0.8, "min_stroke_mm": 2.0},
+    {"threshold": 115, "distance_mm": 5.0, "max_chord_error_mm": 1.0, "min_stroke_mm": 4.0},
+    {"threshold": 105, "distance_mm": 6.0, "max_chord_error_mm": 1.5, "min_stroke_mm": 8.0},
+    {"threshold": 95, "distance_mm": 8.0, "max_chord_error_mm": 2.0, "min_stroke_mm": 12.0},
+    {"threshold": 80, "distance_mm": 10.0, "max_chord_error_mm": 3.0, "min_stroke_mm": 20.0},
+)
+
+
+def working_scale(image_shape, drawing_area, pen_width_mm: float = 1.0, pixels_per_pen: float = 2.0) -> float:
+    """Factor to shrink the image by so a pixel is pen_width_mm / pixels_per_pen on paper, never above 1.
+
+    The image is fitted into the drawing area the same way PathProcessor does, so the full
+    resolution pixel size is the smaller of the two area / image ratios.
+    """
+    if pen_width_mm is None:
+        return 1.0
+    image_height, image_width = image_shape[:2]
+    min_x, max_x, min_y, max_y = drawing_area
+    mm_per_pixel = min((max_x - min_x) / image_width, (max_y - min_y) / image_height)
+    return min(1.0, mm_per_pixel * pixels_per_pen / pen_width_mm)
+
+
+def thin(binary: np.ndarray, thinning: str = "skimage") -> np.ndarray:
+    """One pixel wide boolean skeleton of a 0/255 binary image"""
+    if thinning == "opencv":
+        if not hasattr(cv, "ximgproc"):
+            raise ImportError("thinning='opencv' needs opencv-contrib-python")
+        return cv.ximgproc.thinning(binary, thinningType=cv.ximgproc.THINNING_ZHANGSUEN) > 0
+    return skeletonize(binary > 0)
+
+
+def extract_paths(image: np.ndarray, log: bool = False, tracer: str = "graph", scale: float = 1.0,
+                  thinning: str = "skimage", timings: dict = None, threshold: int = 125) -> List[List[List[int]]]:
+    """Blur, threshold and skeletonize a grayscale image and return its strokes as pixel paths.
+
+    The graph tracer walks the skeleton once and returns open polylines, the contours tracer is
+    the older findContours pass which follows both sides of every one pixel line. With scale
+    below 1 the thresholded image is shrunk before thinning and any pixel with some ink in it
+    stays ink, so lines thinner than the new pixel size survive. Paths are then in the pixels of
+    the shrunk image. Seconds spent per step are added to timings when given.
+    """
+    if tracer not in TRACERS:
+        raise ValueError(f"Unknown tracer {tracer!r}, expected one of {TRACERS}")
+    if thinning not in THINNING:
+        raise ValueError(f"Unknown thinning {thinning!r}, expected one of {THINNING}")
+    timings = {} if timings is None else timings
+    started = time.perf_counter()
+
+    def lap(step):
+        nonlocal started
+        now = time.perf_counter()
+        timings[step] = timings.get(step, 0.0) + now - started
+        started = now
+
+    blurred = cv.GaussianBlur(image, (3, 3), 0)
+    # cv.imshow('grey', blurred)
+    # cv.waitKey()
+    lap("blur")
+
+    _, binary = cv.threshold(blurred, threshold, 255, cv.THRESH_BINARY_INV)
+    
+    # kernel = np.ones((3,3), np.uint8)
+    # binary = cv.morphologyEx(binary, cv.MORPH_OPEN, kernel)
+    
+    # cv.imshow('binary', binary)
+    # cv.waitKey()
+    lap("threshold")
+
+    if scale < 1:
+        binary = cv.resize(binary, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+        _, binary = cv.threshold(binary, 0, 255, cv.THRESH_BINARY)
+        lap("resize")
+
+    # binary_normalized = binary / 255
+    # binary_image = binary_normalized > 0
+    skeleton = thin(binary, thinning)
+    skeleton_image = (skeleton * 255).astype(np.uint8)
+    # cv.imshow('skeleton', skeleton_image)
+    # cv.waitKey()
+    lap("skeletonize")
+
+    if tracer == "graph":
+        paths = SkeletonTracer().trace(skeleton)
+        lap("trace")
+        if log: print(f"Traced {len(paths)} strokes")
+        return paths
+
+    contours, _ = cv.findContours(
+        skeleton_image, 
+        cv.RETR_LIST,
+        cv.CHAIN_APPROX_SIMPLE
+    )
+    paths = []
+    for contour in contours:
+        # Convert each contour to a list of [x,y] coordinates
+        path = contour.squeeze().tolist()
+        # Handle single points or lines
+        if isinstance(path[0], (int, float)):
+            path = [path]
+        if log >= DEBUG: print(len(path))
+        paths.append(path)
+    lap("trace")
+    return paths
 
 
 class I2P:
-    def __init__(self, image_path="images/dog2.png", drawing_area=(1, 400, 1, 400),log=True):
+    def __init__(self, image_path="images/dog2.png", drawing_area=(1, 400, 1, 400),log=True, tracer="graph",
+                 resample="uniform", pen_width_mm=1.0, thinning="skimage", budget_s=None,
+                 time_model: DrawTimeModel = None, detail: dict = None, sheet: SheetAllocator = None):
+        """pen_width_mm picks the working resolution (two pixels per pen width), None keeps the full image.
+
+        detail overrides the DETAIL_LEVELS[0] knobs. With budget_s the most detailed of DETAIL_LEVELS
+        that time_model expects to draw within budget_s seconds is used instead. With sheet,
+        drawing_area only limits the size: the traced bounding box is scaled to fit it and placed
+        on the sheet, and that place becomes drawing_area. SheetFull is raised when there's no room.
+        """
         self.image_path = image_path
+        self.drawing_area = drawing_area
         self.log = log
+        self.tracer = tracer
+        self.resample = resample
+        self.thinning = thinning
+        self.time_model = time_model if time_model is not None else DrawTimeModel()
+        self.timings = {}
+        self.extracted = {}  # threshold -> pixel paths, so trying detail levels only thins once per threshold
 
-        image = cv.imread(image_path, cv.IMREAD_GRAYSCALE)
-        blurred = cv.GaussianBlur(image, (3, 3), 0)
-        # cv.imshow('grey', blurred)
-        # cv.waitKey()
-
-        _, binary = cv.threshold(blurred, 125, 255, cv.THRESH_BINARY_INV)
-        
-        # kernel = np.ones((3,3), np.uint8)
-        # binary = cv.morphologyEx(binary, cv.MORPH_OPEN, kernel)
-        
-        # cv.imshow('binary', binary)
-        # cv.waitKey()
-        
-
-        # binary_normalized = binary / 255
-        # binary_image = binary_normalized > 0
-        skeleton = skeletonize(binary)
-        skeleton_image = (skeleton * 255).astype(np.uint8)
-        # cv.imshow('skeleton', skeleton_image)
-        # cv.waitKey()
-
-        contours, _ = cv.findContours(
-            skeleton_image, 
-            cv.RETR_LIST,
-            cv.CHAIN_APPROX_SIMPLE
-        )
-        paths = []
-        for contour in contours:
-            # Convert each contour to a list of [x,y] coordinates
-            path = contour.squeeze().tolist()
-            # Handle single points or lines
-            if isinstance(path[0], (int, float)):
-                path = [path]
-            print(len(path))
-            paths.append(path)
-        # # [[[639, 714], ..., [534, 119]]]
-        # Get image dimensions
-        image_height, image_width = image.shape[:2]
+        started = time.perf_counter()
+        self.image = cv.imread(image_path, cv.IMREAD_GRAYSCALE)
+        if self.image is None:
+            raise ValueError(f"Could not read image {image_path}")
+        self.timings["read"] = time.perf_counter() - started
+        self.scale = working_scale(self.image.shape, drawing_area, pen_width_mm)
+        # Get image dimensions, of the working resolution the paths are in
+        image_height, image_width = self.image.shape[:2]
+        self.image_dimensions = (round(image_width * self.scale), round(image_height * self.scale))
 
-        pp = PathProcessor(
-            paths, 
-            drawing_area, 
-            image_dimensions=(image_width, image_height),
-            z_height_pen_down=0.65, 
-            z_height_pen_up=-20, 
-            distance_mm=3.0
-        )
-        self.original_paths, self.reduced_paths = pp.process_paths()
+        self.level = None
+        self.estimated_s = None
+        self.budget_s = budget_s
+        self.over_budget = False  # even the coarsest detail level is expected to take longer than budget_s
+        if sheet is not None:
+            self.drawing_area = self.place(sheet, drawing_area, {**DETAIL_LEVELS[0], **(detail or {})}["threshold"])
+        try:
+            if budget_s is None:
+                self.vectorize(**{**DETAIL_LEVELS[0], **(detail or {})})
+            else:
+                self.fit_budget(budget_s)
+        except Exception:
+            # The caller never gets the placed area to give back
+            if sheet is not None: sheet.release(self.drawing_area)
+            raise
 
-        # Filter out paths with length less than XX
-        self.reduced_paths = [path for path in self.reduced_paths if len(path) >= 4]
+        for step, seconds in self.timings.items():
+            if step != "process": METRICS.observe("i2p", seconds, step=step)
+        METRICS.observe("path_processor", self.timings["process"], engine=self.processor.engine, resample=resample)
 
         if self.log:
             print(f"Original Path Count: {len(self.original_paths)}")
             print(f"Reduced Path Count: {len(self.reduced_paths)}")
-            original_points = sum(len(path) for path in self.original_paths)
-            reduced_points = sum(len(path) for path in self.reduced_paths)
+            original_points = self.original_paths.total_points
+            reduced_points = self.reduced_paths.total_points
 
             print(f"Original paths total points: {original_points}")
             print(f"Reduced paths total points: {reduced_points}")
             print(f"Points reduction: {(original_points - reduced_points) / original_points * 100:.1f}%")
 
-            print(f"Original paths type: {type(self.original_paths)}")
-            print(f"Original paths[0] type: {type(self.original_paths[0])}")
-            print(f"Original paths[0][0] type: {type(self.original_paths[0][0])}")
-            print(f"Reduced paths type: {type(self.reduced_paths)}")
-            print(f"Reduced paths[0] type: {type(self.reduced_paths[0])}")
-            print(f"Reduced paths[0][0] type: {type(self.reduced_paths[0][0])}")
+            print(f"Original paths memory: {self.original_paths.nbytes / 1024:.1f} KiB")
+            print(f"Reduced paths memory: {self.reduced_paths.nbytes / 1024:.1f} KiB")
+            print(f"Working resolution: {self.image_dimensions[0]}x{self.image_dimensions[1]} ({self.scale:.2f}x)")
+            print("Timings: " + ", ".join(f"{step} {seconds * 1000:.0f}ms" for step, seconds in self.timings.items()))
 
-    
+    def extract(self, threshold: int) -> List[List[List[int]]]:
+        if threshold not in self.extracted:
+            self.extracted[threshold] = extract_paths(self.image, log=self.log, tracer=self.tracer, scale=self.scale,
+                                                      thinning=self.thinning, timings=self.timings, threshold=threshold)
+        return self.extracted[threshold]
+
+    def place(self, sheet: SheetAllocator, max_area, threshold: int, min_scale: float = 0.6) -> tuple:
+        """Allocate the drawing's own bounding box, scaled to fit max_area, on the sheet, shrunk down to
+        min_scale of that when only a smaller gap is left"""
+        paths = self.extract(threshold)
+        if not paths:
+            raise ValueError(f"No lines found in {self.image_path}")
+        points = np.concatenate([np.asarray(path, dtype=np.float64).reshape(-1, 2) for path in paths])
+        width, height = np.maximum(points.max(axis=0) - points.min(axis=0), 1.0)
+        min_x, max_x, min_y, max_y = max_area
+        fit = min((max_x - min_x) / width, (max_y - min_y) / height)
+        area = sheet.allocate(width * fit, height * fit, min_scale)
+        if area is None:
+            raise SheetFull(f"No room left on the sheet for {width * fit:.0f}x{height * fit:.0f}mm")
+        return area
+
+    def vectorize(self, threshold: int = 125, distance_mm: float = 3.0, max_chord_error_mm: float = 0.5,
+                  min_stroke_mm: float = 0.0) -> PathArray:
+        """Trace and process the image with one set of detail knobs into original_paths / reduced_paths"""
+        self.detail = {"threshold": threshold, "distance_mm": distance_mm,
+                       "max_chord_error_mm": max_chord_error_mm, "min_stroke_mm": min_stroke_mm}
+        # # [[[639, 714], ..., [534, 119]]]
+        pp = PathProcessor(
+            self.extract(threshold), 
+            self.drawing_area, 
+            image_dimensions=self.image_dimensions,
+            z_height_pen_down=0.65, 
+            z_height_pen_up=-20, 
+            distance_mm=distance_mm,
+            resample=self.resample,
+            max_chord_error_mm=max_chord_error_mm,
+            log=self.log
+        )
+        self.processor = pp
+        started = time.perf_counter()
+        self.original_paths, self.reduced_paths = pp.process_paths()
+        self.timings["process"] = self.timings.get("process", 0.0) + time.perf_counter() - started
+
+        # Filter out paths with length less than XX
+        keep = self.reduced_paths.lengths >= 4
+        if min_stroke_mm > 0:
+            keep &= self.reduced_paths.stroke_lengths >= min_stroke_mm
+        self.reduced_paths = self.reduced_paths[keep]
+        return self.reduced_paths
+
+    def estimate(self, paths: PathArray = None) -> float:
+        """Expected draw time of the reduced paths in the order PathOptimizer will put them"""
+        paths = self.reduced_paths if paths is None else paths
+        ordered, _ = PathOptimizer(start=self.time_model.start, log=False).optimize(paths)
+        return self.time_model.estimate(ordered)
+
+    def fit_budget(self, budget_s: float, levels=DETAIL_LEVELS) -> float:
+        """Vectorize at the most detailed level expected to draw within budget_s, the coarsest if none is,
+        which sets over_budget.
+
+        Fewer points, strokes and pen moves only ever take less time, so the levels are bisected and
+        a handful of images are traced instead of all of them.
+        """
+        estimates = {}
+        low, high = 0, len(levels) - 1
+        while low < high:
+            middle = (low + high) // 2
+            self.vectorize(**levels[middle])
+            estimates[middle] = self.estimate()
+            if estimates[middle] <= budget_s:
+                high = middle
+            else:
+                low = middle + 1
+        if low not in estimates or self.detail != levels[low]:
+            self.vectorize(**levels[low])
+            estimates[low] = self.estimate()
+        self.level, self.estimated_s = low, estimates[low]
+        self.over_budget = self.estimated_s > budget_s
+
+        if self.log:
+            fits = "fits" if self.estimated_s <= budget_s else "still over"
+            print(f"Detail level {low} of {len(levels) - 1}: ~{self.estimated_s:.0f}s, {fits} the {budget_s:.0f}s budget "
+                  f"after trying {len(estimates)} levels")
+        return self.estimated_s
+
+    def metadata(self) -> dict:
+        pp = self.processor
+        return {
+            "source_image": self.image_path,
+            "drawing_area": list(self.drawing_area),
+            "z_height_pen_down": pp.z_height_pen_down,
+            "z_height_pen_up": pp.z_height_pen_up,
+            "resample": pp.resample,
+            **self.detail,
+            "detail_level": self.level,
+            "estimated_draw_s": self.estimated_s,
+            "budget_s": self.budget_s,
+            "over_budget": self.over_budget,
+            "working_scale": self.scale,
+            "timings": self.timings,
+        }
+
+    def save(self, filename: str, paths: PathArray = None, **metadata) -> None:
+        """Write the reduced paths, or paths such as their optimized order, as a .drawing file"""
+        save_drawing(filename, self.reduced_paths if paths is None else paths, {**self.metadata(), **metadata})
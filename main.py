@@ -3,115 +3,29 @@ import os
 import cv2
 import uuid
 import time
-import random
 import requests
 import subprocess
 from datetime import datetime
 from typing import Tuple, List, Union
 
+from dispatcher import Dispatcher
 from path_sender import PathSender
 from image_2_paths import I2P
-from robot import Robot
+from path_optimizer import DrawTimeModel, PathOptimizer
+from drawing_file import DRAWING_SUFFIX
+from face_capture import FaceCapture, FaceTracker, FrameGrabber, make_detector
+from metrics import INFO, METRICS
+from path_array import PathArray
+from pipeline import Pipeline
+from sheet_allocator import SheetAllocator, SheetFull
 from utils import visualize_paths
 
 from portrait_2_line_art import main as p2la
 
-def get_box_bounds(box_x: int, box_y: int, box_size:int) -> Tuple[int, int, int, int]:
-    """Convert grid coordinates to workspace bounds"""
-    min_x = 1 + (box_x * box_size)
-    max_x = min_x + box_size
-    min_y = 1 + (box_y * box_size) 
-    max_y = min_y + box_size
-    return (min_x, max_x, min_y, max_y)
-
-def get_random_unused_box(grid_size, box_size, drawn_boxes) -> Union[Tuple[int, int, int, int], None]:
-    """Get bounds of random undrawn box, or None if all used"""
-    available = []
-    for x in range(grid_size):
-        for y in range(grid_size):
-            if (x,y) not in drawn_boxes:
-                available.append((x,y))
-    if not available: return None
-    box_x, box_y = random.choice(available)
-    drawn_boxes.add((box_x, box_y))
-    return drawn_boxes, get_box_bounds(box_x, box_y, box_size)
-
-def capture_and_process_image(bot, server_live) -> Tuple[bool, Union[Tuple[str, str, str], str]]:
-    print("Opening camera...")
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        return False, "Error: Could not open camera"
-
-    # Wait for camera to initialize
-    time.sleep(1)
-
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    face_detected = False
-    face_detected_start_time = None
-    required_face_time = 2  # seconds
-
-    while not face_detected:
-        ret, frame = cap.read()
-        if not ret: continue
-
-        # Resize frame for faster processing
-        height, width = frame.shape[:2]
-        scale_factor = 0.5
-        # new_width = int(width * scale_factor)
-        # new_height = int(height * scale_factor)
-        # frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
-
-        # Detect faces
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
-
-        if len(faces) > 0:
-            # Find largest face by area
-            largest_face = max(faces, key=lambda face: face[2] * face[3])
-            x, y, w, h = largest_face
-
-            # Only start timer if face is large enough
-            if w > 145 and h > 145:
-                if face_detected_start_time is None:
-                    face_detected_start_time = time.time()
-                    print("Face detected! Hold still...")
-                
-                elapsed_time = time.time() - face_detected_start_time
-                if elapsed_time >= required_face_time:
-                    face_detected = True
-                    print("Face held for 6 seconds - capturing image!")
-                else:
-                    print(f"Hold still for {required_face_time - elapsed_time:.1f} more seconds...")
-            else:
-                if face_detected_start_time is not None:
-                    print("Face too small - resetting timer...")
-                    face_detected_start_time = None
-                else:
-                    print("Face too small, please move closer...")
-        
-
-            # Add padding around face
-            padding = 150
-            x = max(0, x - padding)
-            y = max(0, y - padding)
-            w = min(frame.shape[1] - x, w + 2*padding)
-            h = min(frame.shape[0] - y, h + 2*padding)
-
-            # Crop image to face area
-            frame = frame[y:y+h, x:x+w]
-        else:
-            if face_detected_start_time is not None:
-                print("Face lost - resetting timer...")
-                face_detected_start_time = None
-            else:
-                print("No face detected, retrying...", end="\r")
-            time.sleep(0.1)
-        # cv2.imshow('faces', frame)
-        # cv2.waitKey(1)
-    cv2.destroyAllWindows()
-    cap.release()
-    # exit()
-    bot.servo_p_sync(0,0,-30,0,0,0)
+def capture_image(face_capture: FaceCapture) -> Tuple[bool, Union[Tuple[str, str], str]]:
+    res, frame = face_capture.capture()
+    if not res:
+        return False, frame
     try:
 
         _, img_encoded = cv2.imencode('.jpg', frame)
@@ -120,11 +34,19 @@ def capture_and_process_image(bot, server_live) -> Tuple[bool, Union[Tuple[str,
         
         with open(o_filename, 'wb') as f:
             f.write(img_encoded.tobytes())
+        return True, (image_uuid, o_filename)
+    except Exception as e:
+        return False, e
 
+def stylize_image(capture: Tuple[str, str], server_live: bool) -> Tuple[bool, Union[Tuple[str, str, str], Exception]]:
+    image_uuid, o_filename = capture
+    try:
         # SEND TO RUNPOD FOR PROCESSING
         # subprocess.run(["python", "portrait-2-line-art.py", "--ip", "213.173.109.234", "--port", "17778", "--filepath", "linear-api.json", "--xf", o_filename])
         if server_live: res_filename = p2la(ip="213.173.110.141", port=16457, filepath="linear-api.json", image_path=o_filename)
         else: res_filename = o_filename
+        if res_filename is None:
+            return False, f"Stylization failed for {o_filename}"
 
         return True, (image_uuid, o_filename, res_filename)
     except Exception as e:
@@ -132,65 +54,135 @@ def capture_and_process_image(bot, server_live) -> Tuple[bool, Union[Tuple[str,
 
 
 
+def vectorize_image(data: Tuple[str, str, str], vis: bool, log: int = INFO, budget_s: float = None,
+                    time_model: DrawTimeModel = None, sheet: SheetAllocator = None,
+                    drawing_area=(0,360,0,500), max_overrun: float = 1.5) -> Tuple[bool, Union[Tuple[str, PathArray], Exception]]:
+    """With a sheet drawing_area is the largest a portrait may be and it's drawn where the sheet has room.
+    A portrait expected to take more than max_overrun times budget_s even at the coarsest detail is dropped."""
+    iuuid, original, result = data
+    # result = "/Users/isaac/Desktop/drawbot/output/ComfyUI_00052_.png"
+    i2p = I2P(image_path=result, drawing_area=drawing_area, resample="adaptive", log=log,
+              budget_s=budget_s, time_model=time_model, sheet=sheet)
+    if i2p.over_budget:
+        METRICS.count("portraits_over_budget")
+        if i2p.estimated_s > budget_s * max_overrun:
+            if sheet is not None: sheet.release(i2p.drawing_area)
+            return False, RuntimeError(f"Portrait would take ~{i2p.estimated_s:.0f}s, over the {budget_s:.0f}s budget at the coarsest detail")
+        print(f"Portrait over budget at the coarsest detail, ~{i2p.estimated_s:.0f}s for {budget_s:.0f}s")
+
+    try:
+        if vis: visualize_paths([i2p.reduced_paths])
+
+        # Robot waits at (0,0,-30) between drawings, so start the tour there
+        paths, travel_stats = PathOptimizer(start=(0, 0)).optimize(i2p.reduced_paths)
+        # Kept on disk so a crash mid drawing can be replayed with drawing_file.py draw
+        os.makedirs("output/drawings", exist_ok=True)
+        i2p.save(f"output/drawings/{iuuid}{DRAWING_SUFFIX}", paths)
+    except Exception:
+        # Nothing goes to the arms, so nothing will be drawn where the sheet placed it
+        if sheet is not None: sheet.release(i2p.drawing_area)
+        raise
+    return True, (iuuid, paths, i2p.drawing_area)
+
+
 if __name__ == "__main__":
     try:
-        total_workspace = (1,400, 1,400) #minx,maxx, miny, maxy
-        box_size = 400
-        grid_size = 1
-        drawn_boxes = set() 
+        # Portraits are packed onto the sheet by their own size, the state file keeps track of what is
+        # drawn across restarts; delete it (or call sheet.reset()) when a new sheet goes on the table
+        sheet = SheetAllocator(sheet=(0,360, 0,500), margin=5, state_file="output/sheet.json") #minx,maxx, miny, maxy
+        portrait_size = (0,170, 0,240) # largest area one portrait may take
         # (579, 153, -533, 97, -53, 178)
-        is_running = True
 
         bot_live = True
         server_live = True
         vis = False
+        log_level = INFO # QUIET, INFO, or DEBUG for the per path diagnostics
+        # Seconds each visitor's portrait may take on the robot, detail is reduced until the estimate fits.
+        # The estimator is recalibrated after every drawing so it tracks the real robot
+        portrait_budget_s = 300
+        # Strokes are streamed one point per ServoP period as PathProcessor spaced them. A TrajectoryPlanner
+        # (e.g. max_speed=250, max_accel=2500, junction_deviation=0.5) would retime them to what the arm
+        # can follow, but on adaptive spacing it only slows curls and stroke ends, and no setting made the
+        # sample portraits faster. Turn it on once tracking error on the arm shows it's needed; the arms
+        # and the estimates share it
+        trajectory = None
+        time_model = DrawTimeModel(rate_hz=30, trajectory=trajectory)
+
+        # Every span and counter goes to a JSON lines log, and totals to a file node_exporter can scrape
+        METRICS.configure(jsonl_file="output/metrics/events.jsonl", prometheus_file="output/metrics/drawbot.prom")
+
+        # One entry per arm, any Robot keyword (ip, main_port, feedback_port, user), each drawing goes to the first idle arm
+        arms = [{"ip": "192.168.1.6", "user": 6}]
 
         if bot_live:
-            bot = Robot()
-            bot.clear_error()
-            bot.enable_robot()
-            bot.set_speed_factor(bot.speed)
-            bot.set_user(6)
-
-        while is_running:
+            dispatcher = Dispatcher([{**arm, "log": log_level} for arm in arms], time_model=time_model, rest=(0,0,-30)).start()
+
+        # Capture, stylize, vectorize and draw each run on their own thread. One portrait is in the
+        # pipeline at a time besides the ones on the arms: the next visitor is captured, stylized and
+        # vectorized while the robot draws, and waits in the draw stage for a free arm, but nobody
+        # after them is captured until then. A failing capture (no camera, no face) backs off
+        pipeline = Pipeline(queue_size=1, max_in_flight=1, source_backoff=(0.5, 10.0))
+
+        def drawn(job, area):
+            res, msg = job.result
+            if not res:
+                # Every arm that was up tried it, stop taking visitors rather than fail their portraits too
+                print(f"Drawing {job.name} failed on {job.attempts} arms, stopping: {msg}")
+                METRICS.count("drawings_failed")
+                # Only a drawing that never reached the paper gives its place back, a half drawn one keeps it
+                if not job.touched:
+                    sheet.release(area)
+                pipeline.stop()
+
+        def draw(data):
+            iuuid, paths, area = data
             # GO TO CAMERA POSITION
             # if bot_live: bot.servo_p_sync(579, 153, -533, 97, -53, 178)
-
-            drawn_boxes, work_area = get_random_unused_box(grid_size, box_size, drawn_boxes)
-            print(f"Drawn in {len(drawn_boxes)} slots")
-            print(f"Work Area ", work_area)
-            
-            
-            res, data = capture_and_process_image(bot, server_live)
-
-            if bot_live: bot.servo_p_sync(0,0,-30,0,0,0)
-
-            if not res: 
-                print(data)
-                continue
-            else:
-                iuuid, original, result = data
-
-                # result = "/Users/isaac/Desktop/drawbot/output/ComfyUI_00052_.png"
-
-                i2p = I2P(image_path=result, drawing_area=(0,360,0,500))
-
-                if vis: visualize_paths([i2p.reduced_paths])
-
-                paths = sorted(i2p.reduced_paths, key=len, reverse=True)
-
-                if bot_live:
-                    res, msg = bot.process_paths(paths)
-                    if not res: is_running = False
-                    
-                # GO TO CAMERA POSITION
-                # if bot_live: bot.servo_p_sync(579, 153, -533, 97, -53, 178)
-                # time.sleep(60) 
-                # Wait for spacebar press to continue
-                # key = input("Press spacebar to continue...")
-                # while key != " ":
-                #     key = input("Press spacebar to continue...")
-
+            stats = sheet.stats()
+            print(f"{stats['placed']} portraits on the sheet, {stats['utilization']:.0%} used")
+
+            if bot_live:
+                # Hold the next portrait back until an arm is free, the arms calibrate time_model as they finish
+                dispatcher.wait_idle()
+                job = dispatcher.submit(paths, iuuid)
+                job.add_done_callback(lambda job: drawn(job, area))
+                print(dispatcher.report())
+                dispatcher.export_metrics()
+            print(pipeline.report())
+            pipeline.export_metrics()
+            METRICS.export()
+            return True, iuuid
+
+        def vectorize(data):
+            try:
+                return vectorize_image(data, vis, log_level, portrait_budget_s, time_model, sheet, portrait_size)
+            except SheetFull as e:
+                pipeline.stop()
+                return False, e
+
+        # The camera stays open between visitors and is read on its own thread
+        print("Opening camera...")
+        face_capture = FaceCapture(FrameGrabber(0), FaceTracker(make_detector("haar"), scale=0.5))
+
+        pipeline.add_stage("capture", lambda _: capture_image(face_capture))
+        pipeline.add_stage("stylize", lambda capture: stylize_image(capture, server_live))
+        # A portrait vectorized but never drawn gives its place on the sheet back
+        pipeline.add_stage("vectorize", vectorize, on_drop=lambda data: sheet.release(data[2]))
+        pipeline.add_stage("draw", draw)
+        pipeline.start()
+
+        while pipeline.running and not pipeline.stop_event.is_set():
+            time.sleep(0.5)
+        # Let the portrait on the robot finish, the other stages may be stuck waiting for a face
+        pipeline.stages[-1].thread.join()
+        if bot_live:
+            dispatcher.stop()
+            print(dispatcher.report())
+        # Give the other stages a moment to drop what they hold, the capture stage may be waiting for a face
+        pipeline.join(timeout=5)
+        print(pipeline.report())
+        pipeline.export_metrics()
+        METRICS.close()
 
     except Exception as e:
         print("MAIN LOOP ERR", e)
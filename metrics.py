@@ -0,0 +1,170 @@
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Levels for the log parameters, True and False still mean INFO and QUIET. Per path diagnostics only
+# print at DEBUG, so INFO keeps the console to one line per step of a portrait
+QUIET, INFO, DEBUG = 0, 1, 2
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _metric_name(name: str) -> str:
+    return "drawbot_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _format_labels(labels: Labels, **extra) -> str:
+    pairs = list(labels) + [(key, str(value)) for key, value in extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Metrics:
+    """Spans, counters and gauges from every part of the installation.
+
+    Each record is appended to jsonl_file as it happens, one JSON object per line, and the running
+    totals can be written to prometheus_file in the Prometheus text format for node_exporter's
+    textfile collector. Spans become a drawbot_span_seconds summary labelled by span name, so the
+    share of a portrait spent waiting for a face, on the GPU or drawing can be compared over days.
+    Without files configured everything is only kept in memory.
+    """
+
+    def __init__(self, jsonl_file: str = None, prometheus_file: str = None):
+        self.lock = threading.Lock()
+        self.jsonl = None
+        self.prometheus_file = None
+        self.spans: Dict[Tuple[str, Labels], List[float]] = {}  # count, sum, max
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.gauges: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Tuple[Sequence[float], List[int], float]] = {}
+        self.configure(jsonl_file, prometheus_file)
+
+    def configure(self, jsonl_file: str = None, prometheus_file: str = None) -> None:
+        with self.lock:
+            if self.jsonl is not None:
+                self.jsonl.close()
+                self.jsonl = None
+            if jsonl_file:
+                os.makedirs(os.path.dirname(jsonl_file) or ".", exist_ok=True)
+                self.jsonl = open(jsonl_file, "a", buffering=1)
+            self.prometheus_file = prometheus_file
+
+    def write(self, record: dict) -> None:
+        """Append one record to the JSON lines file, call with the lock held"""
+        if self.jsonl is not None:
+            self.jsonl.write(json.dumps({"ts": time.time(), **record}) + "\n")
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        """Record one finished span of seconds"""
+        key = (name, _labels(labels))
+        with self.lock:
+            span = self.spans.setdefault(key, [0, 0.0, 0.0])
+            span[0] += 1
+            span[1] += seconds
+            span[2] = max(span[2], seconds)
+            self.write({"type": "span", "name": name, "seconds": seconds, **labels})
+
+    @contextmanager
+    def span(self, name: str, **labels) -> Iterator[None]:
+        """Time the block as one span, also when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+            self.write({"type": "counter", "name": name, "value": value, **labels})
+
+    def gauge(self, name: str, value: float, **labels) -> None:
+        key = (name, _labels(labels))
+        with self.lock:
+            self.gauges[key] = value
+            self.write({"type": "gauge", "name": name, "value": value, **labels})
+
+    def histogram(self, name: str, edges: Sequence[float], counts: Sequence[int], total: float, **labels) -> None:
+        """Replace a histogram snapshot, counts per bucket with one more open ended bucket than edges"""
+        key = (name, _labels(labels))
+        with self.lock:
+            self.histograms[key] = (tuple(edges), list(counts), total)
+            self.write({"type": "histogram", "name": name, "edges": list(edges), "counts": list(counts),
+                        "sum": total, **labels})
+
+    def summary(self) -> dict:
+        """Span count, total and mean seconds by name, labels folded into the name"""
+        with self.lock:
+            spans = dict(self.spans)
+        result = {}
+        for (name, labels), (count, total, longest) in sorted(spans.items()):
+            label = name + "".join(f".{value}" for _, value in labels)
+            result[label] = {"count": count, "total_s": total, "mean_s": total / count, "max_s": longest}
+        return result
+
+    def prometheus(self) -> str:
+        with self.lock:
+            spans = dict(self.spans)
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = dict(self.histograms)
+
+        lines = []
+        if spans:
+            lines += ["# HELP drawbot_span_seconds Time spent per step of a portrait.",
+                      "# TYPE drawbot_span_seconds summary"]
+            for (name, labels), (count, total, _) in sorted(spans.items()):
+                lines.append(f"drawbot_span_seconds_sum{_format_labels(labels, span=name)} {total:.6f}")
+                lines.append(f"drawbot_span_seconds_count{_format_labels(labels, span=name)} {count}")
+            lines.append("# TYPE drawbot_span_seconds_max gauge")
+            for (name, labels), (_, _, longest) in sorted(spans.items()):
+                lines.append(f"drawbot_span_seconds_max{_format_labels(labels, span=name)} {longest:.6f}")
+
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            typed = set()
+            for (name, labels), value in sorted(values.items()):
+                metric = _metric_name(name) + ("_total" if kind == "counter" else "")
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} {kind}")
+                    typed.add(metric)
+                lines.append(f"{metric}{_format_labels(labels)} {value:g}")
+
+        for (name, labels), (edges, counts, total) in sorted(histograms.items()):
+            metric = _metric_name(name)
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for edge, count in zip(list(edges) + ["+Inf"], counts):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_format_labels(labels, le=edge)} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, prometheus_file: Optional[str] = None) -> None:
+        """Rewrite the Prometheus file, atomically so a scrape never reads half of it"""
+        filename = prometheus_file or self.prometheus_file
+        if not filename:
+            return
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        partial = f"{filename}.part"
+        with open(partial, "w") as f:
+            f.write(self.prometheus())
+        os.replace(partial, filename)
+
+    def close(self) -> None:
+        self.export()
+        self.configure(None, self.prometheus_file)
+
+
+# Shared by every module, main.py points it at files
+METRICS = Metrics()
@@ -0,0 +1,157 @@
+from typing import Iterator, List, Sequence, Union
+
+import numpy as np
+
+# Column layout of PathArray.points, orientation (rx, ry, rz) is always 0.0 so it is not stored
+X, Y, Z = 0, 1, 2
+
+
+class PathArray:
+    """All paths of a drawing in one flat float32 (n, 3) x/y/z buffer with a path offset index.
+
+    Path i is points[offsets[i]:offsets[i + 1]] and, like the dict paths, starts and ends with a
+    pen up point around its pen down drawing points. Indexing with an int returns a view of one
+    path, indexing with a slice, index array or boolean mask returns a new PathArray.
+    """
+
+    def __init__(self, points: np.ndarray, offsets: np.ndarray):
+        self.points = np.ascontiguousarray(points, dtype=np.float32).reshape(-1, 3)
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+        if self.offsets[0] != 0 or self.offsets[-1] != len(self.points):
+            raise ValueError("offsets must start at 0 and end at the number of points")
+
+    @classmethod
+    def empty(cls) -> "PathArray":
+        return cls(np.empty((0, 3), dtype=np.float32), np.zeros(1, dtype=np.int64))
+
+    @classmethod
+    def from_arrays(cls, paths: Sequence[np.ndarray]) -> "PathArray":
+        """Build from a list of (n, 3) x/y/z arrays"""
+        if len(paths) == 0:
+            return cls.empty()
+        lengths = [len(path) for path in paths]
+        offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(np.concatenate([np.asarray(path, dtype=np.float32).reshape(-1, 3) for path in paths]), offsets)
+
+    @classmethod
+    def from_dicts(cls, paths: List[List[dict]]) -> "PathArray":
+        """Adapter for the old list of {"x","y","z","rx","ry","rz"} dict paths"""
+        return cls.from_arrays([np.array([(p["x"], p["y"], p["z"]) for p in path], dtype=np.float32)
+                                for path in paths])
+
+    @classmethod
+    def from_strokes(cls, xy: np.ndarray, stroke_offsets: np.ndarray,
+                     z_pen_down: float, z_pen_up: float) -> "PathArray":
+        """Build from flat (n, 2) drawing points, adding a pen up point before and after every stroke"""
+        xy = np.asarray(xy).reshape(-1, 2)
+        stroke_offsets = np.asarray(stroke_offsets, dtype=np.int64)
+        stroke_count = len(stroke_offsets) - 1
+        if stroke_count == 0:
+            return cls.empty()
+
+        offsets = stroke_offsets + 2 * np.arange(stroke_count + 1)
+        points = np.empty((offsets[-1], 3), dtype=np.float32)
+        # Every drawing point shifts by the two pen up points of each earlier stroke plus its own start point
+        stroke_index = np.repeat(np.arange(stroke_count), np.diff(stroke_offsets))
+        drawing = np.arange(len(xy)) + 2 * stroke_index + 1
+        points[drawing, :2] = xy
+        points[drawing, Z] = z_pen_down
+
+        starts, ends = offsets[:-1], offsets[1:] - 1
+        points[starts, :2] = points[starts + 1, :2]
+        points[ends, :2] = points[ends - 1, :2]
+        points[starts, Z] = z_pen_up
+        points[ends, Z] = z_pen_up
+        return cls(points, offsets)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """Number of points in each path, pen up points included"""
+        return np.diff(self.offsets)
+
+    @property
+    def stroke_lengths(self) -> np.ndarray:
+        """Pen down x/y length of each path in mm, the pen up points sit over the ends so add nothing"""
+        if len(self) == 0:
+            return np.zeros(0)
+        steps = np.zeros(len(self.points))
+        delta = np.diff(self.points[:, :2].astype(np.float64), axis=0)
+        steps[1:] = np.hypot(delta[:, 0], delta[:, 1])
+        # The step onto the first point of a path comes from the previous path
+        steps[self.offsets[:-1]] = 0.0
+        return np.add.reduceat(steps, self.offsets[:-1]) if len(self.points) else np.zeros(len(self))
+
+    @property
+    def total_points(self) -> int:
+        return len(self.points)
+
+    @property
+    def nbytes(self) -> int:
+        return self.points.nbytes + self.offsets.nbytes
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for i in range(len(self)):
+            yield self.points[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, key: Union[int, slice, Sequence[int], np.ndarray]) -> Union[np.ndarray, "PathArray"]:
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError("path index out of range")
+            return self.points[self.offsets[key]:self.offsets[key + 1]]
+        indices = np.arange(len(self))[key]
+        return self.take(indices)
+
+    def __repr__(self) -> str:
+        return f"PathArray(paths={len(self)}, points={self.total_points})"
+
+    def take(self, indices: Sequence[int], reverse: Union[Sequence[bool], np.ndarray, None] = None) -> "PathArray":
+        """New PathArray holding the given paths in the given order, optionally reversing some of them"""
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) == 0:
+            return PathArray.empty()
+        starts, lengths = self.offsets[indices], self.lengths[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # Gather index of every output point: its path start plus its position within the path
+        position = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths)
+        if reverse is not None:
+            flip = np.repeat(np.asarray(reverse, dtype=bool), lengths)
+            position[flip] = np.repeat(lengths - 1, lengths)[flip] - position[flip]
+        return PathArray(self.points[np.repeat(starts, lengths) + position], offsets)
+
+    def sort_by_length(self, reverse: bool = False) -> "PathArray":
+        """Stable sort by point count, same order as sorted(paths, key=len, reverse=reverse)"""
+        lengths = self.lengths
+        return self.take(np.argsort(-lengths if reverse else lengths, kind="stable"))
+
+    def to_dicts(self) -> List[List[dict]]:
+        """Adapter back to the old list of dict paths"""
+        return [[{"x": x, "y": y, "z": z, "rx": 0.0, "ry": 0.0, "rz": 0.0} for x, y, z in to_rows(path)]
+                for path in self]
+
+
+def as_path(path: Union[np.ndarray, List[dict], List[List[float]]]) -> np.ndarray:
+    """One path as an (n, 3) x/y/z array, from an array, a list of point dicts or a list of [x, y, z]"""
+    if isinstance(path, np.ndarray):
+        return path.reshape(-1, 3)
+    if len(path) > 0 and isinstance(path[0], dict):
+        return np.array([(p["x"], p["y"], p["z"]) for p in path], dtype=np.float32)
+    return np.asarray(path, dtype=np.float32).reshape(-1, 3)
+
+
+def to_rows(path: np.ndarray) -> List[List[float]]:
+    """x/y/z rows as python floats rounded to 0.1 um, so float32 values print without noise in robot commands"""
+    return np.round(path.astype(np.float64), 4).tolist()
+
+
+def as_path_array(paths: Union[PathArray, List[List[dict]], List[np.ndarray]]) -> PathArray:
+    """Accept a PathArray, the old list of dict paths or a list of (n, 3) arrays"""
+    if isinstance(paths, PathArray):
+        return paths
+    return PathArray.from_arrays([as_path(path) for path in paths])
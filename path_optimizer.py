@@ -0,0 +1,206 @@
+import threading
+from typing import List, Tuple, Union
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from path_array import PathArray, as_path_array
+from trajectory import TrajectoryPlanner
+
+# Rough pen up travel speed of a ServoP + Sync move at SpeedFactor 40, used to estimate time saved
+TRAVEL_SPEED_MM_S = 100.0
+
+
+def pen_up_distance(paths: PathArray, start: Tuple[float, float] = (0.0, 0.0)) -> float:
+    """Total pen up travel in mm when drawing the paths in order from start"""
+    if len(paths) == 0:
+        return 0.0
+    entries = paths.points[paths.offsets[:-1], :2].astype(np.float64)
+    exits = paths.points[paths.offsets[1:] - 1, :2].astype(np.float64)
+    previous = np.vstack((np.asarray(start, dtype=np.float64), exits[:-1]))
+    return float(np.linalg.norm(entries - previous, axis=1).sum())
+
+
+# Each Sync() in servo mode waits out the last ServoP (t=0.1s by default) plus a dashboard round trip
+SYNC_S = 0.15
+
+
+class DrawTimeModel:
+    """Predicts how long Robot.process_paths takes to draw paths in servo mode.
+
+    Every drawing point costs one ServoP period, with trajectory counting the points of the retimed
+    strokes, which is what Robot streams when it has the same planner. Every path adds a pen up move from the previous
+    one and a lift at each end, both at travel_speed, and syncs_per_path Sync() stops (pen up
+    move, pen down, settle, pen up) of sync_s each. calibrate() folds measured drawings back in;
+    the arms calibrate while vectorizing reads estimates, so both go through the model's lock.
+    """
+
+    def __init__(self, rate_hz: float = 30.0, travel_speed: float = TRAVEL_SPEED_MM_S, sync_s: float = SYNC_S,
+                 syncs_per_path: int = 4, start: Tuple[float, float] = (0.0, 0.0),
+                 trajectory: TrajectoryPlanner = None):
+        self.rate_hz = rate_hz
+        self.trajectory = trajectory
+        self.lock = threading.RLock()
+        self.travel_speed = travel_speed
+        self.sync_s = sync_s
+        self.syncs_per_path = syncs_per_path
+        self.start = start
+        self.calibrations = 0
+
+    def breakdown(self, paths: PathArray) -> dict:
+        """Estimated seconds split into drawing, pen up travel, lifts and Sync() stops"""
+        paths = as_path_array(paths)
+        with self.lock:
+            return self._breakdown(paths)
+
+    def _breakdown(self, paths: PathArray) -> dict:
+        if len(paths) == 0:
+            return {"drawing_s": 0.0, "travel_s": 0.0, "lift_s": 0.0, "sync_s": 0.0, "total_s": 0.0}
+        drawing_points = paths.total_points - 2 * len(paths)
+        first = paths.offsets[:-1]
+        lifts = np.abs(paths.points[first, 2] - paths.points[first + 1, 2]).astype(np.float64)
+        if self.trajectory is not None:
+            drawing_points = int(self.trajectory.sample_counts(paths, self.rate_hz).sum())
+        drawing_s = drawing_points / self.rate_hz
+        times = {
+            "drawing_s": drawing_s,
+            "travel_s": pen_up_distance(paths, self.start) / self.travel_speed,
+            "lift_s": 2 * float(lifts.sum()) / self.travel_speed,
+            "sync_s": len(paths) * self.syncs_per_path * self.sync_s,
+        }
+        times["total_s"] = sum(times.values())
+        return times
+
+    def estimate(self, paths: PathArray) -> float:
+        return self.breakdown(paths)["total_s"]
+
+    def calibrate(self, paths: PathArray, measured_s: float, weight: float = 0.5) -> None:
+        """Move sync_s towards the value that would have predicted measured_s for these paths.
+
+        All the fixed per path cost (round trips, settling, acceleration on short hops) is carried
+        by sync_s, so a few real drawings are enough to make estimates for the next ones honest.
+        """
+        paths = as_path_array(paths)
+        stops = len(paths) * self.syncs_per_path
+        if stops == 0:
+            return
+        with self.lock:
+            times = self._breakdown(paths)
+            fitted = max(0.0, (measured_s - times["total_s"] + times["sync_s"]) / stops)
+            self.sync_s += weight * (fitted - self.sync_s)
+            self.calibrations += 1
+
+
+def estimate_draw_time(paths: PathArray, rate_hz: float = 30.0, travel_speed: float = TRAVEL_SPEED_MM_S,
+                       start: Tuple[float, float] = (0.0, 0.0)) -> float:
+    """Rough seconds to draw in servo mode with the default DrawTimeModel"""
+    return DrawTimeModel(rate_hz, travel_speed, start=start).estimate(paths)
+
+
+class PathOptimizer:
+    """Orders paths to cut pen up travel: greedy nearest neighbour over path endpoints with a KD-tree,
+    drawing a path backwards when its end is closer, followed by 2-opt passes over the tour."""
+
+    def __init__(self, start: Tuple[float, float] = (0.0, 0.0), two_opt_passes: int = 5,
+                 travel_speed: float = TRAVEL_SPEED_MM_S, log: bool = True):
+        self.start = np.asarray(start, dtype=np.float64)
+        self.two_opt_passes = two_opt_passes
+        self.travel_speed = travel_speed
+        self.log = log
+
+    def nearest_neighbour(self, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Greedy tour, returns path order and whether each path is drawn reversed"""
+        n = len(starts)
+        # Endpoint e < n enters path e at its start, endpoint e >= n enters path e - n at its end
+        endpoints = np.vstack((starts, ends))
+        visited = np.zeros(n, dtype=bool)
+        order = np.empty(n, dtype=np.int64)
+        reverse = np.empty(n, dtype=bool)
+
+        active = np.arange(2 * n)
+        tree = cKDTree(endpoints)
+        visited_in_tree = 0
+        position = self.start
+        for step in range(n):
+            k = min(8, len(active))
+            while True:
+                _, found = tree.query(position, k=k)
+                candidates = active[np.atleast_1d(found)]
+                unvisited = candidates[~visited[candidates % n]]
+                if len(unvisited) or k == len(active):
+                    break
+                k = min(k * 4, len(active))
+
+            endpoint = unvisited[0]
+            path, backwards = endpoint % n, endpoint >= n
+            visited[path] = True
+            visited_in_tree += 1
+            order[step], reverse[step] = path, backwards
+            position = starts[path] if backwards else ends[path]
+
+            # Drop visited endpoints once they make up half the tree so queries stay short
+            if visited_in_tree * 4 >= len(active) and step < n - 1:
+                active = active[~visited[active % n]]
+                tree = cKDTree(endpoints[active])
+                visited_in_tree = 0
+        return order, reverse
+
+    def two_opt(self, entries: np.ndarray, exits: np.ndarray,
+                order: np.ndarray, reverse: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Reverse runs of paths (flipping each path in the run) while that shortens pen up travel"""
+        n = len(order)
+        entries, exits = entries.copy(), exits.copy()
+        for _ in range(self.two_opt_passes):
+            improved = False
+            for i in range(n):
+                previous = self.start if i == 0 else exits[i - 1]
+                # Reversing i..j joins previous -> exit of j and entry of i -> entry of j + 1
+                j = np.arange(i, n)
+                nxt = np.minimum(j + 1, n - 1)
+                has_next = j < n - 1
+                old = np.linalg.norm(entries[i] - previous) + \
+                    np.where(has_next, np.linalg.norm(exits[j] - entries[nxt], axis=1), 0.0)
+                new = np.linalg.norm(exits[j] - previous, axis=1) + \
+                    np.where(has_next, np.linalg.norm(entries[i] - entries[nxt], axis=1), 0.0)
+                gain = old - new
+                best = int(np.argmax(gain))
+                if gain[best] <= 1e-6:
+                    continue
+
+                j = i + best
+                order[i:j + 1] = order[i:j + 1][::-1]
+                reverse[i:j + 1] = ~reverse[i:j + 1][::-1]
+                entries[i:j + 1], exits[i:j + 1] = exits[i:j + 1][::-1].copy(), entries[i:j + 1][::-1].copy()
+                improved = True
+            if not improved:
+                break
+        return order, reverse
+
+    def optimize(self, paths: Union[PathArray, List[List[dict]]]) -> Tuple[PathArray, dict]:
+        """Reorder (and reverse where useful) paths, returns the new PathArray and travel stats"""
+        paths = as_path_array(paths)
+        if len(paths) == 0:
+            return paths, {"pen_up_before_mm": 0.0, "pen_up_after_mm": 0.0, "reversed_paths": 0,
+                           "estimated_time_saved_s": 0.0}
+
+        starts = paths.points[paths.offsets[:-1], :2].astype(np.float64)
+        ends = paths.points[paths.offsets[1:] - 1, :2].astype(np.float64)
+
+        order, reverse = self.nearest_neighbour(starts, ends)
+        entries = np.where(reverse[:, None], ends[order], starts[order])
+        exits = np.where(reverse[:, None], starts[order], ends[order])
+        order, reverse = self.two_opt(entries, exits, order, reverse)
+        optimized = paths.take(order, reverse)
+
+        before = pen_up_distance(paths, tuple(self.start))
+        after = pen_up_distance(optimized, tuple(self.start))
+        stats = {
+            "pen_up_before_mm": before,
+            "pen_up_after_mm": after,
+            "reversed_paths": int(reverse.sum()),
+            "estimated_time_saved_s": (before - after) / self.travel_speed,
+        }
+        if self.log:
+            print(f"Pen up travel: {before:.0f}mm -> {after:.0f}mm, {stats['reversed_paths']} paths reversed, "
+                  f"~{stats['estimated_time_saved_s']:.1f}s saved")
+        return optimized, stats
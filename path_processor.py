@@ -1,17 +1,38 @@
 from typing import List, Tuple
 from math import sqrt
 
+import numpy as np
+
+from metrics import DEBUG, INFO
+from path_array import PathArray
+
+ENGINES = ("numpy", "python")
+RESAMPLE_MODES = ("uniform", "adaptive")
+
 class PathProcessor:
     def __init__(self, paths: List[List[List[float]]], robot_bounds: Tuple[float, float, float, float],
                  image_dimensions: Tuple[int, int],
                  z_height_pen_down: float = 22, z_height_pen_up: float = 10,
-                 distance_mm: float = 1.0):
+                 distance_mm: float = 1.0, engine: str = "numpy", resample: str = "uniform",
+                 max_chord_error_mm: float = 0.5, max_segment_mm: float = 9.0, log: int = INFO):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}")
+        if resample not in RESAMPLE_MODES:
+            raise ValueError(f"Unknown resample mode {resample!r}, expected one of {RESAMPLE_MODES}")
         self.paths = paths
         self.robot_bounds = robot_bounds
         self.image_width, self.image_height = image_dimensions
         self.z_height_pen_down = z_height_pen_down
         self.z_height_pen_up = z_height_pen_up
         self.distance_mm = distance_mm
+        self.engine = engine
+        # Adaptive mode: keep points while the line bends more than max_chord_error_mm, and never
+        # leave more than max_segment_mm between two ServoP targets so straights stay a sane speed
+        self.resample = resample
+        self.max_chord_error_mm = max_chord_error_mm
+        self.max_segment_mm = max_segment_mm
+        # The python engine's mapping diagnostics are a dozen lines per path, only printed at DEBUG
+        self.log = log
 
     def map_to_robot_coords(self, points: List[List[float]], min_x: float, max_x: float, 
                        min_y: float, max_y: float) -> List[dict]:
@@ -23,14 +44,15 @@ class PathProcessor:
         robot_height = y_max - y_min
         
         # Print debugging information
-        print(f"\nMapping Diagnostics:")
-        print(f"Image dimensions: {self.image_width}x{self.image_height}")
-        print(f"Image aspect ratio: {self.image_width / self.image_height:.3f}")
-        print(f"Robot bounds: {self.robot_bounds}")
-        print(f"Robot drawing area: {robot_width}x{robot_height}")
-        print(f"Robot aspect ratio: {robot_width / robot_height:.3f}")
-        print(f"Input bounds: X({min_x:.1f}, {max_x:.1f}), Y({min_y:.1f}, {max_y:.1f})")
-        print(f"Input aspect ratio: {(max_x - min_x) / (max_y - min_y):.3f}")
+        if self.log >= DEBUG:
+            print(f"\nMapping Diagnostics:")
+            print(f"Image dimensions: {self.image_width}x{self.image_height}")
+            print(f"Image aspect ratio: {self.image_width / self.image_height:.3f}")
+            print(f"Robot bounds: {self.robot_bounds}")
+            print(f"Robot drawing area: {robot_width}x{robot_height}")
+            print(f"Robot aspect ratio: {robot_width / robot_height:.3f}")
+            print(f"Input bounds: X({min_x:.1f}, {max_x:.1f}), Y({min_y:.1f}, {max_y:.1f})")
+            print(f"Input aspect ratio: {(max_x - min_x) / (max_y - min_y):.3f}")
         
         # Calculate scaling factors
         input_width = max_x - min_x
@@ -45,10 +67,11 @@ class PathProcessor:
             scaled_height = input_height * scale
             y_offset = (robot_height - scaled_height) / 2
             
-            print(f"\nWidth limited scaling:")
-            print(f"Scale factor: {scale:.3f}")
-            print(f"Scaled dimensions: {robot_width}x{scaled_height}")
-            print(f"Y offset: {y_offset}")
+            if self.log >= DEBUG:
+                print(f"\nWidth limited scaling:")
+                print(f"Scale factor: {scale:.3f}")
+                print(f"Scaled dimensions: {robot_width}x{scaled_height}")
+                print(f"Y offset: {y_offset}")
             
             robot_points = []
             for x, y in points:
@@ -74,10 +97,11 @@ class PathProcessor:
             scaled_width = input_width * scale
             x_offset = (robot_width - scaled_width) / 2
             
-            print(f"\nHeight limited scaling:")
-            print(f"Scale factor: {scale:.3f}")
-            print(f"Scaled dimensions: {scaled_width}x{robot_height}")
-            print(f"X offset: {x_offset}")
+            if self.log >= DEBUG:
+                print(f"\nHeight limited scaling:")
+                print(f"Scale factor: {scale:.3f}")
+                print(f"Scaled dimensions: {scaled_width}x{robot_height}")
+                print(f"X offset: {x_offset}")
             
             robot_points = []
             for x, y in points:
@@ -162,6 +186,12 @@ class PathProcessor:
         if not points:
             return []
 
+        if self.resample == "adaptive":
+            xy = np.array([(p["x"], p["y"]) for p in points[1:-1]])
+            simplified = [{"x": x, "y": y, "z": points[1]["z"], "rx": 0.0, "ry": 0.0, "rz": 0.0}
+                          for x, y in self.adaptive_resample_array(xy).tolist()]
+            return [points[0]] + simplified + [points[-1]]
+
         drawing_points = points[1:-1]
 
         path_length = 0
@@ -175,7 +205,128 @@ class PathProcessor:
 
         return [points[0]] + resampled + [points[-1]]
 
-    def process_paths(self) -> Tuple[List[List[List[float]]], List[List[dict]]]:
+    def robot_transform(self, min_x: float, max_x: float,
+                        min_y: float, max_y: float) -> Tuple[float, float, float]:
+        """Scale and x/y offsets used by map_to_robot_coords for the given input bounds"""
+        x_min, x_max, y_min, y_max = self.robot_bounds
+        robot_width = x_max - x_min
+        robot_height = y_max - y_min
+        input_width = max_x - min_x
+        input_height = max_y - min_y
+
+        if input_width / input_height > robot_width / robot_height:
+            scale = robot_width / input_width
+            return scale, 0.0, (robot_height - input_height * scale) / 2
+        scale = robot_height / input_height
+        return scale, (robot_width - input_width * scale) / 2, 0.0
+
+    def map_to_robot_array(self, points: np.ndarray, min_x: float, min_y: float,
+                           transform: Tuple[float, float, float]) -> np.ndarray:
+        """Vectorised map_to_robot_coords: (n, 2) image points to clamped (n, 2) robot x/y, without pen up/down points"""
+        x_min, x_max, y_min, y_max = self.robot_bounds
+        scale, x_offset, y_offset = transform
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+        robot_xy = np.empty_like(points)
+        robot_xy[:, 0] = x_min + x_offset + (points[:, 0] - min_x) * scale
+        robot_xy[:, 1] = y_min + y_offset + (points[:, 1] - min_y) * scale
+        np.clip(robot_xy[:, 0], x_min, x_max, out=robot_xy[:, 0])
+        np.clip(robot_xy[:, 1], y_min, y_max, out=robot_xy[:, 1])
+        return robot_xy
+
+    def resample_array(self, xy: np.ndarray) -> np.ndarray:
+        """Vectorised resample_points on the drawing points of one path, using cumulative arc length and interpolation"""
+        if len(xy) < 2:
+            return xy
+
+        delta = np.diff(xy, axis=0)
+        segment_lengths = np.sqrt(delta[:, 0] * delta[:, 0] + delta[:, 1] * delta[:, 1])
+        cumulative = np.zeros(len(xy))
+        np.cumsum(segment_lengths, out=cumulative[1:])
+
+        path_length = cumulative[-1]
+        num_points = max(2, int(path_length / self.distance_mm))
+        targets = np.arange(1, num_points - 1) * (path_length / (num_points - 1))
+
+        # Segment k holds target t when cumulative[k] < t < cumulative[k + 1]; targets landing exactly
+        # on a vertex or past the end are dropped, matching uniform_resample
+        segment = np.searchsorted(cumulative[1:], targets, side="right")
+        valid = segment < len(xy) - 1
+        segment, targets = segment[valid], targets[valid]
+        valid = cumulative[segment] < targets
+        segment, targets = segment[valid], targets[valid]
+
+        ratio = (targets - cumulative[segment]) / segment_lengths[segment]
+        start, end = xy[segment], xy[segment + 1]
+        interpolated = start + ratio[:, None] * (end - start)
+        return np.concatenate((xy[:1], interpolated, xy[-1:]))
+
+    def simplify_array(self, xy: np.ndarray) -> np.ndarray:
+        """Douglas-Peucker: indices of the points needed to keep every dropped point within max_chord_error_mm of the line"""
+        keep = np.zeros(len(xy), dtype=bool)
+        keep[0] = keep[-1] = True
+        stack = [(0, len(xy) - 1)]
+        while stack:
+            first, last = stack.pop()
+            if last - first < 2:
+                continue
+            chord = xy[last] - xy[first]
+            offsets = xy[first + 1:last] - xy[first]
+            chord_length = np.hypot(chord[0], chord[1])
+            if chord_length > 0:
+                distances = np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / chord_length
+            else:
+                # Closed loop, measure from the shared start/end point instead
+                distances = np.hypot(offsets[:, 0], offsets[:, 1])
+            farthest = int(np.argmax(distances))
+            if distances[farthest] > self.max_chord_error_mm:
+                split = first + 1 + farthest
+                keep[split] = True
+                stack.append((first, split))
+                stack.append((split, last))
+        return np.flatnonzero(keep)
+
+    def adaptive_resample_array(self, xy: np.ndarray) -> np.ndarray:
+        """Curvature adaptive alternative to resample_array: dense where the line bends, sparse on straights"""
+        if len(xy) < 2:
+            return xy
+
+        kept = xy[self.simplify_array(xy)]
+        # Split long chords evenly so no step exceeds max_segment_mm
+        delta = np.diff(kept, axis=0)
+        pieces = np.maximum(1, np.ceil(np.hypot(delta[:, 0], delta[:, 1]) / self.max_segment_mm)).astype(np.int64)
+        segment = np.repeat(np.arange(len(delta)), pieces)
+        fraction = (np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)) / np.repeat(pieces, pieces)
+        interpolated = kept[segment] + fraction[:, None] * delta[segment]
+        return np.concatenate((interpolated, kept[-1:]))
+
+    def process_paths_numpy(self) -> Tuple[PathArray, PathArray]:
+        """Same paths as the python engine, computed as array operations"""
+        arrays = [np.asarray(path, dtype=np.float64).reshape(-1, 2) for path in self.paths]
+        all_points = np.concatenate(arrays)
+        min_x, min_y = all_points.min(axis=0)
+        max_x, max_y = all_points.max(axis=0)
+        transform = self.robot_transform(min_x, max_x, min_y, max_y)
+
+        # Map every point in one pass, then split back into paths
+        robot_points = self.map_to_robot_array(all_points, min_x, min_y, transform)
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        np.cumsum([len(points) for points in arrays], out=offsets[1:])
+
+        resample = self.adaptive_resample_array if self.resample == "adaptive" else self.resample_array
+        resampled = [resample(robot_xy) for robot_xy in np.split(robot_points, offsets[1:-1])]
+        resampled_offsets = np.zeros(len(resampled) + 1, dtype=np.int64)
+        np.cumsum([len(xy) for xy in resampled], out=resampled_offsets[1:])
+
+        original_paths = PathArray.from_strokes(robot_points, offsets, self.z_height_pen_down, self.z_height_pen_up)
+        all_paths = PathArray.from_strokes(np.concatenate(resampled), resampled_offsets,
+                                           self.z_height_pen_down, self.z_height_pen_up)
+        return original_paths, all_paths
+
+    def process_paths(self) -> Tuple[PathArray, PathArray]:
+        if self.engine == "numpy":
+            return self.process_paths_numpy()
+
         all_paths = []
         original_paths = []
 
@@ -191,4 +342,4 @@ class PathProcessor:
             all_paths.append(reduced_path)
             original_paths.append(robot_points)
 
-        return original_paths, all_paths
\ No newline at end of file
+        return PathArray.from_dicts(original_paths), PathArray.from_dicts(all_paths)
\ No newline at end of file
@@ -1,20 +1,59 @@
 import zmq
-from typing import List, Tuple, Union
+import struct
+from typing import Dict, Iterator, List, Tuple, Union
 import time
 
+import numpy as np
+
+from path_array import PathArray, as_path_array
+
+# Multipart messages, every path travels as raw float32 x/y/z bytes with no encoding step:
+#   listener -> sender  [b"READY", credit u32]     holds credit paths in all, less those still unacked
+#                       [b"ACK", seq u64]          path seq was handled, one credit back
+#   sender -> listener  [b"PATH", seq u64 + point count u32, points]
+#                       [b"END", path count u64]   end of one send_paths call
+SEQ = struct.Struct("<Q")
+PATH_HEADER = struct.Struct("<QI")
+CREDIT = struct.Struct("<I")
+
+
 class PathSender:
-    def __init__(self, log: bool = True):
+    """Streams drawings to a PathReceiver with acknowledgements and credit based flow control.
+
+    The sender binds a ROUTER socket and the listener connects with a DEALER and announces how
+    many paths it can hold. A path is only sent against a credit and every ACK returns one, so a
+    slow listener stalls the sender instead of losing paths the way PUB/SUB does, and memory on
+    both ends stays bounded by the window. ROUTER_MANDATORY makes an unroutable send an error.
+    """
+
+    def __init__(self, log: bool = True, address: str = "tcp://localhost:5555", hwm: int = 64):
         self.log = log
 
         self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.PUB)
-        self.socket.bind("tcp://localhost:5555")
+        self.socket = self.context.socket(zmq.ROUTER)
+        self.socket.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self.socket.setsockopt(zmq.SNDHWM, hwm)
+        self.socket.setsockopt(zmq.RCVHWM, hwm)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.bind(address)
+
+        self.credits: Dict[bytes, int] = {}
+        # Paths each listener hasn't acked yet, a READY can cross them on the wire
+        self.unacked: Dict[bytes, int] = {}
+        self.listener = None
+        self.sent_at: Dict[int, float] = {}
+        self.sequence = 0
+        self.acked = 0
+        self.ack_total = 0.0
+        self.stats = {}
 
     def __del__(self):
         self.close_connection()
 
     def close_connection(self) -> Tuple[bool, Union[str, Exception]]:
         try:
+            if self.socket.closed:
+                return True, "ZMQ connection already closed"
             self.socket.close()
             self.context.term()
             if self.log: print("ZMQ connection closed")
@@ -22,18 +61,152 @@ class PathSender:
         except Exception as e:
             return False, e
 
-    def send_paths(self, paths: List[List[dict]]) -> Tuple[bool, Union[str, Exception]]:
+    def handle(self, timeout_ms: int) -> bool:
+        """Process one message from a listener, False if none came within timeout_ms"""
+        if not self.socket.poll(timeout_ms, zmq.POLLIN):
+            return False
+        identity, kind, value = self.socket.recv_multipart()
+        if kind == b"READY":
+            # The window counts paths already on their way, whose ACKs give those credits back
+            self.credits[identity] = max(0, CREDIT.unpack(value)[0] - self.unacked.get(identity, 0))
+            self.listener = identity
+        elif kind == b"ACK":
+            seq = SEQ.unpack(value)[0]
+            self.credits[identity] = self.credits.get(identity, 0) + 1
+            sent_at = self.sent_at.pop(seq, None)
+            if sent_at is not None:
+                self.unacked[identity] = max(0, self.unacked.get(identity, 0) - 1)
+                self.ack_total += time.monotonic() - sent_at
+                self.acked += 1
+        return True
+
+    def wait_for(self, condition, timeout: float, per_ack: bool = False) -> bool:
+        """Handle messages until condition() holds, False after timeout seconds, or with per_ack
+        after timeout seconds without an ACK"""
+        deadline = time.monotonic() + timeout
+        while not condition():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            acked = self.acked
+            self.handle(int(remaining * 1000) + 1)
+            if per_ack and self.acked != acked:
+                deadline = time.monotonic() + timeout
+        return True
+
+    def send_paths(self, paths: Union[PathArray, List[List[dict]]], timeout: float = 30.0,
+                   wait: bool = True) -> Tuple[bool, Union[str, Exception]]:
+        """Send every path, blocking while the listener has no credit left.
+
+        timeout bounds each wait for credit, so it has to cover drawing one path when the
+        listener acknowledges after drawing. With wait the call returns once every path is acked,
+        the last window draining with up to timeout between one ACK and the next.
+        """
         try:
+            paths = as_path_array(paths)
             if self.log: print(f"Sending {len(paths)} paths")
-            time.sleep(0.1)
+            if not self.wait_for(lambda: self.listener is not None, timeout):
+                return False, TimeoutError(f"No listener connected after {timeout}s")
+
+            started = time.monotonic()
+            self.acked, self.ack_total = 0, 0.0
+            first_seq = self.sequence
             for path in paths:
-                print("-"*120)
-                print("sending:", path)
-                self.socket.send_json(path)
+                while True:
+                    if not self.wait_for(lambda: self.credits.get(self.listener, 0) > 0, timeout):
+                        return False, TimeoutError(f"Listener gave no credit for {timeout}s")
+                    seq = self.sequence
+                    try:
+                        # The path is a contiguous view of PathArray.points, sent without copying
+                        self.socket.send_multipart([self.listener, b"PATH", PATH_HEADER.pack(seq, len(path)), path],
+                                                   copy=False)
+                        break
+                    except zmq.ZMQError as e:
+                        if e.errno != zmq.EHOSTUNREACH:
+                            raise e
+                        # The listener went away, nothing is lost if it had acked everything so far
+                        self.credits.pop(self.listener, None)
+                        self.listener = None
+                        if self.sent_at:
+                            return False, ConnectionError(f"Listener disconnected with {len(self.sent_at)} paths unacknowledged")
+                        if not self.wait_for(lambda: self.listener is not None, timeout):
+                            return False, TimeoutError(f"No listener connected after {timeout}s")
+                self.credits[self.listener] -= 1
+                self.unacked[self.listener] = self.unacked.get(self.listener, 0) + 1
+                self.sequence += 1
+                self.sent_at[seq] = time.monotonic()
+            self.socket.send_multipart([self.listener, b"END", SEQ.pack(len(paths))])
+            sent = time.monotonic() - started
+
+            if wait and not self.wait_for(lambda: not any(seq >= first_seq for seq in self.sent_at), timeout, per_ack=True):
+                return False, TimeoutError(f"{len(self.sent_at)} paths not acknowledged, none for {timeout}s")
+            elapsed = time.monotonic() - started
+            nbytes = paths.points.nbytes
+            self.stats = {
+                "paths": len(paths),
+                "points": paths.total_points,
+                "bytes": nbytes,
+                "send_s": sent,
+                "total_s": elapsed,
+                "paths_per_s": len(paths) / elapsed if elapsed > 0 else 0.0,
+                "mb_per_s": nbytes / 1e6 / elapsed if elapsed > 0 else 0.0,
+                "mean_ack_ms": self.ack_total / self.acked * 1000 if self.acked else 0.0,
+            }
+            if self.log: print(f"Sent {len(paths)} paths ({nbytes / 1024:.1f} KiB) in {elapsed:.2f}s, "
+                               f"{self.stats['paths_per_s']:.0f} paths/s, mean ack {self.stats['mean_ack_ms']:.1f}ms")
             payload = True, "All paths sent successfully"
         except Exception as e:
             if self.log: print("send_paths exception: ", e)
             payload = False, e
         finally:
             return payload
-        
+
+
+class PathReceiver:
+    """Listener end of PathSender: yields each path as an (n, 3) float32 array viewing the received frame.
+
+    Call ack(seq) once a path is done with (Robot acks after drawing it) to let the sender send
+    another; at most window paths are ever queued on this side.
+    """
+
+    def __init__(self, address: str = "tcp://localhost:5555", window: int = 8, hwm: int = 64, log: bool = True):
+        self.log = log
+        self.window = window
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.SNDHWM, hwm)
+        self.socket.setsockopt(zmq.RCVHWM, hwm)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.connect(address)
+        self.outstanding = 0
+        self.received = 0
+        self.socket.send_multipart([b"READY", CREDIT.pack(window)])
+
+    def ack(self, seq: int) -> None:
+        self.outstanding -= 1
+        self.socket.send_multipart([b"ACK", SEQ.pack(seq)])
+
+    def paths(self, idle_s: float = 1.0) -> Iterator[Tuple[int, np.ndarray]]:
+        """(seq, path) for every path received, forever.
+
+        While idle with nothing outstanding READY is repeated, so a sender that starts (or
+        restarts) after this listener still learns about it.
+        """
+        while True:
+            if not self.socket.poll(int(idle_s * 1000), zmq.POLLIN):
+                if self.outstanding == 0:
+                    self.socket.send_multipart([b"READY", CREDIT.pack(self.window)])
+                continue
+            frames = self.socket.recv_multipart(copy=False)
+            kind = frames[0].bytes
+            if kind == b"PATH":
+                seq, count = PATH_HEADER.unpack(frames[1].bytes)
+                self.outstanding += 1
+                self.received += 1
+                yield seq, np.frombuffer(frames[2].buffer, dtype=np.float32).reshape(count, 3)
+            elif kind == b"END" and self.log:
+                print(f"End of drawing, {SEQ.unpack(frames[1].bytes)[0]} paths")
+
+    def close(self) -> None:
+        self.socket.close()
+        self.context.term()
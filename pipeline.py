@@ -0,0 +1,249 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, List, Tuple, Union
+
+from metrics import METRICS
+
+# Passed down the queues to tell the next stage to finish
+STOP = object()
+
+
+class Stage:
+    """One worker thread of a Pipeline.
+
+    work(item) returns (True, result) to hand result to the next stage or (False, error) to drop the
+    item, the same contract as the Robot methods. The first stage is a source: work(None) is called
+    over and over to produce items, after taking one of the pipeline's slots, and backs off from
+    backoff[0] up to backoff[1] seconds while it keeps failing (no camera, no face). The slot is
+    given back when the last stage is done with the item or any stage drops it. Items this stage
+    produced that the next one never gets to, because the pipeline stopped, go to on_drop so what
+    they hold (sheet area) can be given back. Time is split into
+    busy (inside work), starved (waiting for input) and blocked (waiting for a slot or for room in
+    the next queue).
+    """
+
+    def __init__(self, name: str, work: Callable[[Any], Tuple[bool, Union[Any, Exception]]],
+                 inbox: "queue.Queue", outbox: "queue.Queue", stop_event: threading.Event, log: bool = True,
+                 slots: threading.Semaphore = None, backoff: Tuple[float, float] = (0.5, 10.0),
+                 on_drop: Callable[[Any], None] = None):
+        self.name = name
+        self.work = work
+        self.inbox = inbox
+        self.outbox = outbox
+        self.stop_event = stop_event
+        self.log = log
+        self.slots = slots
+        self.backoff = backoff
+        self.on_drop = on_drop
+        self.drop_input: Callable[[Any], None] = None  # the previous stage's on_drop
+
+        self.items = 0
+        self.failures = 0
+        self.busy_s = 0.0
+        self.starved_s = 0.0
+        self.blocked_s = 0.0
+        self.started_at = None
+        self.thread = threading.Thread(target=self.run, name=f"pipeline-{name}", daemon=True)
+
+    def take_slot(self) -> bool:
+        """Wait for room in the pipeline, False if it is stopped meanwhile"""
+        if self.slots is None:
+            return True
+        waited = time.monotonic()
+        try:
+            while not self.slots.acquire(timeout=0.2):
+                if self.stop_event.is_set():
+                    return False
+            return True
+        finally:
+            self.blocked_s += time.monotonic() - waited
+
+    def free_slot(self) -> None:
+        if self.slots is not None:
+            self.slots.release()
+
+    def get(self) -> Any:
+        """Next item from the previous stage, STOP once the pipeline is stopped"""
+        waited = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    return self.inbox.get(timeout=0.2)
+                except queue.Empty:
+                    pass
+            return STOP
+        finally:
+            self.starved_s += time.monotonic() - waited
+
+    def put(self, data: Any) -> bool:
+        """Hand data to the next stage, False if the pipeline stopped before there was room for it"""
+        waited = time.monotonic()
+        try:
+            # The next stage may already have finished, don't wait on it forever
+            while not self.stop_event.is_set():
+                try:
+                    self.outbox.put(data, timeout=0.2)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        finally:
+            self.blocked_s += time.monotonic() - waited
+
+    def drop(self, data: Any, on_drop: Callable[[Any], None]) -> None:
+        self.free_slot()
+        if on_drop is not None:
+            try:
+                on_drop(data)
+            except Exception as e:
+                print(f"[{self.name}] dropping an item failed: {e}")
+
+    def drain(self) -> None:
+        """Drop whatever is left in the inbox once the pipeline stopped"""
+        while self.inbox is not None:
+            try:
+                item = self.inbox.get_nowait()
+            except queue.Empty:
+                return
+            if item is not STOP:
+                self.drop(item, self.drop_input)
+
+    def run(self) -> None:
+        self.started_at = time.monotonic()
+        delay = self.backoff[0]
+        while not self.stop_event.is_set():
+            item = None
+            if self.inbox is not None:
+                item = self.get()
+                if item is STOP:
+                    break
+            elif not self.take_slot():
+                break
+
+            started = time.monotonic()
+            try:
+                res, data = self.work(item)
+            except Exception as e:
+                res, data = False, e
+            busy = time.monotonic() - started
+            self.busy_s += busy
+            METRICS.observe("stage", busy, stage=self.name, result="ok" if res else "failed")
+
+            if not res:
+                self.failures += 1
+                if self.log: print(f"[{self.name}] {data}")
+                self.free_slot()
+                if self.inbox is None:
+                    # Don't spin on a missing camera or an empty room
+                    self.stop_event.wait(delay)
+                    delay = min(delay * 2, self.backoff[1])
+                continue
+            delay = self.backoff[0]
+            self.items += 1
+            if self.outbox is None:
+                self.free_slot()
+            elif not self.put(data):
+                self.drop(data, self.on_drop)
+        self.drain()
+        if self.outbox is not None:
+            try:
+                self.outbox.put_nowait(STOP)
+            except queue.Full:
+                pass  # stopped, the next stage ends on stop_event instead
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            "items": self.items,
+            "failures": self.failures,
+            "busy_s": self.busy_s,
+            "starved_s": self.starved_s,
+            "blocked_s": self.blocked_s,
+            "occupancy": self.busy_s / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+class Pipeline:
+    """Chain of stages, each on its own thread, joined by bounded queues.
+
+    Bounded queues alone still let every queue and every stage blocked on a full one hold an item,
+    so with max_in_flight at most that many items are anywhere between the start of the first stage
+    and the end of the last one. With max_in_flight=1 the next portrait is captured, stylized and
+    vectorized while the current one is drawing, and the visitor after that isn't captured before
+    the last stage has taken it.
+    """
+
+    def __init__(self, queue_size: int = 1, max_in_flight: int = None, source_backoff: Tuple[float, float] = (0.5, 10.0),
+                 log: bool = True):
+        self.queue_size = queue_size
+        self.max_in_flight = max_in_flight
+        self.slots = threading.Semaphore(max_in_flight) if max_in_flight else None
+        self.source_backoff = source_backoff
+        self.log = log
+        self.stages: List[Stage] = []
+        self.stop_event = threading.Event()
+        self.started_at = None
+
+    def add_stage(self, name: str, work: Callable[[Any], Tuple[bool, Union[Any, Exception]]],
+                  on_drop: Callable[[Any], None] = None) -> "Pipeline":
+        """on_drop(result) is called for results of work the next stage never takes once stopped"""
+        inbox = None
+        if self.stages:
+            inbox = queue.Queue(maxsize=self.queue_size)
+            self.stages[-1].outbox = inbox
+        stage = Stage(name, work, inbox, None, self.stop_event, log=self.log, slots=self.slots,
+                      backoff=self.source_backoff, on_drop=on_drop)
+        if self.stages:
+            stage.drop_input = self.stages[-1].on_drop
+        self.stages.append(stage)
+        return self
+
+    def start(self) -> "Pipeline":
+        self.started_at = time.monotonic()
+        for stage in self.stages:
+            stage.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop taking new work, stages finish the item they are on"""
+        self.stop_event.set()
+
+    @property
+    def running(self) -> bool:
+        return any(stage.thread.is_alive() for stage in self.stages)
+
+    def join(self, timeout: float = None) -> None:
+        for stage in self.stages:
+            stage.thread.join(timeout)
+        if self.stop_event.is_set():
+            # Anything a stage still handed on after the next one had finished
+            for stage in self.stages:
+                stage.drain()
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        completed = self.stages[-1].items if self.stages else 0
+        return {
+            "elapsed_s": elapsed,
+            "completed": completed,
+            "per_hour": completed / elapsed * 3600 if elapsed > 0 else 0.0,
+            "stages": {stage.name: stage.stats() for stage in self.stages},
+        }
+
+    def export_metrics(self) -> None:
+        """Throughput and per stage occupancy as METRICS gauges"""
+        stats = self.stats()
+        METRICS.gauge("portraits_per_hour", stats["per_hour"])
+        for name, stage in stats["stages"].items():
+            METRICS.gauge("stage_occupancy", stage["occupancy"], stage=name)
+            METRICS.gauge("stage_starved_seconds", stage["starved_s"], stage=name)
+            METRICS.gauge("stage_blocked_seconds", stage["blocked_s"], stage=name)
+
+    def report(self) -> str:
+        stats = self.stats()
+        lines = [f"{stats['completed']} done in {stats['elapsed_s']:.0f}s, {stats['per_hour']:.1f} per hour"]
+        for name, stage in stats["stages"].items():
+            lines.append(f"  {name:<10} {stage['occupancy']:6.1%} busy  {stage['items']:4d} ok  {stage['failures']:3d} failed  "
+                         f"starved {stage['starved_s']:7.1f}s  blocked {stage['blocked_s']:7.1f}s")
+        return "\n".join(lines)
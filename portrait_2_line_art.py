@@ -1,44 +1,300 @@
 import argparse
+import copy
 import json
-import random
+import os
+import threading
 import time
+import uuid
 import requests
 from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
 
-def upload_image(url, image_path):
-    upload_url = f"{url}/upload/image"
-    files = {'image': open(image_path, 'rb')}
-    data = {'type': 'input', 'overwrite': 'true'}
+from metrics import METRICS
+from stylize_cache import StylizeCache
 
-    try:
-        response = requests.post(upload_url, files=files, data=data)
-        response.raise_for_status()
-        result = response.json()
-        filename = result['name']
-        print(f"Image uploaded successfully. Server filename: {filename}")
-        return filename
-    except requests.exceptions.RequestException as ex:
-        print(f'POST {upload_url} failed: {ex}')
+try:
+    import websocket  # websocket-client, optional: without it completion is polled
+except ImportError:
+    websocket = None
+
+class ComfyClient:
+    """ComfyUI client that keeps one pooled HTTP session and listens for completion on the websocket.
+
+    ComfyUI pushes {"type": "executing", "data": {"node": null, "prompt_id": ...}} on /ws once a
+    prompt has finished, and "execution_error" when it fails. Those events are only sent to the
+    clientId the prompt was queued with, so the socket is opened before queueing. Without
+    websocket-client, or when the socket drops, /history is polled every poll_interval instead.
+    Parsed workflow files are cached and only re-read when they change on disk, and with a
+    StylizeCache an image already stylized with the same workflow never reaches the server.
+    """
+
+    def __init__(self, url: str, timeout: float = 600.0, poll_interval: float = 1.0,
+                 cache: Optional[StylizeCache] = None, log: bool = True):
+        self.url = url.rstrip("/")
+        self.cache = cache
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        # With the socket up /history is still checked this often, in case an event was missed
+        self.event_fallback_s = 10.0
+        self.log = log
+        self.client_id = uuid.uuid4().hex
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.workflows: Dict[str, Tuple[float, dict]] = {}
+        self.lock = threading.Lock()
+        self.finished: Dict[str, Optional[str]] = {}  # prompt_id -> error message, None when it succeeded
+        self.prompt_events: Dict[str, threading.Event] = {}
+        self.executing_at: Dict[str, float] = {}  # prompt_id -> first node started, splits queue from run time
+        self.ws = None
+        self.ws_thread = None
+        self.events = 0
+
+    def workflow(self, filepath: str) -> dict:
+        """Copy of the parsed workflow, read from disk only when the file changed"""
+        mtime = os.path.getmtime(filepath)
+        cached = self.workflows.get(filepath)
+        if cached is None or cached[0] != mtime:
+            with open(filepath, 'r') as file:
+                cached = (mtime, json.load(file))
+            self.workflows[filepath] = cached
+        return copy.deepcopy(cached[1])
+
+    @property
+    def listening(self) -> bool:
+        return self.ws_thread is not None and self.ws_thread.is_alive()
+
+    def connect_events(self) -> bool:
+        """Open the status websocket if it isn't already, False when only polling is available"""
+        if self.listening:
+            return True
+        if websocket is None:
+            return False
+        ws_url = self.url.replace("http", "ws", 1) + f"/ws?clientId={self.client_id}"
+        try:
+            self.ws = websocket.create_connection(ws_url, timeout=10)
+            self.ws.settimeout(None)
+        except Exception as ex:
+            if self.log: print(f"Websocket {ws_url} failed, polling instead: {ex}")
+            self.ws = None
+            return False
+        self.ws_thread = threading.Thread(target=self.event_loop, args=(self.ws,), name="comfy-events", daemon=True)
+        self.ws_thread.start()
+        return True
+
+    def event_loop(self, ws) -> None:
+        try:
+            while True:
+                message = ws.recv()
+                if not message:
+                    break
+                if isinstance(message, bytes):
+                    continue  # preview images
+                self.handle_event(json.loads(message))
+        except Exception as ex:
+            if self.ws is ws and self.log: print(f"Websocket closed, polling instead: {ex}")
+
+    def handle_event(self, event: dict) -> None:
+        self.events += 1
+        kind, data = event.get("type"), event.get("data", {})
+        prompt_id = data.get("prompt_id")
+        if kind == "executing" and data.get("node") is not None and prompt_id:
+            with self.lock:
+                self.executing_at.setdefault(prompt_id, time.monotonic())
+        elif kind == "executing" and data.get("node") is None and prompt_id:
+            self.finish(prompt_id, None)
+        elif kind == "execution_success" and prompt_id:
+            self.finish(prompt_id, None)
+        elif kind == "execution_error" and prompt_id:
+            self.finish(prompt_id, data.get("exception_message", "execution error"))
+
+    def finish(self, prompt_id: str, error: Optional[str]) -> None:
+        with self.lock:
+            if prompt_id in self.finished and error is None:
+                return
+            self.finished[prompt_id] = error
+            event = self.prompt_events.get(prompt_id)
+        if event is not None:
+            event.set()
+
+    def upload_image(self, image_path: str) -> Tuple[bool, Union[str, Exception]]:
+        upload_url = f"{self.url}/upload/image"
+        try:
+            with open(image_path, 'rb') as image:
+                response = self.session.post(upload_url, files={'image': image}, data={'type': 'input', 'overwrite': 'true'})
+            response.raise_for_status()
+            filename = response.json()['name']
+            if self.log: print(f"Image uploaded successfully. Server filename: {filename}")
+            return True, filename
+        except Exception as ex:
+            return False, ex
+
+    def queue_prompt(self, prompt: dict) -> Tuple[bool, Union[str, Exception]]:
+        try:
+            r = self.session.post(f"{self.url}/prompt", json={"prompt": prompt, "client_id": self.client_id})
+            r.raise_for_status()
+            prompt_id = r.json()['prompt_id']
+        except Exception as ex:
+            return False, ex
+        with self.lock:
+            self.prompt_events.setdefault(prompt_id, threading.Event())
+            if prompt_id in self.finished:
+                self.prompt_events[prompt_id].set()
+        return True, prompt_id
+
+    def get_history(self, prompt_id: str) -> Tuple[bool, Union[dict, Exception]]:
+        try:
+            r = self.session.get(f"{self.url}/history/{prompt_id}")
+            r.raise_for_status()
+            return True, r.json()
+        except Exception as ex:
+            return False, ex
+
+    def wait_for(self, prompt_id: str, timeout: float = None) -> Tuple[bool, Union[dict, Exception]]:
+        """Block until the prompt is done and return its history entry"""
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self.lock:
+            event = self.prompt_events.setdefault(prompt_id, threading.Event())
+        while True:
+            if not event.is_set():
+                # A history entry only appears once the prompt has finished executing
+                res, history = self.get_history(prompt_id)
+                if res and prompt_id in history:
+                    status = history[prompt_id].get("status", {})
+                    self.finish(prompt_id, "execution error" if status.get("status_str") == "error" else None)
+            if event.is_set():
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False, TimeoutError(f"Prompt {prompt_id} not finished after {timeout or self.timeout}s")
+            interval = self.event_fallback_s if self.listening else self.poll_interval
+            event.wait(min(interval, remaining))
+
+        with self.lock:
+            error = self.finished.pop(prompt_id, None)
+            self.prompt_events.pop(prompt_id, None)
+        if error is not None:
+            return False, RuntimeError(f"Prompt {prompt_id} failed: {error}")
+        res, history = self.get_history(prompt_id)
+        if not res:
+            return False, history
+        return True, history.get(prompt_id, {})
+
+    def download_image(self, filename: str, save_path: Path) -> Tuple[bool, Union[Path, Exception]]:
+        try:
+            response = self.session.get(f"{self.url}/output/{filename}", stream=True)
+            response.raise_for_status()
+            with open(save_path, 'wb') as f:
+                for chunk in response.iter_content(64 * 1024):
+                    f.write(chunk)
+            if self.log: print(f"Image saved locally as: {save_path}")
+            return True, save_path
+        except Exception as ex:
+            return False, ex
+
+    def run(self, filepath: str, image_path: str, image_node: str = "5", output_node: str = "64",
+            output_dir: str = "output") -> Tuple[bool, Union[Path, Exception]]:
+        """Upload image_path into image_node of the workflow, run it and download output_node's image"""
+        prompt = self.workflow(filepath)
+        cache_key = None
+        if self.cache is not None:
+            try:
+                with open(image_path, 'rb') as image:
+                    cache_key = self.cache.key(image.read(), prompt, image_node) + f"_{output_node}"
+            except Exception as ex:
+                return False, ex
+            cached = self.cache.get(cache_key)
+            METRICS.count("stylize_cache_lookups", result="miss" if cached is None else "hit")
+            if cached is not None:
+                return True, cached
+
+        self.connect_events()
+        with METRICS.span("comfy_upload"):
+            res, uploaded_filename = self.upload_image(image_path)
+        if not res:
+            return False, uploaded_filename
+        prompt[image_node]["inputs"]["image"] = uploaded_filename
+
+        started = time.monotonic()
+        res, prompt_id = self.queue_prompt(prompt)
+        if not res:
+            return False, prompt_id
+        if self.log: print(f'Prompt ID: {prompt_id}')
+
+        res, entry = self.wait_for(prompt_id)
+        finished = time.monotonic()
+        with self.lock:
+            executing_at = self.executing_at.pop(prompt_id, None)
+        if not res:
+            METRICS.count("comfy_failures")
+            return False, entry
+        if self.log: print(f"Prompt finished in {finished - started:.1f}s")
+        METRICS.observe("comfy_prompt", finished - started)
+        if executing_at is not None:
+            # Only known from the websocket, polling sees the prompt when it is already done
+            METRICS.observe("comfy_queue", executing_at - started)
+            METRICS.observe("comfy_run", finished - executing_at)
+
+        output_info = entry.get('outputs', {}).get(output_node, {}).get('images', [{}])[0]
+        filename = output_info.get('filename', 'unknown.png')
+        save_path = Path(output_dir) / filename
+        save_path.parent.mkdir(exist_ok=True)  # Create 'output' directory if it doesn't exist
+        with METRICS.span("comfy_download"):
+            res, save_path = self.download_image(filename, save_path)
+        if res and cache_key is not None:
+            self.cache.put(cache_key, save_path)
+        return res, save_path
+
+    def close(self) -> None:
+        ws, self.ws = self.ws, None
+        if ws is not None:
+            # Skip the close handshake, event_loop is blocked in recv and would eat the reply
+            ws.abort()
+            ws.shutdown()
+        self.session.close()
+
+
+# One client per server so consecutive portraits reuse the session, socket and workflow, and one
+# result cache shared by all of them
+_clients: Dict[str, ComfyClient] = {}
+_cache: Optional[StylizeCache] = None
+
+def get_client(ip, port) -> ComfyClient:
+    return client_for(f"http://{ip}:{port}")
+
+def client_for(url) -> ComfyClient:
+    global _cache
+    url = url.rstrip("/")
+    if url not in _clients:
+        if _cache is None: _cache = StylizeCache()
+        _clients[url] = ComfyClient(url, cache=_cache)
+    return _clients[url]
+
+# The module level helpers from before ComfyClient, kept for scripts that call them. They go through
+# the pooled client of their server and keep the old return values, None when a request failed
+
+def upload_image(url, image_path):
+    res, filename = client_for(url).upload_image(image_path)
+    if not res:
+        print(f'POST {url}/upload/image failed: {filename}')
         return None
-    finally:
-        files['image'].close()
+    return filename
 
 def queue_prompt(url, prompt):
-    p = {"prompt": prompt}
-    data = json.dumps(p).encode('utf-8')
-    prompt_url = f"{url}/prompt"
-    try:
-        r = requests.post(prompt_url, data=data)
-        r.raise_for_status()
-        return r.json()
-    except requests.exceptions.RequestException as ex:
-        print(f'POST {prompt_url} failed: {ex}')
+    res, prompt_id = client_for(url).queue_prompt(prompt)
+    if not res:
+        print(f'POST {url}/prompt failed: {prompt_id}')
         return None
+    return {"prompt_id": prompt_id}
 
 def get_queue(url):
     queue_url = f"{url}/queue"
     try:
-        r = requests.get(queue_url)
+        r = client_for(url).session.get(queue_url)
         r.raise_for_status()
         return r.json()
     except requests.exceptions.RequestException as ex:
@@ -46,91 +302,30 @@ def get_queue(url):
         return None
 
 def get_history(url, prompt_id):
-    history_url = f"{url}/history/{prompt_id}"
-    try:
-        r = requests.get(history_url)
-        r.raise_for_status()
-        return r.json()
-    except requests.exceptions.RequestException as ex:
-        print(f'GET {history_url} failed: {ex}')
+    res, history = client_for(url).get_history(prompt_id)
+    if not res:
+        print(f'GET {url}/history/{prompt_id} failed: {history}')
         return None
+    return history
 
 def download_image(url, save_path):
+    """url is the full address of the image on the server"""
+    parts = urlsplit(url)
     try:
-        response = requests.get(url, stream=True)
+        response = client_for(f"{parts.scheme}://{parts.netloc}").session.get(url, stream=True)
         response.raise_for_status()
         with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(1024):
+            for chunk in response.iter_content(64 * 1024):
                 f.write(chunk)
         print(f"Image saved locally as: {save_path}")
     except requests.exceptions.RequestException as ex:
         print(f"Failed to download the image: {ex}")
 
 def main(ip, port, filepath, image_path):
-    url = f"http://{ip}:{port}"
-
-    # Upload the image
-    uploaded_filename = upload_image(url, image_path)
-    if uploaded_filename is None:
-        print("Image upload failed. Exiting.")
-        return
-
-    # Load the workflow JSON
-    with open(filepath, 'r') as file:
-        prompt_text = json.load(file)
-
-    prompt_text["5"]["inputs"]["image"] = uploaded_filename
-
-    # Queue the prompt
-    response1 = queue_prompt(url, prompt_text)
-    if response1 is None:
-        print("Failed to queue the prompt.")
-        return
-
-    prompt_id = response1['prompt_id']
-    print(f'Prompt ID: {prompt_id}')
-    print('-' * 20)
-
-    # Monitor the queue
-    while True:
-        time.sleep(5)
-        queue_response = get_queue(url)
-        if queue_response is None:
-            continue
-
-        queue_pending = queue_response.get('queue_pending', [])
-        queue_running = queue_response.get('queue_running', [])
-
-        # Check position in queue
-        for position, item in enumerate(queue_pending):
-            if item[1] == prompt_id:
-                print(f'Queue running: {len(queue_running)}, Queue pending: {len(queue_pending)}, Workflow is in position {position + 1} in the queue.')
-
-        # Check if the prompt is currently running
-        for item in queue_running:
-            if item[1] == prompt_id:
-                print(f'Queue running: {len(queue_running)}, Queue pending: {len(queue_pending)}, Workflow is currently running.')
-                break
-
-        if not any(prompt_id in item for item in queue_pending + queue_running):
-            break
-
-    # Retrieve the output
-    history_response = get_history(url, prompt_id)
-    if history_response is None:
-        print("Failed to retrieve history.")
-        return
-
-    output_info = history_response.get(prompt_id, {}).get('outputs', {}).get('64', {}).get('images', [{}])[0]
-    filename = output_info.get('filename', 'unknown.png')
-    output_url = f"{url}/output/{filename}"
-
-    print(f"Output URL: {output_url}")
-
-    # Save the image locally
-    save_path = Path("output") / filename
-    save_path.parent.mkdir(exist_ok=True)  # Create 'output' directory if it doesn't exist
-    download_image(output_url, save_path)
+    res, save_path = get_client(ip, port).run(filepath, image_path)
+    if not res:
+        print(f"ComfyUI request failed: {save_path}")
+        return None
     return save_path
 
 if __name__ == "__main__":
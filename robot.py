@@ -1,22 +1,64 @@
+import os
+import json
 import zmq
 import time
 import socket
 from typing import Tuple, Union, List
 import keyboard
 
+from command_channel import RTT_BUCKETS_MS, CommandChannel, configure_low_latency
+from feedback import FeedbackReader
+from metrics import METRICS
+from path_array import PathArray, as_path_array, to_rows
+from path_sender import PathReceiver
+from stream_scheduler import StreamScheduler
+from trajectory import TrajectoryPlanner
+
 class Robot:
-    def __init__(self, log: bool = True):
-        self.log = True
+    def __init__(self, log: bool = True, ip: str = None, main_port: int = None, feedback_port: int = None,
+                 user: int = None, trajectory: TrajectoryPlanner = None):
+        self.log = log
         if self.log: print("Initializing Robot")
-        self.ip = '192.168.1.6'
+        # Unset arguments come from DOBOT_IP / DOBOT_PORT / DOBOT_FEEDBACK_PORT / DOBOT_USER, e.g. to point at dobot_sim.py
+        self.ip = ip or os.environ.get("DOBOT_IP", '192.168.1.6')
         # self.ip = 'dobot.local'
-        self.user = 6
+        self.user = user if user is not None else int(os.environ.get("DOBOT_USER", 6))
         self.speed = 40
-        self.main_port = 29999
-        self.feedback_port = 30004
+        self.servo_rate = 30 # ServoP points per second while drawing
+        # "servo" streams ServoP points from here, "blended" queues each stroke as MovL moves blended with CP
+        self.motion_mode = "servo"
+        self.blend_ratio = 50 # CP ratio 0-100 used in blended mode
+        # In servo mode strokes are retimed to speed, acceleration and corner limits before streaming,
+        # None streams the points as PathProcessor spaced them, one per ServoP period
+        self.trajectory = trajectory
+        self.main_port = main_port or int(os.environ.get("DOBOT_PORT", 29999))
+        self.feedback_port = feedback_port or int(os.environ.get("DOBOT_FEEDBACK_PORT", 30004))
+        self.pipelined = True # send commands without waiting for the previous reply
+        self.connect()
+        # "sync" stops with Sync() at every pen move, "near" waits for feedback to put the TCP within
+        # settle_tolerance mm of the target and falls back to Sync() if that doesn't happen in time
+        self.settle_mode = "sync"
+        self.settle_tolerance = 0.5
+        self.settle_timeout = 5.0
+        self.running = False
+        self.stream_timings = []
+        # process_paths reconnects and resumes this many times per drawing before giving up, restarting an
+        # interrupted stroke resume_overlap points before the last point sent so the join doesn't leave a gap
+        self.max_recoveries = 3
+        # Strokes process_paths has put the pen down for, whatever became of them
+        self.pen_downs = 0
+        self.resume_overlap = 3
+        self.checkpoint = {"path": 0, "point": 0}
+        self.recovery_stats = {"recoveries": 0, "time_lost_s": 0.0, "errors": []}
+
+    def connect(self) -> bool:
+        """Open the dashboard and feedback connections, True when the dashboard is up"""
         res, self.connection = self.setup_connection(self.ip, self.main_port)
+        self.channel = CommandChannel(self.connection, log=self.log) if res and self.pipelined else None
+        connected = res
         res, self.feedback_connection = self.setup_connection(self.ip, self.feedback_port)
-        self.running = False
+        self.feedback = FeedbackReader(self.feedback_connection, log=self.log) if res else None
+        return connected
 
     def __del__(self):
         self.close_connections()
@@ -27,8 +69,12 @@ class Robot:
     def __exit__(self, exc_type, exc_value, traceback):
         self.close_connection()
 
-    def send_message(self, message: str) -> Tuple[bool, Union[str, Exception]]:
+    def send_message(self, message: str, wait: bool = True) -> Tuple[bool, Union[str, Exception]]:
         try:
+            if self.channel is not None:
+                # Pipelined: with wait=False the PendingReply is returned instead of the reply
+                pending = self.channel.send(message)
+                return pending.wait(self.channel.timeout) if wait else (True, pending)
             # if self.log: print("Sending:", message)
             self.connection.send(message.encode())
             data = self.connection.recv(1440)
@@ -37,14 +83,9 @@ class Robot:
         except Exception as e:
             return False, e
         
-    def setup_zmq(self) -> Tuple[bool, Union[Tuple[zmq.Context, zmq.Socket], Exception]]:
+    def setup_zmq(self) -> Tuple[bool, Union[PathReceiver, Exception]]:
         try:
-            context = zmq.Context()
-            socket = context.socket(zmq.SUB)
-            socket.connect("tcp://localhost:5555") 
-            socket.setsockopt_string(zmq.SUBSCRIBE, "")
-            time.sleep(0.5)
-            return True, (context, socket)
+            return True, PathReceiver("tcp://localhost:5555", log=self.log)
         except Exception as e:
             return False, e
 
@@ -52,6 +93,7 @@ class Robot:
         try:
             if self.log: print(f"Attempting to connect to {ip}:{port}")
             con = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            configure_low_latency(con)
             con.connect((ip, port))
             if self.log: print(f"Connected to {ip}:{port}")
             return True, con
@@ -61,54 +103,232 @@ class Robot:
 
     def close_connections(self) -> Tuple[bool, Union[str, Exception]]:
         try:
+            if getattr(self, 'channel', None) is not None: self.channel.close()
+            if getattr(self, 'feedback', None) is not None: self.feedback.close()
             if hasattr(self, 'connection'): self.connection.close()
             if hasattr(self, 'feedback_connection'): self.feedback_connection.close()
-            if hasattr(self, 'zmq_socket'): self.zmq_socket.close()
-            if hasattr(self, 'zmq_context'): self.zmq_context.term()
+            if getattr(self, 'receiver', None) is not None: self.receiver.close()
             if self.log: print("Connections closed")
             return True, "Connections closed"
         except Exception as e:
             return False, e
         
-    def process_paths(self, paths:List[List[dict]]) -> Tuple[bool, Union[str, Exception]]:
+    def draw_point(self, x: float, y: float, z: float) -> Tuple[bool, Union[str, Exception]]:
+        # Streamed points don't wait for their reply, the Sync() at the end of the path does
+        return self.servo_p(x, y, z, 0.0, 0.0, 0.0, wait=False)
+
+    def queue_blended(self, coords: List[List[float]]) -> dict:
+        """Queue a stroke as MovL moves and let the controller blend and interpolate them, no client pacing"""
+        start = time.monotonic()
+        for x,y,z in coords:
+            self.mov_l(x, y, z, 0.0, 0.0, 0.0, wait=False)
+        return {"points": len(coords), "queued_s": time.monotonic() - start}
+
+    def check(self, result: Tuple[bool, Union[bytes, Exception]], what: str) -> None:
+        """Raise when a command failed to send or the controller answered with a non-zero ErrorID"""
+        res, data = result
+        if not res:
+            raise ConnectionError(f"{what}: {data}")
+        if isinstance(data, bytes) and not data.lstrip().startswith(b"0,"):
+            raise RuntimeError(f"{what}: {data}")
+
+    def initialize(self, blended: bool) -> None:
+        self.check(self.clear_error(), "ClearError")
+        self.check(self.enable_robot(), "EnableRobot")
+        self.check(self.set_speed_factor(self.speed), "SpeedFactor")
+        self.check(self.set_user(self.user), "User")
+        if blended: self.check(self.set_cp(self.blend_ratio), "CP")
+
+    def draw_stroke(self, coords_list: List[List[float]], start: int, scheduler: StreamScheduler,
+                    blended: bool, move_settle) -> dict:
+        """Draw one path from its drawing point start onwards, pen up and back up again.
+
+        Raises on any failed command so process_paths can recover. self.checkpoint["point"] follows
+        the streamed points; in blended mode the queued moves say nothing about progress so an
+        interrupted stroke starts over.
+        """
+        errors_before = self.channel.error_replies if self.channel is not None else 0
+        first = 1 + start
+        z_up = coords_list[0][2]
+        x,y,z = coords_list[first]
+        self.check(move_settle(x,y,z_up), "Pen up move")
+        # Counted before the move, a pen down that fails may still have touched the paper
+        self.pen_downs += 1
+        self.check(move_settle(x,y,z), "Pen down")
+
+        sent = []
+        def first_rejected() -> int:
+            """Index in sent of the first point the controller refused, -1 if none has been so far"""
+            for i, pending in enumerate(sent):
+                if not pending.event.is_set():
+                    break
+                if pending.reply is None or not pending.reply.lstrip().startswith(b"0,"):
+                    return i
+            return -1
+
+        if blended:
+            timing = self.queue_blended(coords_list[first + 1:-1])
+        else:
+            def send(x, y, z):
+                res, pending = self.draw_point(x, y, z)
+                self.check((res, b"0," if res else pending), "ServoP")
+                if self.channel is not None:
+                    sent.append(pending)
+                    # Stop streaming into an alarm as soon as a refusal comes back
+                    if pending.event.is_set() and first_rejected() >= 0:
+                        raise RuntimeError("ServoP rejected by the controller")
+                self.checkpoint["point"] += 1
+            self.checkpoint["point"] = start
+            try:
+                timing = scheduler.stream(coords_list[first:-1], send)
+            finally:
+                if self.channel is not None:
+                    self.channel.drain()
+                    rejected = first_rejected()
+                    if rejected >= 0:
+                        # Only what the controller accepted counts as drawn
+                        self.checkpoint["point"] = start + rejected
+
+        self.check(self.settle(*coords_list[-2]), "Settle")
+        x,y,z = coords_list[-1]
+        self.check(move_settle(x,y,z), "Pen up")
+        if self.channel is not None and self.channel.error_replies > errors_before:
+            raise RuntimeError(f"{self.channel.error_replies - errors_before} commands rejected by the controller")
+        return timing
+
+    def recover(self, coords_list: List[List[float]], blended: bool) -> None:
+        """Reconnect if needed, clear the error, re-enable and lift the pen off the interrupted stroke.
+
+        In servo mode the pen goes up at the last point the controller accepted, which the arm was
+        at or heading to. Queued blended moves give no such point, so the pen is lifted straight up
+        in the drawing's user frame instead.
+        """
+        if self.channel is None or self.channel.closed:
+            if self.log: print("Reconnecting...")
+            for closer in (self.channel, self.feedback, self.connection, self.feedback_connection):
+                try:
+                    closer.close()
+                except Exception:
+                    pass
+            if not self.connect():
+                raise ConnectionError(f"Could not reconnect to {self.ip}:{self.main_port}")
+        self.initialize(blended)
+        z_up = coords_list[0][2]
+        if blended:
+            lift = z_up - coords_list[1][2]
+            self.check(self.rel_mov_l_user(0.0, 0.0, lift, 0.0, 0.0, 0.0), "Pen lift")
+            self.check(self.sync(), "Pen lift")
+        else:
+            x, y, _ = coords_list[max(1, self.checkpoint["point"])]
+            self.check(self.servo_p_sync(x, y, z_up, 0.0, 0.0, 0.0), "Pen lift")
+
+    def save_checkpoint(self, checkpoint_file: str) -> None:
+        partial = f"{checkpoint_file}.part"
+        with open(partial, "w") as f:
+            json.dump({**self.checkpoint, **self.recovery_stats}, f)
+        os.replace(partial, checkpoint_file)
+
+    def process_paths(self, paths: Union[PathArray, List[List[dict]]], rate_hz: float = None,
+                      motion: str = None, checkpoint_file: str = None, resume: bool = False,
+                      checkpoint: dict = None) -> Tuple[bool, Union[str, Exception]]:
+        """Draw every path, recovering from controller errors and dropped connections.
+
+        Progress is kept in self.checkpoint as the next path and the drawing points of it already
+        sent. After a failure the robot is reconnected if needed, ClearError / EnableRobot are
+        sent, the pen is lifted and the interrupted path is resumed, up to max_recoveries times;
+        a recovery that fails itself counts as one of them and is tried again.
+        With checkpoint_file the checkpoint is written after every path, and resume starts from
+        the one saved there, e.g. after the whole process died. A checkpoint given directly starts
+        the drawing there instead, e.g. one another arm reached before it failed.
+        """
         try:
             # Setup initial state
+            paths = as_path_array(paths)
             path_count = len(paths)
-            total_points = sum(len(path) for path in paths)
+            total_points = paths.total_points
             self.running = True
-            
+
+            self.checkpoint = {"path": 0, "point": 0}
+            if checkpoint:
+                self.checkpoint = {"path": checkpoint["path"], "point": checkpoint["point"]}
+            if resume and checkpoint_file and os.path.exists(checkpoint_file):
+                with open(checkpoint_file) as f:
+                    saved = json.load(f)
+                self.checkpoint = {"path": saved["path"], "point": saved["point"]}
+                if self.log: print(f"Resuming at path {saved['path']}, point {saved['point']}")
+            self.recovery_stats = {"recoveries": 0, "time_lost_s": 0.0, "errors": []}
+            self.pen_downs = 0
+
+            scheduler = StreamScheduler(rate_hz or self.servo_rate)
+            self.stream_timings = scheduler.timings
+            blended = (motion or self.motion_mode) == "blended"
+            if self.trajectory is not None and not blended:
+                # Deterministic, so a checkpoint's point index still matches when resuming the same file
+                paths = self.trajectory.retime(paths, scheduler.rate_hz)
+            move_settle = self.mov_l_settle if blended else self.servo_p_settle
+
             # Initialize robot
-            self.enable_robot()
-            self.clear_error()
-            self.set_speed_factor(self.speed)
-            self.set_user(self.user)
-            
-            completed_paths = 0
-            completed_points = 0
-            
-            for coords_list in paths:
-                
-                x,y,z,rx,ry,rz = coords_list[0]['x'], coords_list[0]['y'], coords_list[0]['z'], coords_list[0]['rx'], coords_list[0]['ry'], coords_list[0]['rz']
-                self.servo_p_sync(x,y,z,rx,ry,rz)
-                x,y,z,rx,ry,rz = coords_list[1]['x'], coords_list[1]['y'], coords_list[1]['z'], coords_list[1]['rx'], coords_list[1]['ry'], coords_list[1]['rz']
-                self.servo_p_sync(x,y,z,rx,ry,rz)
-                
-                # Process each path
-                for coords in coords_list[1:-1]:
-                    # handle_keyboard()  # Check for keyboard input
-                    x,y,z,rx,ry,rz = coords['x'], coords['y'], coords['z'], coords['rx'], coords['ry'], coords['rz']
-                    self.servo_p(x,y,z,rx,ry,rz)
-                    time.sleep(1.0/30)
-                    completed_points += 1
+            drawing_started = time.monotonic()
+            finished = False
+            try:
+                self.initialize(blended)
 
-                self.sync()
-                x,y,z,rx,ry,rz = coords_list[-1]['x'], coords_list[-1]['y'], coords_list[-1]['z'], coords_list[-1]['rx'], coords_list[-1]['ry'], coords_list[-1]['rz']
-                self.servo_p_sync(x,y,z,rx,ry,rz)
+                completed_points = 0
+                resumed_at = None
+                failed_at = None
+                while self.checkpoint["path"] < path_count:
+                    coords_list = to_rows(paths[self.checkpoint["path"]])
+                    try:
+                        if failed_at is not None:
+                            # A recovery that fails counts as another attempt, like a failed stroke
+                            self.recover(coords_list, blended)
+                            self.recovery_stats["time_lost_s"] += time.monotonic() - failed_at + redrawn
+                            failed_at = None
+                        # Redraw a few points before the last one sent, which may not have been reached
+                        start = 0 if blended else max(0, self.checkpoint["point"] - self.resume_overlap)
+                        started = time.monotonic()
+                        timing = self.draw_stroke(coords_list, start, scheduler, blended, move_settle)
+                    except (RuntimeError, OSError) as e:
+                        if failed_at is None:
+                            failed_at = time.monotonic()
+                            # The part of the stroke that will be drawn again
+                            redrawn = (failed_at - started) if blended else self.resume_overlap / scheduler.rate_hz
+                        self.recovery_stats["errors"].append(str(e))
+                        if self.log: print(f"\nPath {self.checkpoint['path']} interrupted: {e}")
+                        if checkpoint_file: self.save_checkpoint(checkpoint_file)
+                        if self.recovery_stats["recoveries"] >= self.max_recoveries:
+                            raise e
+                        self.recovery_stats["recoveries"] += 1
+                        resumed_at = self.checkpoint["path"]
+                        continue
+                    completed_points += timing["points"]
+                    METRICS.observe("robot_path", time.monotonic() - started, motion="blended" if blended else "servo")
 
-                completed_paths += 1
-                if self.log:
-                    print(f"Progress: {completed_paths/path_count*100:.1f}% complete")
-            
+                    self.checkpoint = {"path": self.checkpoint["path"] + 1, "point": 0}
+                    if checkpoint_file: self.save_checkpoint(checkpoint_file)
+                    completed_paths = self.checkpoint["path"]
+                    if self.log and blended:
+                        print(f"Progress: {completed_paths/path_count*100:.1f}% complete")
+                    elif self.log:
+                        print(f"Progress: {completed_paths/path_count*100:.1f}% complete, "
+                              f"{timing['achieved_hz']:.1f}/{scheduler.rate_hz:.0f}Hz, max late {timing['max_lateness_ms']:.1f}ms")
+                    if resumed_at is not None and self.log:
+                        print(f"Resumed path {resumed_at} after recovery {self.recovery_stats['recoveries']}")
+                        resumed_at = None
+                finished = True
+            finally:
+                # Don't leave the blend ratio on for the servo moves of whoever uses the arm next,
+                # also when the drawing gave up (send_message doesn't raise on a dead connection)
+                if blended: self.set_cp(0)
+                # Failed drawings are exported too, their errors and recoveries are the interesting part
+                METRICS.observe("robot_draw", time.monotonic() - drawing_started,
+                                motion="blended" if blended else "servo", result="done" if finished else "failed")
+                self.export_metrics()
+            if self.log and self.channel is not None:
+                stats = self.command_stats()
+                print(f"Commands: {stats['replied']} at {stats['commands_per_s']:.1f}/s, mean RTT {stats['mean_rtt_ms']:.1f}ms")
+            if self.log and self.recovery_stats["recoveries"]:
+                print(f"Recovered {self.recovery_stats['recoveries']} times, {self.recovery_stats['time_lost_s']:.1f}s lost")
             return True, "Done"
             
         except KeyboardInterrupt as ki:
@@ -125,44 +345,43 @@ class Robot:
             self.close_connections()
             return False, str(e)
 
-    def run_bot_listener(self) -> Tuple[bool, Union[str, Exception]]:
-        res, zmq_tuple = self.setup_zmq()
+    def run_bot_listener(self, rate_hz: float = None) -> Tuple[bool, Union[str, Exception]]:
+        res, receiver = self.setup_zmq()
         if not res:
-            return False, zmq_tuple
-        self.zmq_context, self.zmq_socket = zmq_tuple
+            return False, receiver
+        self.receiver = receiver
         
         self.running = True
         self.enable_robot()
         self.clear_error()
         self.set_speed_factor(self.speed)
         self.set_user(self.user)
+        scheduler = StreamScheduler(rate_hz or self.servo_rate)
+        self.stream_timings = scheduler.timings
         
         # self.servo_p_sync(0,0,-30,0,0,0)
         try:
-            while self.running:
-                # Receive coordinates from ZMQ
-                print("waiting for ZMQ")
-                coords_list = self.zmq_socket.recv_json() #blocking
-                print(f"{len(coords_list)}")
-                print(f"coords_list type: {type(coords_list)}")
-                print(f"coords_list[0] type: {type(coords_list[0])}")
+            if self.log: print("waiting for ZMQ")
+            # (n, 3) x/y/z arrays from PathSender, blocking
+            for seq, path in self.receiver.paths():
+                coords_list = to_rows(path)
                 # MOVE TO FIRST POS AND PEN DOWN
-                x,y,z,rx,ry,rz = coords_list[0]['x'], coords_list[0]['y'], coords_list[0]['z'], coords_list[0]['rx'], coords_list[0]['ry'], coords_list[0]['rz']
-                self.servo_p_sync(x,y,z,rx,ry,rz)
-                x,y,z,rx,ry,rz = coords_list[1]['x'], coords_list[1]['y'], coords_list[1]['z'], coords_list[1]['rx'], coords_list[1]['ry'], coords_list[1]['rz']
-                self.servo_p_sync(x,y,z,rx,ry,rz)
+                x,y,z = coords_list[0]
+                self.servo_p_sync(x,y,z,0.0,0.0,0.0)
+                x,y,z = coords_list[1]
+                self.servo_p_sync(x,y,z,0.0,0.0,0.0)
 
-                # LOOP OVER MAIN DRAWING AT 30hz
-                for coords in coords_list[1:-1]:
-                    x,y,z,rx,ry,rz = coords['x'], coords['y'], coords['z'], coords['rx'], coords['ry'], coords['rz']
-                    self.servo_p(x,y,z,rx,ry,rz)
-                    time.sleep(1.0/30)
+                # LOOP OVER MAIN DRAWING AT servo_rate
+                scheduler.stream(coords_list[1:-1], self.draw_point)
 
                 self.sync()
                 # MOVE TO LAST POS AND PEN IP
                 self.sync()
-                x,y,z,rx,ry,rz = coords_list[-1]['x'], coords_list[-1]['y'], coords_list[-1]['z'], coords_list[-1]['rx'], coords_list[-1]['ry'], coords_list[-1]['rz']
-                self.servo_p_sync(x,y,z,rx,ry,rz)
+                x,y,z = coords_list[-1]
+                self.servo_p_sync(x,y,z,0.0,0.0,0.0)
+                # Drawn, the sender may send another path
+                self.receiver.ack(seq)
+                if not self.running: break
         except KeyboardInterrupt:
             if self.log: print("\nShutting down gracefully...")
             payload = True, "Shutting down gracefully"
@@ -192,21 +411,78 @@ class Robot:
     def set_user(self, user: int) -> Tuple[bool, Union[str, Exception]]:
         return self.send_message(f"User({user})")
     
+    def set_cp(self, ratio: int) -> Tuple[bool, Union[str, Exception]]:
+        """Continuous path blending ratio (0-100) for the following MovL/MovJ moves"""
+        return self.send_message(f"CP({ratio})")
+
     def get_robot_mode(self) -> Tuple[bool, Union[str, Exception]]:
         return self.send_message("RobotMode()")
     
-    def mov_l(self, x: float, y: float, z: float, rx: float, ry: float, rz: float) -> Tuple[bool, Union[str, Exception]]:
-        return self.send_message(f"MovL({x},{y},{z},{rx},{ry},{rz})")
+    def mov_l(self, x: float, y: float, z: float, rx: float, ry: float, rz: float, wait: bool = True) -> Tuple[bool, Union[str, Exception]]:
+        return self.send_message(f"MovL({x},{y},{z},{rx},{ry},{rz})", wait=wait)
     
+    def rel_mov_l_user(self, x: float, y: float, z: float, rx: float, ry: float, rz: float) -> Tuple[bool, Union[str, Exception]]:
+        """Linear move by an offset along the axes of the current user frame"""
+        return self.send_message(f"RelMovLUser({x},{y},{z},{rx},{ry},{rz},{self.user})")
+
     def mov_j(self, a: float, b: float, c: float, d: float, e: float, f: float) -> Tuple[bool, Union[str, Exception]]:
         return self.send_message(f"MovJ({a},{b},{c},{d},{e},{f})")
     
-    def servo_p(self, x: float, y: float, z: float, rx: float, ry: float, rz: float) -> Tuple[bool, Union[str, Exception]]:
-        return self.send_message(f"ServoP({x},{y},{z},{rx},{ry},{rz})")
+    def servo_p(self, x: float, y: float, z: float, rx: float, ry: float, rz: float, wait: bool = True) -> Tuple[bool, Union[str, Exception]]:
+        return self.send_message(f"ServoP({x},{y},{z},{rx},{ry},{rz})", wait=wait)
     
     def sync(self) -> Tuple[bool, Union[str, Exception]]:
         return self.send_message("Sync()")
 
+    def settle(self, x: float, y: float, z: float) -> Tuple[bool, Union[str, Exception]]:
+        """Wait for the last motion to reach (x, y, z), via feedback in "near" mode, otherwise Sync()"""
+        if self.settle_mode == "near" and self.feedback is not None and self.feedback.alive:
+            if self.feedback.wait_near((x, y, z), self.settle_tolerance, self.settle_timeout):
+                return True, "near"
+            if self.log: print(f"Not near ({x},{y},{z}) after {self.settle_timeout}s, falling back to Sync()")
+        return self.sync()
+
+    def servo_p_settle(self, x: float, y: float, z: float) -> Tuple[bool, Union[str, Exception]]:
+        self.servo_p(x, y, z, 0.0, 0.0, 0.0, wait=self.settle_mode != "near")
+        return self.settle(x, y, z)
+
+    def mov_l_settle(self, x: float, y: float, z: float) -> Tuple[bool, Union[str, Exception]]:
+        self.mov_l(x, y, z, 0.0, 0.0, 0.0, wait=self.settle_mode != "near")
+        return self.settle(x, y, z)
+
+    def get_feedback_state(self) -> dict:
+        """Pose, robot mode and queue flags from the real-time feedback port, empty without feedback"""
+        if self.feedback is None:
+            return {}
+        mode, mode_name = self.feedback.robot_mode()
+        pose = self.feedback.pose()
+        return {
+            "pose": None if pose is None else pose.tolist(),
+            "robot_mode": mode,
+            "robot_mode_name": mode_name,
+            "queue": self.feedback.queue_state(),
+            **self.feedback.stats(),
+        }
+
+    def command_stats(self) -> dict:
+        """Throughput and RTT histogram of the dashboard channel, empty when not pipelined"""
+        return self.channel.stats() if self.channel is not None else {}
+
+    def export_metrics(self) -> None:
+        """Hand the command channel's throughput, RTT histogram and recoveries so far to METRICS"""
+        stats = self.command_stats()
+        if stats:
+            METRICS.gauge("dobot_commands_per_second", stats["commands_per_s"])
+            METRICS.gauge("dobot_command_rtt_mean_seconds", stats["mean_rtt_ms"] / 1000)
+            METRICS.gauge("dobot_error_replies", stats["error_replies"])
+            METRICS.histogram("dobot_command_rtt_seconds", [edge / 1000 for edge in RTT_BUCKETS_MS],
+                              self.channel.rtt_counts, self.channel.rtt_total)
+        if self.recovery_stats["recoveries"]:
+            METRICS.count("robot_recoveries", self.recovery_stats["recoveries"])
+            METRICS.count("robot_recovery_seconds", self.recovery_stats["time_lost_s"])
+        if self.stream_timings:
+            METRICS.gauge("servo_max_lateness_seconds", max(t["max_lateness_ms"] for t in self.stream_timings) / 1000)
+
     def servo_p_sync(self, x: float, y: float, z: float, rx: float, ry: float, rz: float) -> Tuple[bool, Union[str, Exception]]:
         try:
             res, data = self.send_message(f"ServoP({x},{y},{z},{rx},{ry},{rz})")
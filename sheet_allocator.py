@@ -0,0 +1,284 @@
+import itertools
+import json
+import os
+import random
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# x, y, width, height in robot mm
+Rect = Tuple[float, float, float, float]
+
+
+class SheetFull(RuntimeError):
+    """No free rectangle on the sheet is large enough for the drawing"""
+
+
+def to_area(rect: Rect) -> Tuple[float, float, float, float]:
+    """Rect to the (min_x, max_x, min_y, max_y) drawing_area PathProcessor takes"""
+    x, y, w, h = rect
+    return (x, x + w, y, y + h)
+
+
+def edge(*values: float) -> Tuple[float, ...]:
+    """Dictionary key for a rectangle edge, rounded so x - margin + margin still finds x"""
+    return tuple(round(v, 6) for v in values)
+
+
+class _Node:
+    """Treap node for one free rectangle, ordered by (width, height, id) and heap ordered by priority"""
+    __slots__ = ("key", "rect", "priority", "left", "right", "max_h", "max_area")
+
+    def __init__(self, rect: Rect, rect_id: int):
+        _, _, w, h = rect
+        self.key = (w, h, rect_id)
+        self.rect = rect
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.max_h = h
+        self.max_area = w * h
+
+    def update(self) -> "_Node":
+        _, _, w, h = self.rect
+        self.max_h, self.max_area = h, w * h
+        for child in (self.left, self.right):
+            if child is not None:
+                self.max_h = max(self.max_h, child.max_h)
+                self.max_area = max(self.max_area, child.max_area)
+        return self
+
+
+def _split(node: Optional[_Node], key: tuple) -> Tuple[Optional[_Node], Optional[_Node]]:
+    """Nodes below key and nodes from key on"""
+    if node is None:
+        return None, None
+    if node.key < key:
+        node.right, right = _split(node.right, key)
+        return node.update(), right
+    left, node.left = _split(node.left, key)
+    return left, node.update()
+
+
+def _join(left: Optional[_Node], right: Optional[_Node]) -> Optional[_Node]:
+    """Join two treaps where every key in left is below every key in right"""
+    if left is None or right is None:
+        return left if left is not None else right
+    if left.priority > right.priority:
+        left.right = _join(left.right, right)
+        return left.update()
+    right.left = _join(left, right.left)
+    return right.update()
+
+
+def _find(node: Optional[_Node], width: float, height: float) -> Optional[_Node]:
+    """Narrowest free rectangle at least width x height, the shortest of those on a tie.
+
+    Subtrees entirely narrower than width are skipped by key and ones without a tall enough
+    rectangle by max_h, so this follows one root to leaf path plus one descent into a subtree
+    known to hold a match, O(log n) expected.
+    """
+    if node is None or node.max_h < height:
+        return None
+    if node.key[0] < width:
+        return _find(node.right, width, height)
+    found = _find(node.left, width, height)
+    if found is not None:
+        return found
+    if node.key[1] >= height:
+        return node
+    return _find(node.right, width, height)
+
+
+class SheetAllocator:
+    """Packs drawings onto one large sheet by their bounding boxes.
+
+    Free space is a set of disjoint rectangles indexed by a treap on (width, height) that also
+    tracks the tallest and the largest rectangle below each node. A drawing goes into the narrowest
+    free rectangle tall enough for it, at that rectangle's top left corner, and what is left of the
+    rectangle is cut in two along the longer leftover side (guillotine packing). Finding, adding and
+    removing a rectangle are O(log n) expected. Every drawing keeps margin mm clear on each side.
+    With state_file the sheet survives restarts, so a crash never draws over an earlier portrait,
+    and release() gives back the place of a drawing that never made it onto the paper, merged with
+    any free neighbour that shares a whole edge so the sheet doesn't fragment.
+
+    Safe to share between threads, e.g. allocating while vectorizing and releasing from the arms.
+    """
+
+    def __init__(self, sheet: Tuple[float, float, float, float] = (0, 360, 0, 500), margin: float = 5.0,
+                 state_file: str = None, log: bool = True):
+        self.sheet = tuple(sheet)
+        self.margin = margin
+        self.state_file = state_file
+        self.log = log
+        # allocate() and release() come from different pipeline and arm threads, and both save()
+        self.lock = threading.RLock()
+        self.ids = itertools.count()
+        self.root: Optional[_Node] = None
+        self.free: Dict[int, Rect] = {}
+        # Free rectangles by their left (x, y, h), right (x + w, y, h), top (x, y, w) and bottom
+        # (x, y + h, w) edge, to find the neighbours a released rectangle merges with
+        self.edges: Dict[str, Dict[Tuple[float, ...], int]] = {"left": {}, "right": {}, "top": {}, "bottom": {}}
+        self.placed: List[Rect] = []
+        if state_file and os.path.exists(state_file):
+            self.load(state_file)
+        else:
+            self.reset()
+
+    def reset(self) -> None:
+        """Start a fresh sheet"""
+        min_x, max_x, min_y, max_y = self.sheet
+        with self.lock:
+            self.clear()
+            self.add_free((min_x, min_y, max_x - min_x, max_y - min_y))
+            self.save()
+
+    def clear(self) -> None:
+        self.root = None
+        self.free = {}
+        for edges in self.edges.values():
+            edges.clear()
+        self.placed = []
+
+    def edge_keys(self, rect: Rect) -> Dict[str, Tuple[float, ...]]:
+        x, y, w, h = rect
+        return {"left": edge(x, y, h), "right": edge(x + w, y, h), "top": edge(x, y, w), "bottom": edge(x, y + h, w)}
+
+    def add_free(self, rect: Rect, merge: bool = False) -> None:
+        """Index a free rectangle, with merge first joined with the neighbours it shares a whole edge with"""
+        _, _, w, h = rect
+        if w <= 0 or h <= 0:
+            return
+        while merge:
+            x, y, w, h = rect
+            keys = self.edge_keys(rect)
+            # The neighbour's edge that touches each of ours, and the rectangle the two make together
+            for side, other, joined in (("right", "left", lambda o: (x, y, w + o[2], h)),
+                                        ("left", "right", lambda o: (o[0], y, w + o[2], h)),
+                                        ("bottom", "top", lambda o: (x, y, w, h + o[3])),
+                                        ("top", "bottom", lambda o: (x, o[1], w, h + o[3]))):
+                neighbour = self.edges[other].get(keys[side])
+                if neighbour is not None:
+                    rect = joined(self.remove_free(neighbour))
+                    break
+            else:
+                merge = False
+        rect_id = next(self.ids)
+        self.free[rect_id] = rect
+        for side, key in self.edge_keys(rect).items():
+            self.edges[side][key] = rect_id
+        node = _Node(rect, rect_id)
+        left, right = _split(self.root, node.key)
+        self.root = _join(_join(left, node), right)
+
+    def remove_free(self, rect_id: int) -> Rect:
+        rect = self.free.pop(rect_id)
+        for side, key in self.edge_keys(rect).items():
+            if self.edges[side].get(key) == rect_id:
+                del self.edges[side][key]
+        _, _, w, h = rect
+        left, rest = _split(self.root, (w, h, rect_id))
+        _, right = _split(rest, (w, h, rect_id + 1))
+        self.root = _join(left, right)
+        return rect
+
+    def fits(self, need_w: float, need_h: float) -> Optional[_Node]:
+        return _find(self.root, need_w, need_h)
+
+    def shrink_to_fit(self, width: float, height: float, min_scale: float) -> float:
+        """Largest scale from min_scale up to 1 at which a width x height drawing fits some free rectangle,
+        0 if it doesn't even at min_scale. Bisects on the scale, each step one O(log n) lookup."""
+        margin = 2 * self.margin
+        if self.fits(width * min_scale + margin, height * min_scale + margin) is None:
+            return 0.0
+        low, high = min_scale, 1.0
+        for _ in range(20):
+            scale = (low + high) / 2
+            if self.fits(width * scale + margin, height * scale + margin) is not None:
+                low = scale
+            else:
+                high = scale
+        return low
+
+    def allocate(self, width: float, height: float, min_scale: float = 1.0) -> Optional[Tuple[float, float, float, float]]:
+        """drawing_area for a width x height drawing, None when the sheet has no room left for it.
+
+        With min_scale below 1 a drawing that doesn't fit anywhere is shrunk, down to min_scale,
+        to fill the largest gap left, so the end of a sheet still takes smaller portraits.
+        """
+        width, height = float(width), float(height)
+        with self.lock:
+            node = self.fits(width + 2 * self.margin, height + 2 * self.margin)
+            if node is None and min_scale < 1:
+                scale = self.shrink_to_fit(width, height, min_scale)
+                if scale > 0:
+                    width, height = width * scale, height * scale
+                    node = self.fits(width + 2 * self.margin, height + 2 * self.margin)
+            if node is None:
+                if self.log: print(f"No room for {width:.0f}x{height:.0f}mm on the sheet, {len(self.placed)} drawings placed")
+                return None
+
+            need_w, need_h = width + 2 * self.margin, height + 2 * self.margin
+            x, y, w, h = self.remove_free(node.key[2])
+            # Cut along the longer leftover so the bigger remaining piece stays as large as possible
+            right_w, below_h = w - need_w, h - need_h
+            if right_w > below_h:
+                self.add_free((x + need_w, y, right_w, h))
+                self.add_free((x, y + need_h, need_w, below_h))
+            else:
+                self.add_free((x, y + need_h, w, below_h))
+                self.add_free((x + need_w, y, right_w, need_h))
+
+            rect = (x + self.margin, y + self.margin, width, height)
+            self.placed.append(rect)
+            self.save()
+            if self.log: print(f"Placed {width:.0f}x{height:.0f}mm at ({rect[0]:.0f}, {rect[1]:.0f}), {self.utilization():.0%} of the sheet used")
+            return to_area(rect)
+
+    def release(self, area: Tuple[float, float, float, float]) -> None:
+        """Give back an area that was never drawn, e.g. a portrait dropped when the pipeline stopped or one
+        whose drawing failed before the pen touched the paper"""
+        with self.lock:
+            for rect in self.placed:
+                if to_area(rect) == tuple(area):
+                    self.placed.remove(rect)
+                    x, y, w, h = rect
+                    self.add_free((x - self.margin, y - self.margin, w + 2 * self.margin, h + 2 * self.margin), merge=True)
+                    self.save()
+                    return
+
+    def utilization(self) -> float:
+        """Share of the sheet covered by placed drawings"""
+        min_x, max_x, min_y, max_y = self.sheet
+        with self.lock:
+            return float(sum(w * h for _, _, w, h in self.placed) / ((max_x - min_x) * (max_y - min_y)))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "placed": len(self.placed),
+                "free_rects": len(self.free),
+                "largest_free_mm2": float(self.root.max_area) if self.root is not None else 0.0,
+                "utilization": self.utilization(),
+            }
+
+    def save(self) -> None:
+        if not self.state_file:
+            return
+        with self.lock:
+            partial = f"{self.state_file}.part"
+            with open(partial, "w") as f:
+                json.dump({"sheet": self.sheet, "margin": self.margin, "placed": self.placed,
+                           "free": list(self.free.values())}, f)
+            os.replace(partial, self.state_file)
+
+    def load(self, state_file: str) -> None:
+        with open(state_file) as f:
+            state = json.load(f)
+        with self.lock:
+            self.clear()
+            self.sheet = tuple(state["sheet"])
+            self.margin = state["margin"]
+            self.placed = [tuple(rect) for rect in state["placed"]]
+            for rect in state["free"]:
+                self.add_free(tuple(rect))
+        if self.log: print(f"Continuing sheet from {state_file}, {len(self.placed)} drawings placed")
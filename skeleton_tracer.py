@@ -0,0 +1,150 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# 8-connected neighbour offsets as (dy, dx); offset k and 7 - k point in opposite directions
+OFFSETS = np.array([(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])
+OPPOSITE = 7 - np.arange(8)
+DIRECTION = {(dy, dx): k for k, (dy, dx) in enumerate(OFFSETS.tolist())}
+
+
+def pixel_graph(skeleton: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Pixel coordinates (n, 2) as x/y and an (n, 8) neighbour index table, -1 where there is no link.
+
+    A diagonal link is dropped when an orthogonal pixel already bridges the two pixels, so staircase
+    corners of the skeleton read as plain path pixels instead of tiny junctions.
+    """
+    ys, xs = np.nonzero(skeleton)
+    height, width = skeleton.shape[:2]
+    index = np.full((height + 2, width + 2), -1, dtype=np.int64)
+    index[ys + 1, xs + 1] = np.arange(len(ys))
+
+    neighbours = np.stack([index[ys + 1 + dy, xs + 1 + dx] for dy, dx in OFFSETS], axis=1)
+    for (dy, dx), k in DIRECTION.items():
+        if dy == 0 or dx == 0:
+            continue
+        bridged = (neighbours[:, DIRECTION[(dy, 0)]] >= 0) | (neighbours[:, DIRECTION[(0, dx)]] >= 0)
+        neighbours[bridged, k] = -1
+    return np.column_stack((xs, ys)), neighbours
+
+
+def drop_collinear(path: np.ndarray) -> np.ndarray:
+    """Keep only the points where a pixel chain changes direction, like CHAIN_APPROX_SIMPLE"""
+    if len(path) < 3:
+        return path
+    step = np.diff(path, axis=0)
+    turns = np.any(step[1:] != step[:-1], axis=1)
+    keep = np.concatenate(([True], turns, [True]))
+    return path[keep]
+
+
+class SkeletonTracer:
+    """Traces a one pixel wide skeleton into open polylines by walking pixel adjacency once.
+
+    Strokes are split at junctions and endpoints, then stroke ends meeting at a junction are joined
+    in pairs, straightest continuation first, so a line crossing a junction is drawn in one go.
+    """
+
+    def __init__(self, min_points: int = 2, direction_pixels: int = 5):
+        self.min_points = min_points
+        self.direction_pixels = direction_pixels
+
+    def strokes(self, neighbours: np.ndarray) -> List[List[int]]:
+        """Pixel index chains between nodes (pixels with other than two links), then the remaining cycles"""
+        degree = (neighbours >= 0).sum(axis=1)
+        visited = neighbours < 0
+        strokes = []
+
+        def walk(start: int, k: int) -> List[int]:
+            chain = [start]
+            current = start
+            while True:
+                following = neighbours[current, k]
+                visited[current, k] = True
+                visited[following, OPPOSITE[k]] = True
+                chain.append(following)
+                if following == start or degree[following] != 2:
+                    return chain
+                free = np.flatnonzero(~visited[following])
+                if len(free) == 0:
+                    return chain
+                current, k = following, free[0]
+
+        for node in np.flatnonzero(degree != 2):
+            for k in np.flatnonzero(~visited[node]):
+                if not visited[node, k]:
+                    strokes.append(walk(node, k))
+
+        # Whatever is left only has two-link pixels, i.e. closed loops
+        for pixel in np.flatnonzero(~visited.all(axis=1)):
+            free = np.flatnonzero(~visited[pixel])
+            if len(free):
+                strokes.append(walk(pixel, free[0]))
+        return strokes
+
+    def end_direction(self, xy: np.ndarray, chain: List[int], at_start: bool) -> np.ndarray:
+        """Unit vector pointing from a stroke end into the stroke"""
+        steps = min(self.direction_pixels, len(chain) - 1)
+        end, inner = (chain[0], chain[steps]) if at_start else (chain[-1], chain[-1 - steps])
+        direction = (xy[inner] - xy[end]).astype(np.float64)
+        norm = np.linalg.norm(direction)
+        return direction / norm if norm > 0 else direction
+
+    def join(self, xy: np.ndarray, strokes: List[List[int]]) -> List[List[int]]:
+        """Pair up stroke ends that meet at the same junction pixel and chain the pairs together"""
+        ends: Dict[int, List[Tuple[int, bool]]] = {}
+        for s, chain in enumerate(strokes):
+            if chain[0] == chain[-1]:
+                continue
+            ends.setdefault(chain[0], []).append((s, True))
+            ends.setdefault(chain[-1], []).append((s, False))
+
+        # link[(stroke, at_start)] = (other stroke, other at_start)
+        link: Dict[Tuple[int, bool], Tuple[int, bool]] = {}
+        for node, incident in ends.items():
+            if len(incident) < 2:
+                continue
+            directions = [self.end_direction(xy, strokes[s], at_start) for s, at_start in incident]
+            pairs = sorted((float(np.dot(directions[a], directions[b])), a, b)
+                           for a in range(len(incident)) for b in range(a + 1, len(incident))
+                           if incident[a][0] != incident[b][0])
+            used = set()
+            for _, a, b in pairs:
+                if a in used or b in used:
+                    continue
+                used.update((a, b))
+                link[incident[a]] = incident[b]
+                link[incident[b]] = incident[a]
+
+        joined = []
+        done = [False] * len(strokes)
+
+        def follow(s: int, forward: bool) -> List[int]:
+            chain = []
+            while not done[s]:
+                done[s] = True
+                part = strokes[s] if forward else strokes[s][::-1]
+                chain.extend(part if not chain else part[1:])
+                # Leave through the far end and continue with whatever is linked to it
+                partner = link.get((s, not forward))
+                if partner is None:
+                    break
+                s, forward = partner[0], partner[1]
+            return chain
+
+        # Start at free ends first so open chains are walked from one end, then close the loops
+        for s in range(len(strokes)):
+            if not done[s] and (s, True) not in link:
+                joined.append(follow(s, True))
+            elif not done[s] and (s, False) not in link:
+                joined.append(follow(s, False))
+        for s in range(len(strokes)):
+            if not done[s]:
+                joined.append(follow(s, True))
+        return joined
+
+    def trace(self, skeleton: np.ndarray) -> List[np.ndarray]:
+        """Open (n, 2) x/y pixel polylines covering every skeleton pixel once"""
+        xy, neighbours = pixel_graph(skeleton)
+        strokes = self.join(xy, self.strokes(neighbours))
+        return [drop_collinear(xy[chain]) for chain in strokes if len(chain) >= self.min_points]
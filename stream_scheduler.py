@@ -0,0 +1,70 @@
+import time
+from typing import Callable, Iterable, List, Sequence
+
+
+class StreamScheduler:
+    """Sends points on a fixed grid of monotonic deadlines instead of sleeping a period after each send.
+
+    Point i of a path is due at start + i * period, so time spent in the send (the blocking recv of
+    send_message) comes out of the next sleep instead of adding up over the path. When a send runs
+    more than max_lateness behind, the grid is re-anchored rather than bursting points to catch up,
+    which would make the arm speed up.
+    """
+
+    def __init__(self, rate_hz: float = 30.0, max_lateness: float = 0.5, spin_s: float = 0.001,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        if rate_hz <= 0:
+            raise ValueError("rate_hz must be positive")
+        self.rate_hz = rate_hz
+        self.period = 1.0 / rate_hz
+        # Fraction of a period a send may be late before the schedule slips
+        self.max_lateness = max_lateness
+        # Sleep until this close to a deadline, then spin, since sleep() can overshoot
+        self.spin_s = spin_s
+        self.clock = clock
+        self.sleep = sleep
+        self.timings: List[dict] = []
+
+    def wait_until(self, deadline: float) -> None:
+        remaining = deadline - self.clock()
+        if remaining > self.spin_s:
+            self.sleep(remaining - self.spin_s)
+        while self.clock() < deadline:
+            pass
+
+    def stream(self, points: Iterable[Sequence[float]], send: Callable[..., object]) -> dict:
+        """Call send(*point) for every point at the scheduled rate and record how closely it was kept"""
+        start = self.clock()
+        anchor, index = start, 0
+        lateness = []
+        slips = 0
+        sent_at = start
+        for point in points:
+            deadline = anchor + index * self.period
+            self.wait_until(deadline)
+            sent_at = self.clock()
+            send(*point)
+
+            late = sent_at - deadline
+            lateness.append(late)
+            index += 1
+            if late > self.max_lateness * self.period:
+                # Keep the spacing from here on rather than firing the backlog back to back
+                anchor, index = sent_at, 1
+                slips += 1
+
+        # Both spans run from the first send to the last one
+        count = len(lateness)
+        actual = sent_at - start
+        timing = {
+            "points": count,
+            "rate_hz": self.rate_hz,
+            "target_s": max(0, count - 1) * self.period,
+            "actual_s": actual,
+            "achieved_hz": (count - 1) / actual if actual > 0 else 0.0,
+            "mean_lateness_ms": sum(lateness) / count * 1000 if count else 0.0,
+            "max_lateness_ms": max(lateness) * 1000 if count else 0.0,
+            "slips": slips,
+        }
+        self.timings.append(timing)
+        return timing
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Optional
+
+
+class StylizeCache:
+    """Content addressed store of stylized images, kept in output/cache.
+
+    The key is a SHA-256 over the input image bytes and the workflow with its image input blanked
+    out (the uploaded filename says nothing about the content), so the same picture through the
+    same workflow parameters is only ever sent to the GPU once. Entries are files named by key;
+    a hit bumps the file's mtime, and once the directory is over max_bytes or max_entries the
+    least recently used files are deleted.
+    """
+
+    def __init__(self, directory: str = "output/cache", max_bytes: int = 512 * 1024 * 1024,
+                 max_entries: int = 1000, log: bool = True):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.log = log
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(image_bytes: bytes, prompt: dict, image_node: str = "5") -> str:
+        prompt = dict(prompt)
+        if image_node in prompt:
+            node = dict(prompt[image_node])
+            node["inputs"] = {**node.get("inputs", {}), "image": None}
+            prompt[image_node] = node
+        digest = hashlib.sha256(image_bytes)
+        digest.update(json.dumps(prompt, sort_keys=True, separators=(",", ":")).encode())
+        return digest.hexdigest()
+
+    def path(self, key: str, suffix: str = ".png") -> Path:
+        return self.directory / f"{key}{suffix}"
+
+    def get(self, key: str) -> Optional[Path]:
+        with self.lock:
+            for path in self.directory.glob(f"{key}.*"):
+                if path.suffix == ".part":
+                    continue
+                os.utime(path)
+                self.hits += 1
+                if self.log: print(f"Stylize cache hit {key[:12]}")
+                return path
+            self.misses += 1
+            return None
+
+    def put(self, key: str, result_path: Path) -> Path:
+        """Copy a finished result into the cache and evict down to the limits"""
+        path = self.path(key, Path(result_path).suffix or ".png")
+        with self.lock:
+            # Copy next to the final name first so a crash never leaves a truncated entry behind
+            partial = path.with_suffix(path.suffix + ".part")
+            shutil.copyfile(result_path, partial)
+            os.replace(partial, path)
+            self.evict()
+        return path
+
+    def entries(self) -> list:
+        """(mtime, size, path) of every entry, oldest first"""
+        entries = []
+        for path in self.directory.iterdir():
+            if path.suffix == ".part" or not path.is_file():
+                continue
+            stat = path.stat()
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self) -> None:
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        while entries and (total > self.max_bytes or len(entries) > self.max_entries):
+            _, size, path = entries.pop(0)
+            path.unlink(missing_ok=True)
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries = self.entries()
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,211 @@
+import argparse
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from path_array import PathArray, X, Y, Z, as_path_array
+
+
+class TrajectoryPlanner:
+    """Times the pen down part of every path from speed, acceleration and corner limits and resamples
+    it to one point per ServoP period.
+
+    PathProcessor spaces points by distance, so streaming them at a fixed rate ties the pen speed to
+    the spacing. With uniform 3 mm spacing that is ~90 mm/s everywhere, too fast through tight curls
+    and far slower than the arm can go on straights. Adaptive spacing already puts straights at
+    100-150 mm/s, but also starts and stops strokes at full speed, which the arm can't follow.
+    Here every vertex gets a speed limit, the lower of
+
+    - max_speed,
+    - the junction deviation limit for the angle the path turns there (as in grbl), which lets the
+      pen through a corner without leaving it by more than junction_deviation mm, and
+    - sqrt(max_accel * r) for the radius r of the curve through the vertex and its neighbours,
+      which keeps the sideways acceleration in a curve within max_accel,
+
+    paths start and end at rest, and a forward and a backward pass bring the limits down to what
+    max_accel can reach. Each segment then runs a trapezoid (accelerate, cruise, brake) between the
+    speeds at its ends, and the result is sampled every 1 / rate_hz seconds. Because the sideways
+    acceleration is bounded, so is the chord error of the resampled curve: max_accel / (8 rate_hz^2).
+    """
+
+    def __init__(self, max_speed: float = 250.0, max_accel: float = 2500.0, junction_deviation: float = 0.5,
+                 rate_hz: float = 30.0):
+        if max_speed <= 0 or max_accel <= 0 or rate_hz <= 0:
+            raise ValueError("max_speed, max_accel and rate_hz must be positive")
+        self.max_speed = max_speed
+        self.max_accel = max_accel
+        self.junction_deviation = junction_deviation
+        self.rate_hz = rate_hz
+
+    def speed_limits(self, paths: PathArray) -> Tuple[np.ndarray, np.ndarray]:
+        """Length of the segment after every drawing point and the speed it can be passed at, before
+        acceleration is taken into account. Both are 0 at the last drawing point of each path."""
+        xy, first, last = self.drawing_points(paths)
+        delta = np.diff(xy, axis=0)
+        lengths = np.zeros(len(xy))
+        lengths[:-1] = np.hypot(delta[:, 0], delta[:, 1])
+        lengths[last] = 0.0  # there is no segment from one path to the next
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            directions = delta / lengths[:-1, None]
+        directions[~np.isfinite(directions)] = 0.0
+        # cos of the turn at every vertex between two segments, 1 going straight on, -1 turning back
+        turn_cos = np.ones(len(xy))
+        turn_cos[1:-1] = np.clip(np.einsum("ij,ij->i", directions[:-1], directions[1:]), -1.0, 1.0)
+
+        limits = np.full(len(xy), self.max_speed ** 2)  # squared speeds from here on
+        half_angle_sin = np.sqrt((1 - turn_cos) / 2)  # sin(turn / 2)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # grbl's junction deviation, written with the turn instead of the angle between the segments
+            half_cos = np.sqrt((1 + turn_cos) / 2)
+            junction = self.max_accel * self.junction_deviation * half_cos / (1 - half_cos)
+            neighbours = np.minimum(np.concatenate(([0.0], lengths[:-1])), lengths)
+            curve = self.max_accel * neighbours / (2 * half_angle_sin)
+        limits = np.fmin(limits, np.where(turn_cos < 1, junction, np.inf))
+        limits = np.fmin(limits, np.where(half_angle_sin > 0, curve, np.inf))
+        limits[first] = 0.0
+        limits[last] = 0.0
+        return lengths, limits
+
+    def drawing_points(self, paths: PathArray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """x/y of the pen down points of all paths, and the index of every path's first and last one"""
+        drawing = np.ones(paths.total_points, dtype=bool)
+        drawing[paths.offsets[:-1]] = False
+        drawing[paths.offsets[1:] - 1] = False
+        xy = paths.points[drawing, :2].astype(np.float64)
+        counts = paths.lengths - 2
+        last = np.cumsum(counts) - 1
+        return xy, last - counts + 1, last
+
+    def profile(self, paths: PathArray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Segment lengths, speeds at every drawing point and the time each segment takes"""
+        lengths, limits = self.speed_limits(paths)
+        reach = 2 * self.max_accel * lengths
+        # v[i+1]^2 <= v[i]^2 + 2 a d[i] over a whole path at once: with c the running sum of 2 a d,
+        # v[i]^2 = c[i] + min over j <= i of (limit[j] - c[j]). Every path starts at a limit of 0, so
+        # points of earlier paths never give the minimum and all paths can go through in one pass
+        climb = np.concatenate(([0.0], np.cumsum(reach[:-1])))
+        forward = climb + np.minimum.accumulate(limits - climb)
+        # Same backwards, braking to 0 at the end of every path
+        fall = np.cumsum(reach[::-1])[::-1]
+        squared = np.minimum(forward, fall + np.minimum.accumulate((forward - fall)[::-1])[::-1])
+        speeds = np.sqrt(np.maximum(squared, 0.0))
+        return lengths, speeds, self.segment_times(lengths, speeds)
+
+    def segment_times(self, lengths: np.ndarray, speeds: np.ndarray) -> np.ndarray:
+        """Trapezoid time of every segment, from the speed at its start to the speed at the next point"""
+        v0, v1 = speeds, np.append(speeds[1:], 0.0)
+        peak, accel_s, cruise_s, brake_s = self.trapezoids(lengths, v0, v1)
+        return accel_s + cruise_s + brake_s
+
+    def trapezoids(self, lengths: np.ndarray, v0: np.ndarray, v1: np.ndarray) -> Tuple[np.ndarray, ...]:
+        a = self.max_accel
+        peak = np.minimum(self.max_speed, np.sqrt(a * lengths + (v0 ** 2 + v1 ** 2) / 2))
+        peak = np.maximum(peak, np.maximum(v0, v1))
+        accel_s, brake_s = (peak - v0) / a, (peak - v1) / a
+        cruise_mm = np.maximum(0.0, lengths - (2 * peak ** 2 - v0 ** 2 - v1 ** 2) / (2 * a))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cruise_s = np.where(peak > 0, cruise_mm / peak, 0.0)
+        return peak, accel_s, cruise_s, brake_s
+
+    def durations(self, paths: Union[PathArray, List[List[dict]]]) -> np.ndarray:
+        """Seconds of pen down drawing per path, the pen moves and Sync() stops around it are not included"""
+        paths = as_path_array(paths)
+        if len(paths) == 0:
+            return np.zeros(0)
+        _, _, times = self.profile(paths)
+        _, first, _ = self.drawing_points(paths)
+        return np.add.reduceat(times, first)
+
+    def sample_counts(self, paths: Union[PathArray, List[List[dict]]], rate_hz: float = None) -> np.ndarray:
+        """Drawing points per path after retime(), without resampling. DrawTimeModel charges one ServoP
+        period per drawing point, so retimed paths are costed exactly like the ones streamed as they are."""
+        rate_hz = rate_hz or self.rate_hz
+        return np.ceil(self.durations(paths) * rate_hz).astype(np.int64) + 1
+
+    def retime(self, paths: Union[PathArray, List[List[dict]]], rate_hz: float = None) -> PathArray:
+        """The same paths, pen up points kept, with the drawing points resampled one per 1 / rate_hz seconds"""
+        paths = as_path_array(paths)
+        rate_hz = rate_hz or self.rate_hz
+        if len(paths) == 0:
+            return paths
+        if np.any(paths.lengths < 3):
+            raise ValueError("every path needs a pen up point at both ends and at least one drawing point")
+        xy, first, last = self.drawing_points(paths)
+        lengths, speeds, times = self.profile(paths)
+
+        # Every path runs on its own clock, placed one after the other on a shared one so a single
+        # searchsorted finds the segment of every sample
+        clock = np.concatenate(([0.0], np.cumsum(times)))[:-1]
+        path_s = clock[last] - clock[first]
+        samples = np.ceil(path_s * rate_hz).astype(np.int64) + 1
+        sample_path = np.repeat(np.arange(len(paths)), samples)
+        sample_offsets = np.concatenate(([0], np.cumsum(samples)))
+        local = (np.arange(sample_offsets[-1]) - sample_offsets[sample_path]) / rate_hz
+        # The last sample of a path lands on its end point, not up to a period past it
+        local = np.minimum(local, path_s[sample_path])
+        at = clock[first][sample_path] + local
+        segment = np.clip(np.searchsorted(clock, at, side="right") - 1, first[sample_path], last[sample_path])
+
+        # Distance covered into the segment at the sample's time, along its trapezoid
+        v0, v1 = speeds[segment], np.where(segment < last[sample_path], speeds[np.minimum(segment + 1, len(speeds) - 1)], 0.0)
+        peak, accel_s, cruise_s, brake_s = self.trapezoids(lengths[segment], v0, v1)
+        t = at - clock[segment]
+        a = self.max_accel
+        t_accel = np.minimum(t, accel_s)
+        t_cruise = np.clip(t - accel_s, 0.0, cruise_s)
+        t_brake = np.clip(t - accel_s - cruise_s, 0.0, brake_s)
+        covered = (v0 * t_accel + a * t_accel ** 2 / 2 + peak * t_cruise + peak * t_brake - a * t_brake ** 2 / 2)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fraction = np.clip(np.where(lengths[segment] > 0, covered / lengths[segment], 0.0), 0.0, 1.0)
+        following = np.minimum(segment + 1, last[sample_path])
+        sampled = xy[segment] + (xy[following] - xy[segment]) * fraction[:, None]
+
+        # Put the pen up points back around every path, the drawing points keep their pen down z
+        offsets = sample_offsets + 2 * np.arange(len(paths) + 1)
+        points = np.empty((offsets[-1], 3), dtype=np.float32)
+        drawing = np.arange(len(sampled)) + 2 * sample_path + 1
+        points[drawing, X] = sampled[:, 0]
+        points[drawing, Y] = sampled[:, 1]
+        points[drawing, Z] = np.repeat(paths.points[paths.offsets[:-1] + 1, Z], samples)
+        starts, ends = offsets[:-1], offsets[1:] - 1
+        points[starts] = paths.points[paths.offsets[:-1]]
+        points[ends] = paths.points[paths.offsets[1:] - 1]
+        return PathArray(points, offsets)
+
+    def stats(self, paths: Union[PathArray, List[List[dict]]], rate_hz: float = None) -> dict:
+        """Drawing time of the paths streamed as they are at rate_hz against their retimed version, both
+        counted like DrawTimeModel's drawing_s: one period per drawing point"""
+        paths = as_path_array(paths)
+        rate_hz = rate_hz or self.rate_hz
+        lengths, speeds, times = self.profile(paths) if len(paths) else (np.zeros(0),) * 3
+        fixed_s = (paths.total_points - 2 * len(paths)) / rate_hz
+        retimed_s = float(self.sample_counts(paths, rate_hz).sum()) / rate_hz if len(paths) else 0.0
+        return {
+            "fixed_rate_s": fixed_s,
+            "retimed_s": retimed_s,
+            "speedup": fixed_s / retimed_s if retimed_s > 0 else 0.0,
+            "fixed_mean_speed_mm_s": float(lengths.sum()) / fixed_s if fixed_s > 0 else 0.0,
+            "mean_speed_mm_s": float(lengths.sum() / times.sum()) if times.sum() > 0 else 0.0,
+            "max_speed_mm_s": float(speeds.max()) if len(speeds) else 0.0,
+            "chord_error_mm": self.max_accel / (8 * rate_hz ** 2),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the fixed rate and retimed drawing time of .drawing files.")
+    parser.add_argument("files", type=str, nargs="+", help="Drawing files.")
+    parser.add_argument("--rate", type=float, default=30.0, help="ServoP rate in Hz.")
+    parser.add_argument("--speed", type=float, default=250.0, help="Top pen down speed in mm/s.")
+    parser.add_argument("--accel", type=float, default=2500.0, help="Acceleration limit in mm/s^2.")
+    parser.add_argument("--deviation", type=float, default=0.5, help="Junction deviation in mm.")
+
+    args = parser.parse_args()
+    from drawing_file import load_drawing
+
+    planner = TrajectoryPlanner(args.speed, args.accel, args.deviation, args.rate)
+    for filename in args.files:
+        paths, _ = load_drawing(filename, mmap=False)
+        stats = planner.stats(paths)
+        print(f"{filename}: {stats['fixed_rate_s']:.0f}s at a fixed rate, {stats['retimed_s']:.0f}s retimed "
+              f"({stats['speedup']:.2f}x), mean {stats['mean_speed_mm_s']:.0f}mm/s, top {stats['max_speed_mm_s']:.0f}mm/s")
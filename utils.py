@@ -1,5 +1,7 @@
 import matplotlib.pyplot as plt
-from typing import List
+from typing import List, Union
+
+from path_array import PathArray, as_path_array
 
 ROBOT_MODE = {
     1:	"ROBOT_MODE_INIT",
@@ -16,17 +18,16 @@ ROBOT_MODE = {
 }
 
 
-def visualize_paths(all_paths: List[List[List[dict]]], title: str = "All Paths Visualization") -> None:
+def visualize_paths(all_paths: List[Union[PathArray, List[List[dict]]]], title: str = "All Paths Visualization") -> None:
     """Visualize all paths on a single plot"""
     plt.figure(figsize=(10, 10))
 
     colors = ['k', 'r', 'y', 'g', 'b', 'm', 'c']
     for i, paths in enumerate(all_paths):
         color = colors[i % len(colors)]
-        for path in paths:
-            print(path)
-            x = [p["x"]+i*5  for p in path] 
-            y = [p["y"]+i*5 for p in path]
+        for path in as_path_array(paths):
+            x = path[:, 0] + i*5
+            y = path[:, 1] + i*5
             plt.plot(x, y, f'{color}-', linewidth=1)
             plt.plot(x, y, f'{color}.', markersize=2)
 